@@ -0,0 +1,323 @@
+import os
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .. import project_paths
+from ..rulesets_merge import http_cache
+from ..rulesets_merge import rulesets_merge_tools as tools
+from ..rulesets_merge.ip_ranges import optimize_ips
+from ..forked_rulesets_get import list2yaml
+from ..template_parts_merge import template_merge
+
+project_root = project_paths.PROJECT_ROOT
+
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_OUTPUT = os.path.join(project_paths.CACHE_DIR, 'benchmark', 'results.json')
+
+# ================= 合成数据 =================
+
+_TLDS = ('com', 'net', 'org', 'cn', 'io', 'co.uk', 'com.cn', 'jp')
+
+def _random_label(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(rng.randint(3, 10)))
+
+def _random_domain(rng, roots):
+    """约一半规则复用已有根域名生成子域名，使覆盖去重有实际工作量"""
+    if roots and rng.random() < 0.5:
+        base = rng.choice(roots)
+        return '.'.join(_random_label(rng) for _ in range(rng.randint(1, 2))) + '.' + base
+    root = f"{_random_label(rng)}.{rng.choice(_TLDS)}"
+    roots.append(root)
+    return root
+
+def _random_cidr(rng, v6_ratio=0.1):
+    if rng.random() < v6_ratio:
+        prefix = rng.choice((32, 40, 48, 56, 64))
+        groups = [f"{rng.randint(0x2000, 0x3fff):x}"] + [f"{rng.randint(0, 0xffff):x}" for _ in range(3)]
+        return f"{':'.join(groups)}::/{prefix}"
+    prefix = rng.choice((8, 12, 16, 20, 22, 24, 24, 24, 32))
+    return f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}/{prefix}"
+
+def generate_domain_lines(size, rng):
+    """domain 列表：完整域名、'+.' 与 '.' 前缀混合，含少量注释与重复"""
+    roots, lines = [], ['# synthetic domain ruleset', 'payload:']
+    for _ in range(size):
+        r = rng.random()
+        domain = _random_domain(rng, roots)
+        if r < 0.3:
+            domain = f"+.{domain}"
+        elif r < 0.35:
+            domain = f".{domain}"
+        lines.append(f"  - '{domain}'")
+    return lines
+
+def generate_ipcidr_lines(size, rng):
+    return ['# synthetic ipcidr ruleset', 'payload:'] + [f"  - '{_random_cidr(rng)}'" for _ in range(size)]
+
+def generate_classical_lines(size, rng):
+    """classical 列表：DOMAIN / DOMAIN-SUFFIX / IP-CIDR 为主，混入会被清洗或丢弃的规则类型"""
+    roots, lines = [], ['payload:']
+    for _ in range(size):
+        r = rng.random()
+        if r < 0.35:
+            lines.append(f"  - DOMAIN-SUFFIX,{_random_domain(rng, roots)}")
+        elif r < 0.65:
+            lines.append(f"  - DOMAIN,{_random_domain(rng, roots)}")
+        elif r < 0.85:
+            lines.append(f"  - IP-CIDR,{_random_cidr(rng)},no-resolve")
+        elif r < 0.92:
+            lines.append(f"  - DOMAIN-KEYWORD,{_random_label(rng)}")
+        elif r < 0.96:
+            lines.append(f"  - PROCESS-NAME,{_random_label(rng)}.exe")
+        else:
+            lines.append(f"  # {_random_label(rng)}")
+    return lines
+
+def generate_sources(size, seed):
+    """返回 {路径: 文本}，每种类型各一个规模为 size 的规则集"""
+    rng = random.Random(seed)
+    return {
+        '/classical.yaml': '\n'.join(generate_classical_lines(size, rng)),
+        '/domain.yaml': '\n'.join(generate_domain_lines(size, rng)),
+        '/ipcidr.yaml': '\n'.join(generate_ipcidr_lines(size, rng)),
+        '/domain.list': '\n'.join(l[5:-1] for l in generate_domain_lines(size, rng)[2:]),
+        '/ipcidr.list': '\n'.join(l[5:-1] for l in generate_ipcidr_lines(size, rng)[2:]),
+    }
+
+# ================= 本地 HTTP 服务 =================
+
+class _RulesetHandler(BaseHTTPRequestHandler):
+    """以内存中的规则集应答 GET，不返回 ETag / Last-Modified，保证每次都是完整下载"""
+    def do_GET(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@contextlib.contextmanager
+def serve_rulesets(files):
+    """在 127.0.0.1 的随机端口上提供 files，返回基础 URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RulesetHandler)
+    server.files = {path: text.encode('utf-8') for path, text in files.items()}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@contextlib.contextmanager
+def isolated_http_cache():
+    """运行期间下载缓存指向临时目录，避免基准测试读写项目缓存；结束后恢复并删除临时目录"""
+    saved = http_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory(prefix='bench_cache_') as cache_dir:
+        http_cache.CACHE_DIR = cache_dir
+        try:
+            yield cache_dir
+        finally:
+            http_cache.CACHE_DIR = saved
+
+# ================= 计时 =================
+
+def time_stage(func, repeat, quiet=True):
+    """执行 repeat 次，返回 (每次耗时列表, 最后一次的返回值)"""
+    timings, result = [], None
+    for _ in range(repeat):
+        sink = io.StringIO() if quiet else None
+        with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+    return timings, result
+
+def _record(results, suite, stage, size, timings, items_in=None, items_out=None):
+    entry = {
+        'suite': suite,
+        'stage': stage,
+        'size': size,
+        'best': min(timings),
+        'mean': sum(timings) / len(timings),
+        'runs': len(timings),
+    }
+    if items_in is not None:
+        entry['items_in'] = items_in
+    if items_out is not None:
+        entry['items_out'] = items_out
+    results.append(entry)
+    print(f"  {suite:<10} {stage:<18} size={size:<9} best={entry['best']:.4f}s mean={entry['mean']:.4f}s")
+
+def bench_merge(base_url, size, repeat, work_dir, results, quiet):
+    """merge_and_save_rulesets 各阶段：下载、清洗分类、域名优化、IP 聚合、写出，以及端到端"""
+    urls = [f"{base_url}/{name}" for name in ('classical.yaml', 'domain.yaml', 'ipcidr.yaml')]
+
+    timings, contents = time_stage(lambda: tools.fetch_all_rulesets(urls), repeat, quiet)
+    _record(results, 'merge', 'fetch', size, timings, items_in=len(urls))
+
+    def clean_and_classify():
+        dm_pool, ip_pool, count = set(), set(), 0
+        for url in urls:
+            for domains, ips, _ in tools.iter_classified_blocks(contents[url]):
+                count += len(domains) + len(ips)
+                dm_pool.update(domains)
+                ip_pool.update(ips)
+        return dm_pool, ip_pool, count
+    timings, (dm_pool, ip_pool, count) = time_stage(clean_and_classify, repeat, quiet)
+    _record(results, 'merge', 'clean_classify', size, timings, items_out=count)
+
+    timings, dm_list = time_stage(lambda: tools.optimize_domains(dm_pool), repeat, quiet)
+    _record(results, 'merge', 'optimize_domains', size, timings, len(dm_pool), len(dm_list))
+
+    timings, ip_list = time_stage(lambda: optimize_ips(ip_pool), repeat, quiet)
+    _record(results, 'merge', 'optimize_ips', size, timings, len(ip_pool), len(ip_list))
+
+    out_path = os.path.join(work_dir, 'write_bench.yaml')
+    timings, _ = time_stage(
+        lambda: tools.write_ruleset_file(out_path, 'domain', dm_list, len(dm_list), 'bench'), repeat, quiet)
+    _record(results, 'merge', 'write', size, timings, items_in=len(dm_list))
+
+    config = {
+        'Bench': {
+            'groupname': 'bench',
+            'rulesets': [{'name': os.path.basename(u), 'type': 'classical', 'url': u} for u in urls]
+        }
+    }
+    out_dir = os.path.join(work_dir, 'Generated_rulesets')
+    timings, info = time_stage(
+        lambda: tools.merge_and_save_rulesets(config, None, out_dir, force=True), repeat, quiet)
+    _record(results, 'merge', 'end_to_end', size, timings,
+            items_out=sum(v['rule_count'] for v in info.values()))
+
+def bench_list2yaml(base_url, size, repeat, work_dir, results, quiet):
+    """list2yaml.process_rulesets_yaml：domain 与 ipcidr 各一个源"""
+    config_dir = os.path.join(work_dir, 'Forked_rulesets')
+    os.makedirs(config_dir, exist_ok=True)
+    config_path = os.path.join(config_dir, 'forked_rulesets.yaml')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'bench_domain': {'name': 'bench_domain', 'type': 'domain', 'url': f"{base_url}/domain.list"},
+            'bench_ipcidr': {'name': 'bench_ipcidr', 'type': 'ipcidr', 'url': f"{base_url}/ipcidr.list"},
+        }, f)
+
+    # 每次运行前清空输出目录，避免“内容未变化时跳过写出”让后续轮次只测到跳过路径
+    output_dir = os.path.join(config_dir, 'Converted_rulesets')
+    def run():
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return list2yaml.process_rulesets_yaml(config_path)
+    timings, _ = time_stage(run, repeat, quiet)
+    _record(results, 'list2yaml', 'end_to_end', size, timings, items_in=2 * size)
+
+def bench_template(size, repeat, work_dir, results, quiet):
+    """template_merge.merge_template：以仓库现有片段为基础，rules 片段扩充到 size 行"""
+    parts_src = project_paths.PARTS_DIR
+    parts_dir = os.path.join(work_dir, 'Parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    for name in os.listdir(parts_src):
+        with open(os.path.join(parts_src, name), 'r', encoding='utf-8') as src:
+            text = src.read()
+        if name == 'rulespart_default.yaml':
+            rng = random.Random(size)
+            roots = []
+            extra = [f"  - DOMAIN-SUFFIX,{_random_domain(rng, roots)},DIRECT" for _ in range(size)]
+            text = text.rstrip('\n') + '\n' + '\n'.join(extra) + '\n'
+        with open(os.path.join(parts_dir, name), 'w', encoding='utf-8') as dst:
+            dst.write(text)
+
+    timings, _ = time_stage(
+        lambda: template_merge.merge_template('bench_template', parts_dir, 'default', 'default', 'default'),
+        repeat, quiet)
+    _record(results, 'template', 'merge_template', size, timings, items_in=size)
+
+# ================= 主流程 =================
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(old_path, new_report):
+    """按 (suite, stage, size) 对比两次结果的 best 耗时，打印比值"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    old_index = {(r['suite'], r['stage'], r['size']): r for r in old.get('results', [])}
+    print(f"\n对比基准: {old_path} (commit: {old.get('meta', {}).get('commit')})")
+    for r in new_report['results']:
+        prev = old_index.get((r['suite'], r['stage'], r['size']))
+        if not prev:
+            continue
+        ratio = r['best'] / prev['best'] if prev['best'] else float('inf')
+        print(f"  {r['suite']:<10} {r['stage']:<18} size={r['size']:<9} "
+              f"{prev['best']:.4f}s -> {r['best']:.4f}s (x{ratio:.2f})")
+
+def run_benchmarks(sizes, repeat=3, seed=0, suites=('merge', 'list2yaml', 'template'), quiet=True):
+    """生成各规模的合成规则集并依次运行各基准（下载缓存使用临时目录），返回结果报告（dict）"""
+    results = []
+    for size in sizes:
+        print(f"\n>>> 规模: {size} 行/源")
+        files = generate_sources(size, seed)
+        with tempfile.TemporaryDirectory(prefix='bench_work_') as work_dir, serve_rulesets(files) as base_url, \
+                isolated_http_cache():
+            if 'merge' in suites:
+                bench_merge(base_url, size, repeat, work_dir, results, quiet)
+            if 'list2yaml' in suites:
+                bench_list2yaml(base_url, size, repeat, work_dir, results, quiet)
+            if 'template' in suites:
+                bench_template(size, repeat, work_dir, results, quiet)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'generated_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="规则处理流程基准测试（合成数据 + 本地 HTTP 服务，无需外网）")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="每个源的规则行数，逗号分隔")
+    parser.add_argument('--repeat', type=int, default=3, help="每个阶段的重复次数，报告取最优与平均")
+    parser.add_argument('--seed', type=int, default=0, help="合成数据的随机种子")
+    parser.add_argument('--suites', default='merge,list2yaml,template', help="运行的基准组，逗号分隔")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="结果 JSON 输出路径")
+    parser.add_argument('--compare', help="与之前的结果 JSON 对比")
+    parser.add_argument('--verbose', action='store_true', help="显示被测函数自身的日志输出")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    suites = tuple(s.strip() for s in args.suites.split(',') if s.strip())
+    report = run_benchmarks(sizes, repeat=max(1, args.repeat), seed=args.seed, suites=suites, quiet=not args.verbose)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存至 {args.output}")
+
+    if args.compare:
+        compare_results(args.compare, report)
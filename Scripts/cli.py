@@ -0,0 +1,65 @@
+import sys
+import argparse
+import importlib
+
+# 子命令 -> (模块名, 说明)：模块在子命令实际执行时才导入，未使用的功能不付出导入开销
+COMMANDS = {
+    'merge': ('.rulesets_merge.manufacture', "合并上游规则并生成 Generated_rulesets（参数同 manufacture.py）"),
+    'fork': ('.forked_rulesets_get.list2yaml', "转换 forked 规则集为 Clash YAML（参数同 list2yaml.py）"),
+    'template': ('.template_parts_merge.template_merge', "组装模板并校验 rule-providers（参数同 template_merge.py）"),
+}
+
+def _load(command):
+    return importlib.import_module(COMMANDS[command][0], __package__)
+
+def run_all(argv=None):
+    """
+    在同一进程内依次执行 merge -> fork -> template：
+    解释器只启动一次，共用模块只导入一次；模板直接使用本次合并得到的 rulesets.json 内容，不再重新读取解析。
+    返回失败的模板数。
+    """
+    parser = argparse.ArgumentParser(prog='python -m Scripts.cli all', description="依次执行 merge、fork、template")
+    parser.add_argument('--jobs', type=int, default=1, help="并行处理规则组的进程数，0 表示使用全部 CPU 核心")
+    parser.add_argument('--mrs', action='store_true', help="规则集额外输出 .mrs 二进制格式（需要 zstandard）")
+    parser.add_argument('--force', action='store_true', help="忽略增量构建清单，重新生成全部规则组")
+    parser.add_argument('--fetch-budget', metavar='SECONDS', help="全部上游源下载的总时间预算（秒）")
+    parser.add_argument('--strict', action='store_true', help="模板校验时将警告视为错误")
+    args = parser.parse_args(argv)
+
+    merge_argv = ['--jobs', str(args.jobs)]
+    if args.mrs:
+        merge_argv.append('--mrs')
+    if args.force:
+        merge_argv.append('--force')
+    if args.fetch_budget:
+        merge_argv += ['--fetch-budget', args.fetch_budget]
+
+    print("\n========== merge ==========")
+    rulesets_info = _load('merge').main(merge_argv)
+    print("\n========== fork ==========")
+    _load('fork').main(['--mrs'] if args.mrs else [])
+    print("\n========== template ==========")
+    # 合并未产出任何规则集时（如配置无效）退回读取现有的 rulesets.json
+    return _load('template').main(['--strict'] if args.strict else [], rulesets_info=rulesets_info or None)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(
+        prog='python -m Scripts.cli', description="规则集与模板生成工具的统一入口",
+        epilog="子命令其余参数原样传给对应脚本，如: python -m Scripts.cli merge --jobs 0 --mrs")
+    choices = [*COMMANDS, 'all']
+    parser.add_argument('command', choices=choices,
+                        help="; ".join(f"{name}: {desc}" for name, (_, desc) in COMMANDS.items()) + "; all: 依次执行以上三步")
+    # 只解析子命令名，其余参数交给子命令自己的解析器（包括 -h）
+    if not argv or argv[0] not in choices:
+        parser.parse_args(argv[:1])
+    command, rest = argv[0], argv[1:]
+
+    if command == 'all':
+        return 1 if run_all(rest) else 0
+    result = _load(command).main(rest)
+    # template 返回失败的模板数
+    return 1 if command == 'template' and result else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,73 @@
 import os
-import sys
 import datetime
-import yaml
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 
-# 尝试导入 requests
-try:
-    import requests
-except ImportError:
-    requests = None
-    print("Warning: 'requests' library not found. URL downloading might be limited or fail. Please install it via 'pip install requests'.")
+if not __package__:
+    # 兼容直接以文件路径运行（python Scripts/forked_rulesets_get/list2yaml.py，以及 spawn 方式启动的子进程重新导入主模块）：
+    # 登记项目根目录并按 PEP 366 指定所属包，使包内相对导入可用
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    __package__ = 'Scripts.forked_rulesets_get'
+
+from .. import project_paths
+# 复用 rulesets_merge 中的下载缓存、YAML 解析与输出格式
+from ..rulesets_merge import fast_yaml, http_cache, mrs_format
+from ..rulesets_merge.ip_ranges import optimize_ips
+from ..rulesets_merge.ruleset_reader import RulesetReader
+
+_requests = None
+
+def get_requests():
+    """按需导入 requests（导入开销较大，只在第一次下载时导入）；未安装时返回 None"""
+    global _requests
+    if _requests is None:
+        try:
+            import requests
+        except ImportError:
+            print("Warning: 'requests' library not found. URL downloading might be limited or fail. Please install it via 'pip install requests'.")
+            requests = False
+        _requests = requests
+    return _requests or None
+
+# 并发下载的最大线程数
+DOWNLOAD_MAX_WORKERS = 8
+
+def decode_content(body):
+    """
+    解码下载内容：上游列表几乎都是 UTF-8，先按 UTF-8 严格解码；
+    失败时才对全文做编码探测（等同于 response.apparent_encoding，对大文件开销较高）；
+    未安装 chardet / charset_normalizer 时按 UTF-8 宽松解码（无法解码的字节替换为 U+FFFD）。
+    """
+    try:
+        return body.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    from requests.compat import chardet
+    if chardet is None:
+        return http_cache.decode_body(body, 'utf-8')
+    encoding = chardet.detect(body)['encoding'] or 'utf-8'
+    return http_cache.decode_body(body, encoding)
 
 def download_content(url):
-    """下载 URL 内容并返回行列表"""
+    """下载 URL 内容并返回行列表（条件请求，未变更时复用缓存）"""
+    requests = get_requests()
     if requests is None:
         print(f"[Error] 'requests' library is required to download: {url}")
         return []
     
     try:
         print(f"[*] Downloading: {url}")
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        response.encoding = response.apparent_encoding
-        return response.text.splitlines()
+        status_code, body, _ = http_cache.cached_get(requests, url, timeout=15)
+        if body is None:
+            raise RuntimeError(f"HTTP {status_code}")
+        if status_code == 304:
+            print(f"[Cache] Not modified: {url}")
+        return decode_content(body).splitlines()
     except Exception as e:
+        body, _ = http_cache.load_stale(url)
+        if body is not None:
+            print(f"[Warning] Failed to download {url}: {e}. Using cached copy.")
+            return decode_content(body).splitlines()
         print(f"[Error] Failed to download {url}: {e}")
         return []
 
@@ -37,27 +81,56 @@ def filter_content(content_lines):
         valid_payloads.append(line)
     return valid_payloads
 
-def save_to_yaml(name, rule_type, payloads, output_dir):
-    """将过滤后的内容保存为 Clash YAML 格式"""
+def payload_unchanged(output_path, payload_text):
+    """已有输出中 'payload:' 之后的内容是否与 payload_text 完全一致（mmap 直接比较）；文件不存在或格式不符时返回 False"""
+    try:
+        with RulesetReader(output_path) as reader:
+            return reader.payload_equals(payload_text.encode('utf-8'))
+    except (OSError, ValueError):
+        return False
+
+def save_to_yaml(name, rule_type, payloads, output_dir, mrs=False):
+    """
+    将过滤后的内容保存为 Clash YAML 格式（mrs=True 时额外输出同名 .mrs 二进制文件）。
+    mrs=False 时删除同名的旧 .mrs，避免其内容与新的 .yaml 不一致却仍被模板引用。
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
     output_path = os.path.join(output_dir, f"{name}.yaml")
+    mrs_path = os.path.join(output_dir, f"{name}.mrs")
     current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(f"# Generated: {current_time}\n")
-            f.write(f"# Type: {rule_type}\n")
-            f.write("payload:\n")
-            for payload in payloads:
-                # 按照用户要求：两个空格缩进，'- '前缀
-                f.write(f"  - '{payload}'\n")
-        print(f"[Success] Saved: {output_path} ({len(payloads)} rules)")
-    except Exception as e:
-        print(f"[Error] Failed to save {output_path}: {e}")
+    # 按照用户要求：两个空格缩进，'- '前缀
+    payload_text = "".join(f"  - '{payload}'\n" for payload in payloads)
+
+    if not mrs and os.path.exists(mrs_path):
+        os.remove(mrs_path)
+        print(f"[Cleanup] Removed stale: {mrs_path}")
+
+    if payload_unchanged(output_path, payload_text):
+        print(f"[Skip] Unchanged: {output_path} ({len(payloads)} rules)")
+        if not mrs or os.path.exists(mrs_path):
+            return
+    else:
+        try:
+            with open(output_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                f.write(f"# Generated: {current_time}\n# Type: {rule_type}\n# Rule Count: {len(payloads)}\npayload:\n")
+                f.write(payload_text)
+            print(f"[Success] Saved: {output_path} ({len(payloads)} rules)")
+        except Exception as e:
+            print(f"[Error] Failed to save {output_path}: {e}")
+            return
 
-def process_rulesets_yaml(input_yaml_path):
+    if mrs:
+        try:
+            if mrs_format.write_mrs(mrs_path, rule_type, payloads):
+                print(f"[Success] Saved: {mrs_path}")
+            else:
+                print("[Warning] 'zstandard' not installed, skip .mrs output. Please install it via 'pip install zstandard'.")
+        except Exception as e:
+            print(f"[Error] Failed to save {mrs_path}: {e}")
+
+def process_rulesets_yaml(input_yaml_path, mrs=False):
     """解析输入的 YAML 配置文件并批量处理规则集"""
     if not os.path.exists(input_yaml_path):
         print(f"[Error] Config file not found: {input_yaml_path}")
@@ -65,7 +138,7 @@ def process_rulesets_yaml(input_yaml_path):
 
     try:
         with open(input_yaml_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
+            config = fast_yaml.safe_load(f)
     except Exception as e:
         print(f"[Error] Failed to parse YAML config: {e}")
         return
@@ -77,6 +150,7 @@ def process_rulesets_yaml(input_yaml_path):
     # 输出目录为配置文件同级目录下的 Converted_rulesets
     output_dir = os.path.join(os.path.dirname(input_yaml_path), 'Converted_rulesets')
 
+    jobs = []
     for title, info in config.items():
         # 数据校验：title、name、type、url 缺一不可
         name = info.get('name')
@@ -92,23 +166,40 @@ def process_rulesets_yaml(input_yaml_path):
             print(f"[Skip] Invalid type '{rule_type}' in '{title}'. (Must be domain/ipcidr)")
             continue
 
+        jobs.append((name, rule_type, url))
+
+    # 并发下载（同一 URL 只下载一次），之后按配置顺序处理
+    urls = list(dict.fromkeys(url for _, _, url in jobs))
+    if not urls:
+        return
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_MAX_WORKERS, len(urls))) as executor:
+        downloaded = dict(zip(urls, executor.map(download_content, urls)))
+
+    for name, rule_type, url in jobs:
         # 处理
         print(f"[*] Processing ruleset: {name} ({rule_type})")
-        lines = download_content(url)
-        payloads = filter_content(lines)
+        payloads = filter_content(downloaded[url])
+        if rule_type == 'ipcidr':
+            count_before = len(payloads)
+            payloads = optimize_ips(payloads)
+            print(f"[*] CIDR aggregation: {count_before} -> {len(payloads)}")
         
         if payloads:
-            save_to_yaml(name, rule_type, payloads, output_dir)
+            save_to_yaml(name, rule_type, payloads, output_dir, mrs=mrs)
         else:
             print(f"[Warning] No valid rules found for {name}.")
 
-if __name__ == "__main__":
-    # 获取项目路径
-    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    project_root = os.path.dirname(current_dir)
-    default_config = os.path.join(project_root, 'SRC_rulesets', 'Forked_rulesets', 'forked_rulesets.yaml')
+def main(argv=None):
+    """命令行入口（也供 Scripts/cli.py 的 fork / all 子命令调用）"""
+    import argparse
 
-    target_config = sys.argv[1] if len(sys.argv) > 1 else default_config
+    parser = argparse.ArgumentParser(description="Convert forked rulesets to Clash YAML")
+    parser.add_argument('config', nargs='?', default=project_paths.FORKED_CONFIG, help="Forked rulesets config path")
+    parser.add_argument('--mrs', action='store_true', help="Also write mihomo .mrs binary rulesets (requires zstandard)")
+    args = parser.parse_args(argv)
     
-    print(f"[*] Starting process with config: {target_config}")
-    process_rulesets_yaml(target_config)
+    print(f"[*] Starting process with config: {args.config}")
+    process_rulesets_yaml(args.config, mrs=args.mrs)
+
+if __name__ == "__main__":
+    main()
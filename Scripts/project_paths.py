@@ -0,0 +1,15 @@
+import os
+
+# 项目目录约定：各脚本统一从这里取路径，不再各自推算项目根目录
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPTS_DIR)
+
+SRC_DIR = os.path.join(PROJECT_ROOT, 'SRC_rulesets')
+RULESETS_CONFIG = os.path.join(SRC_DIR, 'rulesets_src.yaml')
+FORKED_CONFIG = os.path.join(SRC_DIR, 'Forked_rulesets', 'forked_rulesets.yaml')
+CONVERTED_DIR = os.path.join(SRC_DIR, 'Forked_rulesets', 'Converted_rulesets')
+GENERATED_DIR = os.path.join(PROJECT_ROOT, 'Generated_rulesets')
+TEMPLATES_DIR = os.path.join(PROJECT_ROOT, 'Custom_templates')
+PARTS_DIR = os.path.join(TEMPLATES_DIR, 'Parts')
+TEMPLATES_CONFIG = os.path.join(SCRIPTS_DIR, 'template_parts_merge', 'templates.yaml')
+CACHE_DIR = os.path.join(PROJECT_ROOT, '.cache')
@@ -0,0 +1,138 @@
+import heapq
+
+# 域名池分块大小：每累积这么多条规则，就在块内去重排序并拼接为单个字符串保存
+POOL_CHUNK_SIZE = 1 << 16
+
+def domain_sort_keys(domains):
+    """
+    批量生成反转排序键（整体字符串操作，避免逐条 split/join）：
+    'www.Example.com' -> 'moc\x01elpmaxe\x01www\x003'
+    1. 每行前缀替换为类型序号：+. -> 0, . -> 1, *. -> 2, 完整域名 -> 3。
+    2. 整段文本反转后把 '.' 替换为 \x01（小于任何合法域名字符），
+       排序后一个域名的全部子域名紧跟其后，同一域名下 +. 规则最先出现。
+    """
+    if not domains:
+        return []
+    text = ('3\x00' + '\n3\x00'.join(domains)).lower()
+    text = text.replace('3\x00+.', '0\x00').replace('3\x00*.', '2\x00').replace('3\x00.', '1\x00')
+    keys = text[::-1].replace('.', '\x01').split('\n')
+    keys.reverse()
+    return keys
+
+def _iter_chunk(chunk):
+    """逐条切出块内记录，不一次性 split 出整块的列表"""
+    start = 0
+    while True:
+        end = chunk.find('\n', start)
+        if end < 0:
+            yield chunk[start:]
+            return
+        yield chunk[start:end]
+        start = end + 1
+
+class DomainPool:
+    """
+    紧凑的域名规则池：
+    1. 规则先暂存于有界的待处理列表，满 POOL_CHUNK_SIZE 条后批量生成排序键，
+       拼成 '排序键 + 原始规则' 的记录，块内去重排序后以 '\n' 连接为单个字符串保存。
+       每条规则只占其字符数加一个分隔符，不再为每条规则保留独立的 str 对象与集合槽位。
+    2. 优化时对各块做多路归并，逐条产出全局有序且去重的记录，供单次扫描使用。
+    记录形如 'moc\x01elpmaxe\x003Example.com'：排序键中不会出现前缀关系，
+    因此记录顺序即 (排序键, 原始规则) 顺序，大小写不同的同一规则中字典序最小者最先出现。
+    """
+    def __init__(self, chunk_size=POOL_CHUNK_SIZE):
+        self._chunk_size = chunk_size
+        self._pending = []
+        self._chunks = []
+        self.unique_count = None
+
+    def add(self, rule):
+        self._pending.append(rule)
+        if len(self._pending) >= self._chunk_size:
+            self._flush()
+
+    def update(self, rules):
+        """批量加入（整块 extend，不逐条调用 add）"""
+        self._pending.extend(rules)
+        if len(self._pending) >= self._chunk_size:
+            self._flush()
+
+    def __bool__(self):
+        return bool(self._pending or self._chunks)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        keys = domain_sort_keys(self._pending)
+        records = sorted(set(map(str.__add__, keys, self._pending)))
+        self._chunks.append('\n'.join(records))
+        self._pending = []
+
+    def iter_records(self):
+        """按记录顺序逐条产出，跨块的重复记录只产出一次"""
+        self._flush()
+        if len(self._chunks) == 1:
+            merged = _iter_chunk(self._chunks[0])
+        else:
+            merged = heapq.merge(*(_iter_chunk(c) for c in self._chunks))
+        prev = None
+        for record in merged:
+            if record != prev:
+                prev = record
+                yield record
+
+    def optimize(self):
+        """
+        域名去重核心逻辑（反转域名排序，单次扫描）：
+        1. 记录按反转排序键有序，每个域名的子域名连续排列在其后。
+        2. 扫描时维护祖先规则栈，覆盖关系如下，被覆盖的规则（含嵌套的 +.sub 规则）全部移除：
+           - '+.x' 覆盖 x 本身及全部子域名；
+           - '.x'  覆盖 x 的全部子域名（以及同级的 '*.x'）；
+           - '*.x' 仅覆盖 x 的一级子域名。
+        3. 仅大小写不同的重复规则保留字典序最小的一条，输出按原始字符串排序。
+        完成后释放池内数据。
+        """
+        kept = []
+        stack = []  # [(rev, rev + '\x01', kind)]，只保留当前域名自身或祖先的 +. / . / *. 规则
+        prev_key = None
+        unique_count = 0
+        for record in self.iter_records():
+            unique_count += 1
+            sep = record.index('\x00')
+            key = record[:sep + 2]
+            if key == prev_key:
+                continue
+            prev_key = key
+            rev, kind = record[:sep], record[sep + 1]
+
+            if stack:
+                while stack and rev != stack[-1][0] and not rev.startswith(stack[-1][1]):
+                    stack.pop()
+
+                covered = False
+                for base, _, base_kind in stack:
+                    if base_kind == '0':
+                        covered = True
+                    elif base_kind == '1':
+                        covered = base != rev or kind == '2'
+                    elif kind == '3':
+                        covered = rev.rpartition('\x01')[0] == base
+                    if covered:
+                        break
+                if covered:
+                    continue
+
+            kept.append(record[sep + 2:])
+            if kind != '3':
+                stack.append((rev, rev + '\x01', kind))
+
+        self._chunks = []
+        self.unique_count = unique_count
+        kept.sort()
+        return kept
+
+def optimize_domains(domain_list):
+    """域名去重：将任意可迭代的规则装入 DomainPool 后执行 DomainPool.optimize"""
+    pool = DomainPool()
+    pool.update(domain_list)
+    return pool.optimize()
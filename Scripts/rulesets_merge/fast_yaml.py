@@ -0,0 +1,28 @@
+# PyYAML 按需导入：只在第一次解析时加载，不使用 YAML 的入口不付出导入开销。
+# libyaml 可用时使用 C 实现的 CSafeLoader（构造规则与 yaml.safe_load 相同），否则回退到纯 Python 的 SafeLoader。
+_yaml = None
+
+def _module():
+    global _yaml
+    if _yaml is None:
+        import yaml
+        _yaml = yaml
+    return _yaml
+
+def safe_load(stream):
+    """与 yaml.safe_load 等价，可用时使用 CSafeLoader"""
+    yaml = _module()
+    return yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+def safe_dump(data, stream=None, **kwargs):
+    """与 yaml.safe_dump 相同（始终使用纯 Python 的 SafeDumper，保证输出格式不随 libyaml 是否安装而变化）"""
+    return _module().safe_dump(data, stream, **kwargs)
+
+def libyaml_available():
+    return hasattr(_module(), 'CSafeLoader')
+
+def __getattr__(name):
+    # fast_yaml.YAMLError 延迟解析为 yaml.YAMLError，仅在 except 子句实际求值时导入
+    if name == 'YAMLError':
+        return _module().YAMLError
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
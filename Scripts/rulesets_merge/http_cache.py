@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import hashlib
+
+from .. import project_paths
+
+# 缓存目录默认位于项目根目录下的 .cache/http，可通过环境变量覆盖
+CACHE_DIR = os.environ.get('RULESETS_CACHE_DIR') or os.path.join(project_paths.CACHE_DIR, 'http')
+
+# 网络失败时允许回退使用的旧缓存最大年龄（秒），默认 7 天
+CACHE_MAX_STALE = int(os.environ.get('RULESETS_CACHE_MAX_STALE', 7 * 24 * 3600))
+
+# 流式下载：每次读取的块大小，以及连接中断后使用 Range 续传的最大次数
+STREAM_CHUNK_SIZE = 1 << 16
+RESUME_MAX_ATTEMPTS = 3
+
+def _stream_errors():
+    """读取响应体期间连接中断（含内容长度不足）时抛出的异常；requests 由调用方导入，这里只在需要时引用"""
+    try:
+        import requests
+    except ImportError:
+        return (OSError,)
+    return (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+def _cache_paths(url, cache_dir=None):
+    """以 URL 的 sha256 作为缓存键，返回 (元数据路径, 内容路径)"""
+    cache_dir = cache_dir or CACHE_DIR
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{key}.json"), os.path.join(cache_dir, f"{key}.body")
+
+def _atomic_write(path, data):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def load_cache_entry(url, cache_dir=None):
+    """读取缓存，返回 (meta, body)；不存在或损坏时返回 (None, None)"""
+    meta_path, body_path = _cache_paths(url, cache_dir)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(body_path, 'rb') as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None, None
+    if meta.get('url') != url:
+        return None, None
+    return meta, body
+
+def store_cache_entry(url, body, etag=None, last_modified=None, encoding=None, cache_dir=None):
+    """写入缓存：先写内容再写元数据，保证元数据存在时内容完整"""
+    meta_path, body_path = _cache_paths(url, cache_dir)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    meta = {
+        'url': url,
+        'etag': etag,
+        'last_modified': last_modified,
+        'encoding': encoding,
+        'validated_at': time.time()
+    }
+    _atomic_write(body_path, body)
+    _atomic_write(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+def _touch_cache_entry(url, meta, cache_dir=None):
+    """304 命中时刷新校验时间"""
+    meta_path, _ = _cache_paths(url, cache_dir)
+    meta['validated_at'] = time.time()
+    try:
+        _atomic_write(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+    except OSError:
+        pass
+
+def _read_stream(session, url, response, timeout, deadline=None, resume_attempts=RESUME_MAX_ATTEMPTS):
+    """
+    流式读取 200 响应体，连接中断时尝试续传：
+    1. 仅当服务器声明 Accept-Ranges: bytes、响应未经内容编码且带有 ETag/Last-Modified 时允许续传，
+       续传请求携带 Range: bytes=<已接收>- 与 If-Range，保证拼接的是同一版本的内容。
+    2. 续传返回 206 时追加，返回 200（内容已变化或服务器忽略 Range）时丢弃已接收部分重新读取。
+    3. 超过 deadline（time.monotonic() 时间点）时抛出 TimeoutError。
+    返回 (body, 最近一次完整响应)，缓存元数据取自后者。
+    """
+    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+    resumable = (
+        validator is not None
+        and response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        and response.headers.get('Content-Encoding', 'identity').lower() == 'identity'
+    )
+    full_response = response
+    received = bytearray()
+    attempts = 0
+    stream_errors = _stream_errors()
+    while True:
+        try:
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                received += chunk
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"下载超出时间预算: {url}")
+            return bytes(received), full_response
+        except stream_errors:
+            response.close()
+            if not (resumable and received) or attempts >= resume_attempts:
+                raise
+            attempts += 1
+            print(f"  -> 连接中断，从 {len(received)} 字节处续传 ({attempts}/{resume_attempts}): {url}")
+            headers = {'Range': f"bytes={len(received)}-", 'If-Range': validator, 'Accept-Encoding': 'identity'}
+            response = session.get(url, timeout=timeout, headers=headers, stream=True)
+            if response.status_code == 200:
+                full_response = response
+                received.clear()
+            elif response.status_code != 206:
+                response.close()
+                raise
+
+def cached_get(session, url, timeout, cache_dir=None, deadline=None):
+    """
+    条件请求：
+    1. 有缓存时携带 If-None-Match / If-Modified-Since。
+    2. 304 -> 返回缓存内容；200 -> 流式读取（连接中断时按 Range 续传），更新缓存并返回新内容。
+    session 可以是 requests.Session 或 requests 模块本身；deadline 为 time.monotonic() 时间点，超过时放弃读取。
+    返回 (status_code, body, encoding)，非 200/304 时 body 为 None。
+    网络异常直接抛出，由调用方决定重试或回退。
+    """
+    meta, cached_body = load_cache_entry(url, cache_dir)
+    headers = {}
+    if meta:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response = session.get(url, timeout=timeout, headers=headers, stream=True)
+    if response.status_code == 304 and meta:
+        response.close()
+        _touch_cache_entry(url, meta, cache_dir)
+        return 304, cached_body, meta.get('encoding')
+    if response.status_code == 200:
+        body, response = _read_stream(session, url, response, timeout, deadline)
+        try:
+            store_cache_entry(
+                url, body,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                encoding=response.encoding,
+                cache_dir=cache_dir
+            )
+        except OSError as e:
+            print(f"  -> 写入缓存失败 {url}: {e}")
+        return 200, body, response.encoding
+    response.close()
+    return response.status_code, None, None
+
+def load_stale(url, max_stale=None, cache_dir=None):
+    """网络失败时的回退：返回 (body, encoding)，缓存超过 max_stale 秒则返回 (None, None)"""
+    max_stale = CACHE_MAX_STALE if max_stale is None else max_stale
+    meta, body = load_cache_entry(url, cache_dir)
+    if not meta:
+        return None, None
+    if time.time() - meta.get('validated_at', 0) > max_stale:
+        return None, None
+    return body, meta.get('encoding')
+
+def decode_body(body, encoding=None):
+    """按响应声明的编码解码（与 requests 的 response.text 行为一致），缺省为 utf-8"""
+    try:
+        return body.decode(encoding or 'utf-8', errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
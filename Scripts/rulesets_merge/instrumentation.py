@@ -0,0 +1,125 @@
+import sys
+import json
+import time
+import threading
+import contextlib
+
+# resource 仅在类 Unix 系统可用：Windows 下峰值内存记为 None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 结构化埋点：未启用时 emit / stage 不做任何记录
+# 事件为扁平字典，'event' 字段标明类型：fetch / clean / optimize / save / group
+_events = None
+_events_lock = threading.Lock()
+
+def enable():
+    global _events
+    with _events_lock:
+        if _events is None:
+            _events = []
+
+def enabled():
+    return _events is not None
+
+def emit(event, **fields):
+    """记录一条事件（未启用时忽略）"""
+    if _events is None:
+        return
+    record = {'event': event}
+    record.update(fields)
+    with _events_lock:
+        _events.append(record)
+
+def extend(events):
+    """合并来自子进程的事件"""
+    if _events is None or not events:
+        return
+    with _events_lock:
+        _events.extend(events)
+
+def drain():
+    """取出并清空已记录的事件"""
+    if _events is None:
+        return []
+    with _events_lock:
+        events = list(_events)
+        _events.clear()
+    return events
+
+@contextlib.contextmanager
+def stage(event, **fields):
+    """
+    计时上下文：退出时记录一条带 seconds 字段的事件。
+    产出的字典可在块内补充字段（如 items_out），未启用时同样可写但不会被记录。
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        if _events is not None:
+            emit(event, seconds=round(time.perf_counter() - start, 6), **fields)
+
+def peak_memory_mb():
+    """当前进程的峰值常驻内存 (MB)；Linux 下 ru_maxrss 单位为 KB，macOS 为字节"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+def write_jsonl(events, file_path):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for record in events:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _format_table(headers, rows):
+    widths = [max(len(str(v)) for v in column) for column in zip(headers, *rows)]
+    lines = ["  ".join(str(v).ljust(w) for v, w in zip(headers, widths))]
+    lines.append("  ".join('-' * w for w in widths))
+    lines.extend("  ".join(str(v).ljust(w) for v, w in zip(row, widths)) for row in rows)
+    return "\n".join(lines)
+
+def format_summary(events):
+    """汇总为两张表：上游源下载情况、各规则组分阶段耗时与规则数量"""
+    fetch_rows = [
+        (e['url'], e['status'], e['bytes'], e['retries'], f"{e['seconds']:.3f}")
+        for e in events if e['event'] == 'fetch'
+    ]
+
+    groups = {}
+    for e in events:
+        if e['event'] in ('clean', 'optimize', 'save', 'group'):
+            groups.setdefault(e['group'], []).append(e)
+
+    group_rows = []
+    for group, group_events in groups.items():
+        def seconds(kind):
+            return sum(e['seconds'] for e in group_events if e['event'] == kind)
+        clean = [e for e in group_events if e['event'] == 'clean']
+        optimized = [e for e in group_events if e['event'] == 'optimize']
+        total = next((e for e in group_events if e['event'] == 'group'), {})
+        group_rows.append((
+            group,
+            sum(e['lines_in'] for e in clean),
+            sum(e['rules_out'] for e in clean),
+            sum(e['items_out'] for e in optimized),
+            f"{seconds('clean'):.3f}",
+            f"{seconds('optimize'):.3f}",
+            f"{seconds('save'):.3f}",
+            f"{total.get('seconds', 0):.3f}",
+            total.get('peak_rss_mb'),
+        ))
+
+    parts = []
+    if fetch_rows:
+        parts.append(_format_table(('url', 'status', 'bytes', 'retries', 'seconds'), fetch_rows))
+    if group_rows:
+        parts.append(_format_table(
+            ('group', 'lines_in', 'rules', 'rules_out', 'clean_s', 'optimize_s', 'save_s', 'total_s', 'peak_mb'),
+            group_rows
+        ))
+    return "\n\n".join(parts)
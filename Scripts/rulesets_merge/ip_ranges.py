@@ -0,0 +1,87 @@
+import socket
+
+# 地址族 -> (socket 常量, 位数)
+_FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+def parse_ip_range(rule):
+    """
+    将 IP / CIDR 字符串解析为整数区间：
+    '1.2.3.4' -> (4, start, end)，'10.0.0.1/8' -> 主机位归零后的 (4, 10.0.0.0, 10.255.255.255)
+    无法解析时返回 None。
+    """
+    addr, sep, prefix = rule.strip().partition('/')
+    version = 6 if ':' in addr else 4
+    family, bits = _FAMILIES[version]
+    try:
+        value = int.from_bytes(socket.inet_pton(family, addr), 'big')
+        prefix_len = int(prefix) if sep else bits
+    except (OSError, ValueError):
+        return None
+    if not 0 <= prefix_len <= bits:
+        return None
+    host_mask = (1 << (bits - prefix_len)) - 1
+    start = value & ~host_mask
+    return version, start, start | host_mask
+
+def merge_ip_ranges(ip_list):
+    """
+    区间合并：
+    1. 解析全部规则，按地址族分组。
+    2. 排序后合并重叠与相邻区间。
+    返回 ({4: [(start, end), ...], 6: [...]}, 无法解析的规则列表)。
+    """
+    buckets = {4: [], 6: []}
+    invalid = []
+    for rule in ip_list:
+        parsed = parse_ip_range(rule)
+        if parsed is None:
+            invalid.append(rule)
+            continue
+        version, start, end = parsed
+        buckets[version].append((start, end))
+
+    merged = {}
+    for version, ranges in buckets.items():
+        ranges.sort()
+        result = []
+        for start, end in ranges:
+            if result and start <= result[-1][1] + 1:
+                if end > result[-1][1]:
+                    result[-1] = (result[-1][0], end)
+            else:
+                result.append((start, end))
+        merged[version] = result
+    return merged, invalid
+
+def range_to_cidrs(start, end, version):
+    """将整数区间拆分为最少数量的 CIDR，返回 [(network_int, prefix_len), ...]"""
+    bits = _FAMILIES[version][1]
+    cidrs = []
+    while start <= end:
+        # 起始地址的对齐块大小与剩余区间长度取较小者
+        align = (start & -start).bit_length() - 1 if start else bits
+        span = (end - start + 1).bit_length() - 1
+        size = min(align, span)
+        cidrs.append((start, bits - size))
+        start += 1 << size
+    return cidrs
+
+def format_cidr(network, prefix_len, version):
+    family, bits = _FAMILIES[version]
+    return f"{socket.inet_ntop(family, network.to_bytes(bits // 8, 'big'))}/{prefix_len}"
+
+def optimize_ips(ip_list):
+    """
+    IP 规则优化：归一化主机位、合并重叠与相邻网段、输出最少 CIDR。
+    按数值排序输出，IPv4 在前、IPv6 在后；无法解析的规则被丢弃。
+    """
+    merged, invalid = merge_ip_ranges(ip_list)
+    if invalid:
+        print(f"  -> 丢弃无法解析的 IP 规则 {len(invalid)} 条 (如: {invalid[0]})")
+
+    final_ips = []
+    for version in (4, 6):
+        for start, end in merged[version]:
+            for network, prefix_len in range_to_cidrs(start, end, version):
+                final_ips.append(format_cidr(network, prefix_len, version))
+    return final_ips
@@ -1,61 +1,168 @@
 import os
-import sys
 
-# 确保脚本可以导入同级目录下的工具模块
-current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-if current_dir not in sys.path:
-    sys.path.append(current_dir)
+if not __package__:
+    # 兼容直接以文件路径运行（python Scripts/rulesets_merge/manufacture.py，以及 spawn 方式启动的子进程重新导入主模块）：
+    # 登记项目根目录并按 PEP 366 指定所属包，使包内相对导入可用
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    __package__ = 'Scripts.rulesets_merge'
 
-from rulesets_merge_tools import parse_rulesets_yaml, merge_and_save_rulesets
+from .. import project_paths
+from . import fast_yaml
+from .rulesets_merge_tools import parse_rulesets_yaml, merge_and_save_rulesets, merge_and_save_batch
+from . import instrumentation
 
-def run_manufacture(config_path):
+def find_supply_folders(src_dir):
+    """检索目录中以 Supply_ 开头的全部补丁目录（按名称排序）"""
+    return [
+        os.path.join(src_dir, d)
+        for d in sorted(os.listdir(src_dir))
+        if os.path.isdir(os.path.join(src_dir, d)) and d.startswith('Supply_')
+    ]
+
+def run_manufacture(config_path, force=False, jobs=1, mrs=False, shard_size=0, fetch_budget=None, rendered=None):
     """
     主控流程：
     1. 解析主配置
     2. 自动检索同级 Supply_ 文件夹
-    3. 调用合并保存工具
+    3. 调用合并保存工具（force=True 时忽略增量构建清单，全量重建；jobs > 1 时多进程并行处理规则组；mrs=True 时额外输出 .mrs 二进制规则集；shard_size > 0 时为未单独配置的规则组启用分片输出；fetch_budget 为全部下载的总时间预算（秒））
+    rendered 给出时（字典）由 merge_and_save_rulesets 填入本次写出的文件内容。
+    返回 (输出目录, rulesets.json 内容)；配置无效时输出信息为空字典。
     """
+    project_root = project_paths.PROJECT_ROOT
+    output_dir = project_paths.GENERATED_DIR
     if not os.path.exists(config_path):
         print(f"错误: 配置文件 {config_path} 不存在。")
-        return
+        return output_dir, {}
 
     # 1. 解析主配置文件
     print(f"\n>>> 步骤 1: 解析主配置文件 {os.path.basename(config_path)}")
     parsed_main = parse_rulesets_yaml(config_path)
     if not parsed_main:
         print("未发现有效规则组，停止。")
-        return
+        return output_dir, {}
 
-    # 2. 自动检索同级目录中以 Supply_ 开头的目录
-    src_dir = os.path.dirname(config_path)
-    supply_folders = [
-        os.path.join(src_dir, d) 
-        for d in os.listdir(src_dir) 
-        if os.path.isdir(os.path.join(src_dir, d)) and d.startswith('Supply_')
-    ]
-    
-    # 目前 merge_and_save_rulesets 仅支持传入单个路径，我们传入第一个发现的有效路径
-    # 如果有多个，可以在此处扩展循环，但通常结构为单补丁库。
-    supply_folder = supply_folders[0] if supply_folders else None
-    if supply_folder:
-        print(f">>> 发现补丁目录: {os.path.basename(supply_folder)}")
+    # 2. 自动检索同级目录中以 Supply_ 开头的目录（全部合并使用）
+    supply_folders = find_supply_folders(os.path.dirname(config_path))
+    if supply_folders:
+        print(f">>> 发现补丁目录: {', '.join(os.path.basename(d) for d in supply_folders)}")
     else:
         print(">>> 未发现以 Supply_ 开头的补丁目录，将仅处理主配置规则。")
 
-    # 3. 确定最终输出目录（项目根目录下的 Generated_rulesets）
-    # 假设 Scripts 文件夹位于项目根目录下
-    project_root = os.path.dirname(current_dir)
-    output_dir = os.path.join(project_root, 'Generated_rulesets')
-
+    # 3. 最终输出目录为项目根目录下的 Generated_rulesets（假设 Scripts 文件夹位于项目根目录下）
     print(f"\n>>> 步骤 2: 开始执行合并与转换 (输出至: {os.path.relpath(output_dir, project_root)})")
-    merge_and_save_rulesets(parsed_main, supply_folder, output_dir)
+    output_info = merge_and_save_rulesets(parsed_main, supply_folders, output_dir, force=force, jobs=jobs, mrs=mrs, shard_size=shard_size, fetch_budget=fetch_budget,
+                                          rendered=rendered)
+    return output_dir, output_info
+
+def load_batch_config(batch_path):
+    """
+    读取批量构建配置：{名称: {config, supply, output}}，相对路径以批量配置文件所在目录为基准。
+    supply 省略时使用 config 同级的全部 Supply_ 目录；output 省略时为项目根目录下的 Generated_rulesets_<名称>。
+    返回 [{'name', 'config', 'supply', 'output_dir'}]。
+    """
+    with open(batch_path, 'r', encoding='utf-8') as f:
+        data = fast_yaml.safe_load(f) or {}
+    if not isinstance(data, dict):
+        raise ValueError(f"批量构建配置 '{batch_path}' 格式错误，应为 名称 -> {{config, supply, output}} 的映射。")
+
+    base_dir = os.path.dirname(os.path.abspath(batch_path))
+    project_root = project_paths.PROJECT_ROOT
+    resolve = lambda path: os.path.normpath(os.path.join(base_dir, path))
+    entries = []
+    for name, entry in data.items():
+        if not isinstance(entry, dict) or not entry.get('config'):
+            raise ValueError(f"批量构建配置中 '{name}' 缺少 config。")
+        config_path = resolve(entry['config'])
+        supply = entry.get('supply')
+        if supply is None:
+            supply_folders = find_supply_folders(os.path.dirname(config_path))
+        else:
+            supply_folders = [resolve(d) for d in ([supply] if isinstance(supply, str) else supply)]
+        output = entry.get('output')
+        output_dir = resolve(output) if output else os.path.join(project_root, f"Generated_rulesets_{name}")
+        entries.append({'name': str(name), 'config': config_path, 'supply': supply_folders, 'output_dir': output_dir})
+    return entries
+
+def run_batch(batch_path, force=False, jobs=1, mrs=False, shard_size=0, fetch_budget=None):
+    """
+    批量构建：解析批量配置中的每份主配置后统一调用 merge_and_save_batch，
+    相同的上游源只下载、清洗一次，分别写出各配置的输出目录。
+    返回 {名称: (输出目录, rulesets.json 内容)}。
+    """
+    builds = []
+    print(f"\n>>> 步骤 1: 解析批量配置 {os.path.basename(batch_path)}")
+    for entry in load_batch_config(batch_path):
+        print(f"\n>>> 配置 {entry['name']}: {entry['config']}")
+        if not os.path.exists(entry['config']):
+            print(f"错误: 配置文件 {entry['config']} 不存在，跳过。")
+            continue
+        parsed = parse_rulesets_yaml(entry['config'])
+        if not parsed:
+            print("未发现有效规则组，跳过。")
+            continue
+        builds.append(dict(entry, base_results=parsed))
+    if not builds:
+        print("没有可构建的配置，停止。")
+        return {}
+
+    print(f"\n>>> 步骤 2: 批量合并与转换 ({len(builds)} 份配置)")
+    results = merge_and_save_batch(builds, force=force, jobs=jobs, mrs=mrs, shard_size=shard_size, fetch_budget=fetch_budget)
+    return {build['name']: (build['output_dir'], results[build['name']]) for build in builds}
+
+def main(argv=None):
+    """
+    命令行入口（也供 Scripts/cli.py 的 merge / all 子命令调用）。
+    返回 rulesets.json 内容；批量构建时返回 {名称: rulesets.json 内容}。
+    """
+    import argparse
+
+    # 允许从命令行传入路径，否则使用默认：项目根目录/SRC_rulesets/rulesets_src.yaml
+    parser = argparse.ArgumentParser(description="合并上游规则并生成 Generated_rulesets")
+    parser.add_argument('config', nargs='?', default=project_paths.RULESETS_CONFIG, help="主配置文件路径")
+    parser.add_argument('--batch', metavar='PATH', help="批量构建配置（多份主配置及其补丁目录、输出目录），给出时忽略 config 参数")
+    parser.add_argument('--force', action='store_true', help="忽略增量构建清单，重新生成全部规则组")
+    parser.add_argument('--jobs', type=int, default=1, help="并行处理规则组的进程数，0 表示使用全部 CPU 核心")
+    parser.add_argument('--mrs', action='store_true', help="为 domain/ipcidr 规则集额外输出 mihomo .mrs 二进制格式（需要 zstandard）")
+    parser.add_argument('--shard-size', type=int, default=0, metavar='N',
+                        help="domain/ipcidr 输出超过 N 条时按稳定哈希拆分为分片（规则组可在配置中以 shard_size 单独指定），0 表示关闭")
+    parser.add_argument('--fetch-budget', type=float, default=None, metavar='SECONDS',
+                        help="全部上游源下载的总时间预算（秒），超出后未完成的源回退到旧缓存；默认不限制")
+    parser.add_argument('--metrics', metavar='PATH', help="记录各上游源与各规则组的分阶段埋点，写为 JSON lines 并打印汇总表")
+    parser.add_argument('--profile', metavar='PATH', nargs='?', const=os.path.join(project_paths.CACHE_DIR, 'manufacture.prof'),
+                        help="使用 cProfile 运行并保存统计文件（仅覆盖主进程），同时开启汇总表")
+    args = parser.parse_args(argv)
+
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    if args.metrics or args.profile:
+        instrumentation.enable()
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    build_kwargs = {'force': args.force, 'jobs': jobs, 'mrs': args.mrs, 'shard_size': args.shard_size, 'fetch_budget': args.fetch_budget}
+    if args.batch:
+        results = {name: info for name, (_, info) in run_batch(args.batch, **build_kwargs).items()}
+    else:
+        _, results = run_manufacture(args.config, **build_kwargs)
+    if profiler:
+        import pstats
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(args.profile)), exist_ok=True)
+        profiler.dump_stats(args.profile)
+        print(f"\n>>> cProfile 统计已保存至 {args.profile}（按累计耗时前 25 项）")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    if instrumentation.enabled():
+        events = instrumentation.drain()
+        if args.metrics:
+            instrumentation.write_jsonl(events, args.metrics)
+            print(f"\n>>> 埋点数据已保存至 {args.metrics}（{len(events)} 条）")
+        print("\n>>> 分阶段统计")
+        print(instrumentation.format_summary(events))
+    return results
 
 if __name__ == "__main__":
-    # 默认路径：项目根目录/SRC_rulesets/rulesets_src.yaml
-    project_root = os.path.dirname(current_dir)
-    default_config = os.path.join(project_root, 'SRC_rulesets', 'rulesets_src.yaml')
-    
-    # 允许从命令行传入路径，否则使用默认
-    target_config = sys.argv[1] if len(sys.argv) > 1 else default_config
-    
-    run_manufacture(target_config)
+    main()
@@ -0,0 +1,186 @@
+import io
+import struct
+
+from .ip_ranges import merge_ip_ranges, range_to_cidrs, format_cidr
+
+# zstandard 为可选依赖：未安装时跳过 .mrs 输出
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# mihomo 二进制规则集 (MRS v1) 布局，整体经 zstd 压缩：
+#   'MRS' 0x01 | behavior(1B) | count(int64) | extra_len(int64) | extra | 规则数据
+# domain 规则数据为简洁字典树 (succinct set)：
+#   version(1B) | len(leaves) + uint64[] | len(label_bitmap) + uint64[] | len(labels) + bytes
+# ipcidr 规则数据为地址区间：
+#   version(1B) | len(ranges) | 每个区间 16 字节起始地址 + 16 字节结束地址（IPv4 使用 ::ffff: 映射）
+MRS_MAGIC = b'MRS\x01'
+MRS_BEHAVIORS = {'domain': 0, 'ipcidr': 1}
+_SET_VERSION = 1
+_IPV4_MAPPED = 0xffff << 32
+
+def mrs_available():
+    return zstandard is not None
+
+def _set_bit(words, index):
+    while len(words) <= index >> 6:
+        words.append(0)
+    words[index >> 6] |= 1 << (index & 63)
+
+def _get_bit(words, index):
+    word = index >> 6
+    return word < len(words) and (words[word] >> (index & 63)) & 1
+
+def _domain_keys(rules):
+    """
+    将域名规则转换为 mihomo 字典树键（整串反转）：
+    '+.x' -> 'x' 与 '+.x'；'.x' -> '+.x'；'*.x' 与完整域名保持原样。
+    """
+    keys = set()
+    for rule in rules:
+        d = rule.lower()
+        if d.startswith('+.'):
+            keys.add(d[2:])
+            keys.add(d)
+        elif d.startswith('.'):
+            keys.add('+' + d)
+        else:
+            keys.add(d)
+    return sorted(k[::-1].encode('utf-8') for k in keys)
+
+def _build_succinct_set(keys):
+    """按层序遍历构建简洁字典树，返回 (leaves, label_bitmap, labels)"""
+    leaves, label_bitmap, labels = [], [], bytearray()
+    label_index = 0
+    queue = [(0, len(keys), 0)]
+    i = 0
+    while i < len(queue):
+        start, end, col = queue[i]
+        if col == len(keys[start]):
+            start += 1
+            _set_bit(leaves, i)
+        j = start
+        while j < end:
+            frm = j
+            c = keys[frm][col]
+            while j < end and keys[j][col] == c:
+                j += 1
+            queue.append((frm, j, col + 1))
+            labels.append(c)
+            label_index += 1
+        # label_bitmap 中 0 表示一个子节点标签，1 表示当前节点结束
+        _set_bit(label_bitmap, label_index)
+        label_index += 1
+        i += 1
+    return leaves, label_bitmap, bytes(labels)
+
+def _write_words(buf, words):
+    buf.write(struct.pack('>q', len(words)))
+    buf.write(struct.pack(f'>{len(words)}Q', *words))
+
+def encode_mrs(behavior, rules):
+    """生成未压缩的 MRS 数据流"""
+    rules = list(rules)
+    buf = io.BytesIO()
+    buf.write(MRS_MAGIC)
+    buf.write(bytes([MRS_BEHAVIORS[behavior]]))
+    buf.write(struct.pack('>qq', len(rules), 0))
+    buf.write(bytes([_SET_VERSION]))
+
+    if behavior == 'domain':
+        keys = _domain_keys(rules)
+        leaves, label_bitmap, labels = _build_succinct_set(keys) if keys else ([], [], b'')
+        _write_words(buf, leaves)
+        _write_words(buf, label_bitmap)
+        buf.write(struct.pack('>q', len(labels)))
+        buf.write(labels)
+    else:
+        merged, _ = merge_ip_ranges(rules)
+        ranges = [(s | _IPV4_MAPPED, e | _IPV4_MAPPED) for s, e in merged[4]] + merged[6]
+        buf.write(struct.pack('>q', len(ranges)))
+        for start, end in ranges:
+            buf.write(start.to_bytes(16, 'big'))
+            buf.write(end.to_bytes(16, 'big'))
+    return buf.getvalue()
+
+def _read_words(reader):
+    (length,) = struct.unpack('>q', reader.read(8))
+    return list(struct.unpack(f'>{length}Q', reader.read(8 * length)))
+
+def _decode_domains(reader):
+    """遍历简洁字典树还原全部键，再合并为 '+.x' / '.x' / '*.x' / 完整域名规则"""
+    leaves = _read_words(reader)
+    label_bitmap = _read_words(reader)
+    (length,) = struct.unpack('>q', reader.read(8))
+    labels = reader.read(length)
+    if not label_bitmap:
+        return []
+
+    keys = []
+    prefixes = [b'']
+    bm_index = label_index = node = 0
+    while node < len(prefixes):
+        if _get_bit(leaves, node):
+            keys.append(prefixes[node][::-1].decode('utf-8'))
+        while not _get_bit(label_bitmap, bm_index):
+            prefixes.append(prefixes[node] + labels[label_index:label_index + 1])
+            label_index += 1
+            bm_index += 1
+        bm_index += 1
+        node += 1
+
+    key_set = set(keys)
+    rules = []
+    for key in keys:
+        if key.startswith('+.'):
+            rules.append(key if key[2:] in key_set else key[1:])
+        elif f"+.{key}" not in key_set:
+            rules.append(key)
+    return sorted(rules)
+
+def _decode_ipcidrs(reader):
+    (length,) = struct.unpack('>q', reader.read(8))
+    rules = []
+    for _ in range(length):
+        start = int.from_bytes(reader.read(16), 'big')
+        end = int.from_bytes(reader.read(16), 'big')
+        version = 6
+        if start >> 32 == 0xffff and end >> 32 == 0xffff:
+            start, end, version = start & 0xffffffff, end & 0xffffffff, 4
+        rules.extend(format_cidr(n, p, version) for n, p in range_to_cidrs(start, end, version))
+    return rules
+
+def decode_mrs(data):
+    """解析未压缩的 MRS 数据流，返回 (behavior, count, rules)"""
+    reader = io.BytesIO(data)
+    if reader.read(4) != MRS_MAGIC:
+        raise ValueError("不是有效的 MRS 数据 (magic 不匹配)")
+    behavior_byte = reader.read(1)[0]
+    behavior = {v: k for k, v in MRS_BEHAVIORS.items()}.get(behavior_byte)
+    if behavior is None:
+        raise ValueError(f"不支持的 MRS behavior: {behavior_byte}")
+    count, extra_len = struct.unpack('>qq', reader.read(16))
+    reader.read(extra_len)
+    version = reader.read(1)[0]
+    if version != _SET_VERSION:
+        raise ValueError(f"不支持的 MRS 数据版本: {version}")
+    rules = _decode_domains(reader) if behavior == 'domain' else _decode_ipcidrs(reader)
+    return behavior, count, rules
+
+def write_mrs(file_path, behavior, rules):
+    """写出 zstd 压缩的 .mrs 文件，返回写出的字节内容；未安装 zstandard 时返回 None"""
+    if zstandard is None:
+        return None
+    data = zstandard.ZstdCompressor(level=19).compress(encode_mrs(behavior, rules))
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    return data
+
+def read_mrs(file_path):
+    """读取 .mrs 文件，返回 (behavior, count, rules)，用于本地校验"""
+    if zstandard is None:
+        raise RuntimeError("读取 .mrs 需要安装 zstandard: pip install zstandard")
+    with open(file_path, 'rb') as f:
+        data = zstandard.ZstdDecompressor().decompress(f.read())
+    return decode_mrs(data)
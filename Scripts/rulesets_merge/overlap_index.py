@@ -0,0 +1,368 @@
+import os
+import sys
+import json
+import bisect
+import argparse
+import collections
+from urllib.parse import urlparse
+
+from .. import project_paths
+from . import fast_yaml
+from .rulesets_merge_tools import iter_clean_content, classify_rule
+from .ruleset_reader import RulesetReader, read_rules
+from .ip_ranges import parse_ip_range
+from .mrs_format import MRS_BEHAVIORS, mrs_available, write_mrs
+
+# 域名规则类型：与 optimize_domains 的覆盖语义一致
+#   '+' -> '+.x' 覆盖 x 本身及全部子域名
+#   '.' -> '.x'  覆盖 x 的全部子域名（以及同级的 '*.x'）
+#   '*' -> '*.x' 仅覆盖 x 的一级子域名
+#   ''  -> 完整域名，仅覆盖自身
+_DOMAIN_KINDS = (('+.', '+'), ('.', '.'), ('*.', '*'))
+
+def split_domain_rule(rule):
+    """'+.Example.com' -> ('+', 'example.com')"""
+    d = rule.lower()
+    for prefix, kind in _DOMAIN_KINDS:
+        if d.startswith(prefix):
+            return kind, d[len(prefix):]
+    return '', d
+
+def _kind_covers(cover_kind, cover_domain, kind, domain):
+    """判断单条规则 (cover_kind, cover_domain) 是否完全覆盖 (kind, domain)，cover_domain 须为 domain 本身或其后缀"""
+    if cover_domain == domain:
+        if cover_kind == kind or cover_kind == '+':
+            return True
+        return cover_kind == '.' and kind == '*'
+    # cover_domain 为 domain 的上级域名
+    if cover_kind in ('+', '.'):
+        return True
+    return cover_kind == '*' and kind == '' and domain.partition('.')[2] == cover_domain
+
+def _domain_suffixes(domain):
+    """'a.b.com' -> 'a.b.com', 'b.com', 'com'"""
+    while domain:
+        yield domain
+        domain = domain.partition('.')[2]
+
+# ================= 规则集加载 =================
+
+class RulesetSource:
+    """一个规则集文件：名称、路径、行为类型，以及清洗分类后的域名 / IP 规则"""
+    def __init__(self, name, file_path, behavior=None, no_resolve=False):
+        self.name = name
+        self.file_path = file_path
+        self.behavior = behavior
+        self.no_resolve = no_resolve
+        self.domains = []   # [(原始规则, kind, domain)]
+        self.ips = []       # [(原始规则, version, start, end, no_resolve)]
+
+    def load(self):
+        """读取 payload，只收录 DOMAIN / DOMAIN-SUFFIX / IP 类规则，其余类型（如 DOMAIN-KEYWORD）不参与索引"""
+        for rule in read_rules(self.file_path):
+            classified = classify_rule(rule)
+            if classified is None:
+                continue
+            r_type, value = classified
+            if r_type == 'domain':
+                kind, domain = split_domain_rule(value)
+                self.domains.append((rule, kind, domain))
+            else:
+                parsed = parse_ip_range(value)
+                if parsed is None:
+                    continue
+                no_resolve = self.no_resolve or rule.lower().endswith(',no-resolve')
+                self.ips.append((rule, *parsed, no_resolve))
+        return self
+
+def resolve_provider_path(url, project_root):
+    """按 URL 路径逐级截取，找到项目内对应的 YAML 文件；.mrs 地址对应同名 YAML"""
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    if parts and parts[-1].endswith('.mrs'):
+        parts[-1] = parts[-1][:-4] + '.yaml'
+    for i in range(len(parts)):
+        candidate = os.path.join(project_root, *parts[i:])
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+def load_template_providers(rules_part_path, project_root):
+    """
+    解析 rulespart 片段：
+    返回按 rules 中 RULE-SET 出现顺序排列的 RulesetSource 列表（未加载规则）。
+    找不到本地文件的 provider 被跳过并提示。
+    """
+    with open(rules_part_path, 'r', encoding='utf-8') as f:
+        data = fast_yaml.safe_load(f) or {}
+    providers = data.get('rule-providers') or {}
+    sources = []
+    seen = set()
+    for line in data.get('rules') or []:
+        parts = [p.strip() for p in str(line).split(',')]
+        if len(parts) < 3 or parts[0].upper() != 'RULE-SET' or parts[1] in seen:
+            continue
+        name = parts[1]
+        seen.add(name)
+        provider = providers.get(name)
+        if not isinstance(provider, dict) or not provider.get('url'):
+            print(f"  -> 跳过 {name}: rule-providers 中未定义")
+            continue
+        file_path = resolve_provider_path(provider['url'], project_root)
+        if file_path is None:
+            print(f"  -> 跳过 {name}: 本地未找到 {provider['url']}")
+            continue
+        no_resolve = any(p.lower() == 'no-resolve' for p in parts[3:])
+        sources.append(RulesetSource(name, file_path, provider.get('behavior'), no_resolve))
+    return sources
+
+def list_ruleset_files(*dirs):
+    """列出目录下全部规则集 YAML（按文件名排序），以文件名（不含扩展名）为名称"""
+    sources = []
+    for d in dirs:
+        if not os.path.isdir(d):
+            continue
+        for filename in sorted(os.listdir(d)):
+            if filename.endswith('.yaml'):
+                sources.append(RulesetSource(filename[:-5], os.path.join(d, filename)))
+    return sources
+
+# ================= 覆盖索引 =================
+
+class CoverageIndex:
+    """
+    全局覆盖索引：
+    - 域名：{domain: {owner: kinds}}，查询时沿后缀逐级查找，复杂度与标签数成正比。
+    - IP：每个 owner 合并后的区间列表，二分判断区间包含。
+    """
+    def __init__(self):
+        self.domains = collections.defaultdict(dict)
+        self.ip_ranges = {}
+        self._raw_ips = {}
+
+    def add_domains(self, owner, domains):
+        for _, kind, domain in domains:
+            self.domains[domain].setdefault(owner, set()).add(kind)
+
+    def add_ips(self, owner, ips):
+        buckets = self._raw_ips.setdefault(owner, {4: [], 6: []})
+        for _, version, start, end, _ in ips:
+            buckets[version].append((start, end))
+
+    def add(self, owner, source):
+        self.add_domains(owner, source.domains)
+        self.add_ips(owner, source.ips)
+
+    def freeze(self):
+        """合并各 owner 的 IP 区间，之后才能调用 ip_covered_by；新增规则后需重新调用"""
+        for owner, buckets in self._raw_ips.items():
+            merged_buckets = {}
+            for version in (4, 6):
+                merged = []
+                for start, end in sorted(buckets[version]):
+                    if merged and start <= merged[-1][1] + 1:
+                        if end > merged[-1][1]:
+                            merged[-1] = (merged[-1][0], end)
+                    else:
+                        merged.append((start, end))
+                merged_buckets[version] = (merged, [start for start, _ in merged])
+            self.ip_ranges[owner] = merged_buckets
+
+    def domain_covered_by(self, kind, domain):
+        """返回覆盖该域名规则的全部 owner"""
+        owners = set()
+        for suffix in _domain_suffixes(domain):
+            entries = self.domains.get(suffix)
+            if not entries:
+                continue
+            for owner, kinds in entries.items():
+                if owner not in owners and any(_kind_covers(k, suffix, kind, domain) for k in kinds):
+                    owners.add(owner)
+        return owners
+
+    def ip_covered_by(self, version, start, end, owners=None):
+        """返回区间被完全包含的全部 owner"""
+        result = set()
+        for owner in (owners if owners is not None else self.ip_ranges):
+            buckets = self.ip_ranges.get(owner)
+            if not buckets:
+                continue
+            merged, starts = buckets[version]
+            i = bisect.bisect_right(starts, start) - 1
+            if i >= 0 and merged[i][1] >= end:
+                result.add(owner)
+        return result
+
+def overlap_report(sources):
+    """
+    两两重叠统计：report[(a, b)] = b 中被 a 完全覆盖的规则数（方向性，a != b）。
+    同时返回各规则集的可索引规则总数。
+    """
+    index = CoverageIndex()
+    for source in sources:
+        index.add(source.name, source)
+    index.freeze()
+
+    pairs = collections.Counter()
+    totals = {}
+    for source in sources:
+        totals[source.name] = len(source.domains) + len(source.ips)
+        for _, kind, domain in source.domains:
+            for owner in index.domain_covered_by(kind, domain):
+                if owner != source.name:
+                    pairs[(owner, source.name)] += 1
+        for _, version, start, end, _ in source.ips:
+            for owner in index.ip_covered_by(version, start, end):
+                if owner != source.name:
+                    pairs[(owner, source.name)] += 1
+    return pairs, totals
+
+def plan_ordered_dedupe(ordered_sources):
+    """
+    按 rules 顺序计算可移除的规则：某条规则已被排在前面的规则集完全覆盖时，在先匹配原则下永远不会命中。
+    IP 规则额外考虑 no-resolve：前面的规则带 no-resolve 时只覆盖同样带 no-resolve 的后续规则。
+    返回 {name: set(可移除的原始规则)}。
+    """
+    earlier = CoverageIndex()
+    removals = {}
+    for source in ordered_sources:
+        removed = set()
+        if earlier.domains:
+            for rule, kind, domain in source.domains:
+                if earlier.domain_covered_by(kind, domain):
+                    removed.add(rule)
+        if earlier.ip_ranges:
+            for rule, version, start, end, no_resolve in source.ips:
+                owners = ('resolve', 'no_resolve') if no_resolve else ('resolve',)
+                if earlier.ip_covered_by(version, start, end, owners):
+                    removed.add(rule)
+        removals[source.name] = removed
+
+        earlier.add_domains(source.name, source.domains)
+        earlier.add_ips('resolve', [r for r in source.ips if not r[4]])
+        earlier.add_ips('no_resolve', [r for r in source.ips if r[4]])
+        earlier.freeze()
+    return removals
+
+def apply_removals(source, removed, generated_dir):
+    """
+    从规则集文件中删除指定规则：逐行过滤 payload，保留其余内容与格式，同步更新 'Rule Count' 头部。
+    同目录下已有同名 .mrs 时一并重写（生成目录与 Converted_rulesets 均适用），生成目录下的规则集同时更新 rulesets.json 计数。
+    返回剩余规则数；全部规则都将被移除时不改写文件并返回 None。
+    """
+    with open(source.file_path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+
+    kept, remaining = [], []
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('- '):
+            cores = list(iter_clean_content(stripped))
+            if cores and cores[0] in removed:
+                continue
+            if cores:
+                remaining.append(cores[0])
+        kept.append(line)
+    if not remaining:
+        return None
+    kept = [f"# Rule Count: {len(remaining)}" if l.startswith('# Rule Count:') else l for l in kept]
+
+    with open(source.file_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(kept))
+
+    # 规则类型取自文件头部（生成目录为 'Ruleset Type'，Converted_rulesets 为 'Type'）
+    mrs_path = source.file_path[:-len('.yaml')] + '.mrs'
+    if os.path.exists(mrs_path):
+        try:
+            with RulesetReader(source.file_path) as reader:
+                r_type = reader.rule_type
+        except ValueError:
+            r_type = None
+        if r_type in MRS_BEHAVIORS and mrs_available():
+            write_mrs(mrs_path, r_type, remaining)
+        else:
+            print(f"  -> 警告: 无法重写 {os.path.basename(mrs_path)}（类型 {r_type}，zstandard {'可用' if mrs_available() else '未安装'}），其内容已过期")
+
+    if os.path.dirname(os.path.abspath(source.file_path)) != os.path.abspath(generated_dir):
+        return len(remaining)
+
+    out_name = os.path.basename(source.file_path)[:-5]
+    json_path = os.path.join(generated_dir, 'rulesets.json')
+    if os.path.exists(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if out_name in info:
+            info[out_name]['rule_count'] = len(remaining)
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(info, f, ensure_ascii=False, indent=2)
+    return len(remaining)
+
+# ================= 主流程 =================
+
+def run_overlap(project_root, rules_part_path, dedupe=False, report_path=None, top=20):
+    generated_dir = os.path.join(project_root, 'Generated_rulesets')
+    converted_dir = os.path.join(project_root, 'SRC_rulesets', 'Forked_rulesets', 'Converted_rulesets')
+
+    print(">>> 步骤 1: 加载全部规则集")
+    all_sources = [s.load() for s in list_ruleset_files(generated_dir, converted_dir)]
+    print(f"  -> 共 {len(all_sources)} 个规则集，{sum(len(s.domains) + len(s.ips) for s in all_sources)} 条可索引规则")
+
+    print("\n>>> 步骤 2: 统计两两重叠")
+    pairs, totals = overlap_report(all_sources)
+    for (owner, target), count in pairs.most_common(top):
+        print(f"  {target} 中有 {count}/{totals[target]} 条被 {owner} 覆盖")
+
+    print(f"\n>>> 步骤 3: 按 {os.path.basename(rules_part_path)} 的 rules 顺序计算可移除规则")
+    ordered = [s.load() for s in load_template_providers(rules_part_path, project_root)]
+    removals = plan_ordered_dedupe(ordered)
+    total_removed = 0
+    for source in ordered:
+        removed = removals[source.name]
+        if removed:
+            total_removed += len(removed)
+            print(f"  {source.name}: 可移除 {len(removed)} 条（被前序规则集覆盖）")
+    print(f"  -> 合计可移除 {total_removed} 条")
+
+    if dedupe:
+        print("\n>>> 步骤 4: 移除被前序规则集覆盖的规则")
+        # 多个 provider 可能指向同一文件，只有全部引用都可移除时才删除
+        by_file = collections.defaultdict(list)
+        for source in ordered:
+            by_file[source.file_path].append(source)
+        for file_path, refs in by_file.items():
+            removed = set.intersection(*(removals[s.name] for s in refs))
+            if not removed:
+                continue
+            source = refs[0]
+            remaining = apply_removals(source, removed, generated_dir)
+            if remaining is None:
+                print(f"  -> 跳过 {source.name}: 全部规则均被覆盖，保留文件以免产生空规则集")
+                continue
+            print(f"  -> {os.path.relpath(file_path, project_root)}: 移除 {len(removed)} 条，剩余 {remaining} 条")
+
+    if report_path:
+        report = {
+            'totals': totals,
+            'pairs': [{'covered_by': o, 'group': t, 'count': c} for (o, t), c in pairs.most_common()],
+            'removable': {name: len(r) for name, r in removals.items()},
+            'order': [s.name for s in ordered],
+        }
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已保存至 {report_path}")
+    return pairs, removals
+
+if __name__ == "__main__":
+    project_root = project_paths.PROJECT_ROOT
+    default_rules_part = os.path.join(project_root, 'Custom_templates', 'Parts', 'rulespart_default.yaml')
+
+    parser = argparse.ArgumentParser(description="跨规则组重叠分析与按规则顺序去重")
+    parser.add_argument('rules_part', nargs='?', default=default_rules_part, help="定义 rule-providers 与 rules 顺序的模板片段")
+    parser.add_argument('--dedupe', action='store_true', help="从排序靠后的规则集中移除已被前序规则集覆盖的规则（会改写规则集文件）")
+    parser.add_argument('--report', metavar='PATH', help="将完整重叠报告写为 JSON")
+    parser.add_argument('--top', type=int, default=20, help="打印重叠最多的前 N 对")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.rules_part):
+        print(f"错误: 文件 {args.rules_part} 不存在。")
+        sys.exit(1)
+    run_overlap(project_root, args.rules_part, dedupe=args.dedupe, report_path=args.report, top=args.top)
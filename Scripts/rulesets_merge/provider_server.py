@@ -0,0 +1,302 @@
+import os
+import gzip
+import time
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .. import project_paths
+from .manufacture import run_manufacture
+
+# brotli 为可选依赖：未安装时只提供 gzip 预压缩版本
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+URL_PREFIX = '/Generated_rulesets/'
+CONTENT_TYPES = {
+    '.yaml': 'text/yaml; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+    '.mrs': 'application/octet-stream',
+}
+# 小于该字节数的文件不提供压缩版本
+COMPRESS_MIN_BYTES = 1024
+
+class Resource:
+    """
+    内存中的单个文件：原始内容与预压缩版本、ETag、修改时间。
+    各编码的字节不同，ETag 也各不相同（原始内容的 ETag 加 -gzip / -br 后缀），
+    variants 为 {编码: (压缩内容, ETag)}。
+    """
+    __slots__ = ('body', 'variants', 'etag', 'mtime', 'content_type')
+
+    def __init__(self, body, mtime, content_type):
+        self.body = body
+        self.mtime = int(mtime)
+        self.content_type = content_type
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.variants = {}
+        # .mrs 已经过 zstd 压缩，不再重复压缩
+        if len(body) >= COMPRESS_MIN_BYTES and content_type != CONTENT_TYPES['.mrs']:
+            if brotli is not None:
+                self.variants['br'] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+            self.variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gzip"')
+
+    def etags(self):
+        """当前资源全部编码的 ETag，用于条件请求匹配"""
+        return [self.etag, *(etag for _, etag in self.variants.values())]
+
+def load_snapshot(output_dir, output_info=None, previous=None, rendered=None):
+    """
+    生成不可变的快照 {文件名: Resource}：
+    output_info（rulesets.json 内容）给出时只包含其中列出的输出及 rulesets.json，否则包含目录下全部受支持的文件。
+    rendered（合并流程收集的 {文件名: bytes}）中的文件直接使用内存中的内容，不再读取磁盘；
+    其余文件（如输入未变化而跳过的规则组）复用 previous 中修改时间与大小一致的 Resource，否则读取磁盘。
+    内容未变化的文件复用 previous 中的 Resource，避免重复压缩。
+    """
+    if output_info is None:
+        names = [n for n in os.listdir(output_dir) if os.path.splitext(n)[1] in CONTENT_TYPES]
+    else:
+        names = [f"{name}.{fmt}" for name, info in output_info.items() for fmt in info.get('format') or ['yaml']]
+        names.append('rulesets.json')
+    previous = previous or {}
+    rendered = rendered or {}
+    snapshot = {}
+    for name in sorted(set(names)):
+        path = os.path.join(output_dir, name)
+        old = previous.get(name)
+        body = rendered.get(name)
+        try:
+            st = os.stat(path)
+            if body is None:
+                if old is not None and old.mtime == int(st.st_mtime) and len(old.body) == st.st_size:
+                    snapshot[name] = old
+                    continue
+                with open(path, 'rb') as f:
+                    body = f.read()
+            mtime = st.st_mtime
+        except OSError:
+            print(f"  -> 警告: 无法读取 {name}，跳过")
+            continue
+        if old is not None and old.body == body:
+            snapshot[name] = old
+        else:
+            snapshot[name] = Resource(body, mtime, CONTENT_TYPES[os.path.splitext(name)[1]])
+    return snapshot
+
+def directory_signature(output_dir):
+    """输出目录的变化标记：受支持文件的 (文件名, mtime, 大小) 集合"""
+    signature = []
+    for name in sorted(os.listdir(output_dir)):
+        if os.path.splitext(name)[1] in CONTENT_TYPES:
+            st = os.stat(os.path.join(output_dir, name))
+            signature.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+def parse_range(header, size):
+    """
+    解析单段 Range 请求头：返回 (start, end)（含 end）；
+    格式不支持时返回 None（按完整内容响应），范围无法满足时返回 False。
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            length = int(last)
+            if length <= 0:
+                return False
+            start, end = max(0, size - length), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    server_version = 'RulesetsProvider/1.0'
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        # 每个请求只读取一次快照引用，重建后的替换不影响进行中的响应
+        snapshot = self.server.snapshot
+        path = self.path.split('?', 1)[0]
+        name = path[len(URL_PREFIX):] if path.startswith(URL_PREFIX) else path.lstrip('/') if path.count('/') == 1 else None
+        resource = snapshot.get(name) if name else None
+        if resource is None:
+            self._send_simple(404, b'Not Found\n', send_body)
+            return
+
+        if self._not_modified(resource):
+            # 304 返回客户端本次可获得的那个编码的 ETag
+            encoding = self._pick_encoding(resource)
+            self.send_response(304)
+            self._common_headers(resource, resource.variants[encoding][1] if encoding else resource.etag)
+            self.end_headers()
+            return
+
+        body, encoding, etag, status = resource.body, None, resource.etag, 200
+        range_header = self.headers.get('Range')
+        byte_range = parse_range(range_header, len(body)) if range_header else None
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', f"bytes */{len(body)}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if byte_range and self.headers.get('If-Range') not in (None, resource.etag):
+            byte_range = None
+        if byte_range:
+            start, end = byte_range
+            body, status = body[start:end + 1], 206
+        else:
+            encoding = self._pick_encoding(resource)
+            if encoding:
+                body, etag = resource.variants[encoding]
+
+        self.send_response(status)
+        self._common_headers(resource, etag)
+        self.send_header('Content-Type', resource.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(resource.body)}")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _pick_encoding(self, resource):
+        """按 Accept-Encoding 选择预压缩版本（br 优先），不接受压缩或没有压缩版本时返回 None"""
+        accepted = self.headers.get('Accept-Encoding', '')
+        for candidate in ('br', 'gzip'):
+            if candidate in resource.variants and candidate in accepted:
+                return candidate
+        return None
+
+    def _not_modified(self, resource):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*':
+                return True
+            # 任一编码的 ETag 匹配即可：各编码内容同源，原始内容未变则全部未变
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return any(etag in tags for etag in resource.etags())
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return resource.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _common_headers(self, resource, etag):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(resource.mtime, usegmt=True))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', 'no-cache')
+
+    def _send_simple(self, status, body, send_body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class ProviderServer(ThreadingHTTPServer):
+    """持有当前快照的 HTTP 服务；swap() 整体替换快照引用，请求处理无需加锁"""
+    daemon_threads = True
+
+    def __init__(self, address, snapshot, verbose=False):
+        super().__init__(address, ProviderHandler)
+        self.snapshot = snapshot
+        self.verbose = verbose
+
+    def swap(self, snapshot):
+        self.snapshot = snapshot
+
+def _rebuild_loop(server, output_dir, stop, config_path, rebuild_interval, reload_interval, build_kwargs):
+    """
+    后台线程：
+    1. 每 rebuild_interval 秒运行一次 run_manufacture，直接用其返回的输出信息与收集的文件内容生成快照，
+       不再从磁盘读回本次写出的文件；失败时保留旧快照。
+    2. 其间每 reload_interval 秒检查输出目录，文件被外部更新（如 git pull）时重新加载。
+    """
+    signature = directory_signature(output_dir)
+    next_build = time.monotonic() if rebuild_interval else None
+    while not stop.is_set():
+        if next_build is not None and time.monotonic() >= next_build:
+            start = time.perf_counter()
+            try:
+                rendered = {}
+                _, output_info = run_manufacture(config_path, rendered=rendered, **build_kwargs)
+                snapshot = load_snapshot(output_dir, output_info or None, server.snapshot, rendered)
+            except Exception as e:
+                print(f"错误: 重建失败，继续提供旧数据: {e}")
+            else:
+                server.swap(snapshot)
+                signature = directory_signature(output_dir)
+                print(f"\n>>> 重建完成，已切换至新数据: {len(snapshot)} 个文件，耗时 {time.perf_counter() - start:.1f}s")
+            next_build = time.monotonic() + rebuild_interval
+        elif reload_interval:
+            current = directory_signature(output_dir)
+            if current != signature:
+                signature = current
+                server.swap(load_snapshot(output_dir, previous=server.snapshot))
+                print(f">>> 检测到输出目录变化，已重新加载 {len(server.snapshot)} 个文件")
+        stop.wait(reload_interval or rebuild_interval or 60)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在局域网内提供 Generated_rulesets 规则集下载，并定时重建、热切换")
+    parser.add_argument('config', nargs='?', default=project_paths.RULESETS_CONFIG, help="主配置文件路径")
+    parser.add_argument('--host', default='0.0.0.0', help="监听地址")
+    parser.add_argument('--port', type=int, default=8080, help="监听端口")
+    parser.add_argument('--rebuild-interval', type=int, default=6 * 3600, metavar='SECONDS',
+                        help="定时运行合并流程的间隔（秒），0 表示不重建、仅提供现有文件")
+    parser.add_argument('--reload-interval', type=int, default=60, metavar='SECONDS',
+                        help="检查输出目录被外部更新的间隔（秒），0 表示关闭")
+    parser.add_argument('--jobs', type=int, default=1, help="重建时并行处理规则组的进程数，0 表示使用全部 CPU 核心")
+    parser.add_argument('--mrs', action='store_true', help="重建时额外输出 .mrs 二进制规则集")
+    parser.add_argument('--verbose', action='store_true', help="打印每个请求的访问日志")
+    args = parser.parse_args()
+
+    output_dir = project_paths.GENERATED_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    snapshot = load_snapshot(output_dir)
+    server = ProviderServer((args.host, args.port), snapshot, args.verbose)
+    print(f">>> 已加载 {len(snapshot)} 个文件（brotli: {'可用' if brotli else '未安装，仅 gzip'}）")
+    print(f">>> 监听 http://{args.host}:{args.port}{URL_PREFIX}")
+
+    build_kwargs = {'jobs': args.jobs if args.jobs > 0 else (os.cpu_count() or 1), 'mrs': args.mrs}
+    stop = threading.Event()
+    worker = threading.Thread(target=_rebuild_loop, daemon=True, args=(
+        server, output_dir, stop, args.config, args.rebuild_interval, args.reload_interval, build_kwargs))
+    worker.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n>>> 停止服务")
+    finally:
+        stop.set()
+        server.server_close()
@@ -0,0 +1,290 @@
+import os
+import sys
+import time
+import heapq
+import bisect
+import argparse
+import collections
+
+from .. import project_paths
+from . import fast_yaml
+from .ruleset_reader import read_rules
+from .ip_ranges import parse_ip_range
+from .overlap_index import split_domain_rule, resolve_provider_path
+
+# 支持离线判定的规则类型；其余类型（GEOIP / GEOSITE / PROCESS-NAME 等）无法离线判定，加载时跳过并计数
+_DOMAIN_TYPES = {'DOMAIN': '', 'DOMAIN-SUFFIX': '+'}
+_IP_TYPES = ('IP-CIDR', 'IP-CIDR6')
+
+# 字典树节点：[子节点 {label: node}, 完整域名, '+.x', '.x', '*.x']，后四项为命中条目的最小编号
+_EXACT, _PLUS, _DOT, _STAR = 1, 2, 3, 4
+_KIND_SLOTS = {'': _EXACT, '+': _PLUS, '.': _DOT, '*': _STAR}
+
+Match = collections.namedtuple('Match', 'query policy provider rule')
+
+class DomainTrie:
+    """按反转标签组织的后缀字典树，每个节点只记录各类型规则中编号最小（最先匹配）的条目"""
+    def __init__(self):
+        self.root = [{}, None, None, None, None]
+
+    def insert(self, kind, domain, entry_id):
+        node = self.root
+        for label in reversed(domain.split('.')):
+            children = node[0]
+            child = children.get(label)
+            if child is None:
+                child = children[label] = [{}, None, None, None, None]
+            node = child
+        slot = _KIND_SLOTS[kind]
+        if node[slot] is None or entry_id < node[slot]:
+            node[slot] = entry_id
+
+    def lookup(self, host):
+        """
+        沿标签自顶向下查找，返回命中的最小条目编号（无命中为 None）：
+        祖先节点的 '+.' 与 '.' 覆盖全部子域名，父节点的 '*.' 覆盖一级子域名，自身节点匹配完整域名与 '+.'。
+        """
+        labels = host.split('.')
+        best = None
+        node = self.root
+        last = len(labels) - 1
+        for depth, label in enumerate(reversed(labels)):
+            node = node[0].get(label)
+            if node is None:
+                break
+            if depth == last:
+                candidates = (node[_EXACT], node[_PLUS])
+            elif depth == last - 1:
+                candidates = (node[_PLUS], node[_DOT], node[_STAR])
+            else:
+                candidates = (node[_PLUS], node[_DOT])
+            for c in candidates:
+                if c is not None and (best is None or c < best):
+                    best = c
+        return best
+
+class IntervalIndex:
+    """
+    IP 区间索引：扫描线将全部（可能重叠的）区间切分为不相交的片段，每个片段只保留编号最小的条目，
+    查询时二分定位片段。
+    """
+    def __init__(self):
+        self._ranges = {4: [], 6: []}
+        self._starts = {4: [], 6: []}
+        self._segments = {4: [], 6: []}
+
+    def add(self, version, start, end, entry_id):
+        self._ranges[version].append((start, end, entry_id))
+
+    def build(self):
+        for version, ranges in self._ranges.items():
+            ranges.sort()
+            points = sorted({p for start, end, _ in ranges for p in (start, end + 1)})
+            segments, heap, i = [], [], 0
+            for idx, point in enumerate(points[:-1]):
+                while i < len(ranges) and ranges[i][0] <= point:
+                    heapq.heappush(heap, (ranges[i][2], ranges[i][1]))
+                    i += 1
+                while heap and heap[0][1] < point:
+                    heapq.heappop(heap)
+                if heap:
+                    winner = heap[0][0]
+                    seg_end = points[idx + 1] - 1
+                    if segments and segments[-1][2] == winner and segments[-1][1] + 1 == point:
+                        segments[-1] = (segments[-1][0], seg_end, winner)
+                    else:
+                        segments.append((point, seg_end, winner))
+            self._segments[version] = segments
+            self._starts[version] = [s for s, _, _ in segments]
+            self._ranges[version] = []
+
+    def lookup(self, version, value):
+        segments = self._segments[version]
+        i = bisect.bisect_right(self._starts[version], value) - 1
+        if i >= 0 and segments[i][1] >= value:
+            return segments[i][2]
+        return None
+
+class RuleMatcher:
+    """
+    离线规则匹配：按模板 rules 顺序为每条可判定规则分配递增编号，编号越小越先匹配。
+    RULE-SET 展开为其 payload，同一规则集内的条目共享优先级位置但保留各自的原始规则以便报告。
+    域名查询不做 DNS 解析，因此只参与域名类规则与 MATCH 的判定。
+    """
+    def __init__(self):
+        self.entries = []       # [(policy, provider, rule)]
+        self.domains = DomainTrie()
+        self.ips = IntervalIndex()
+        self.keywords = []      # [(entry_id, keyword)]
+        self.final = None       # MATCH 条目编号
+        self.skipped = collections.Counter()
+
+    def _add_entry(self, policy, provider, rule):
+        self.entries.append((policy, provider, rule))
+        return len(self.entries) - 1
+
+    def _add_domain(self, kind, domain, policy, provider, rule):
+        self.domains.insert(kind, domain.lower(), self._add_entry(policy, provider, rule))
+
+    def _add_rule(self, r_type, value, policy, provider, rule):
+        """添加一条 classical 规则：DOMAIN 按字面值完整匹配（'*.x' / '.x' 不视为通配），DOMAIN-SUFFIX 覆盖自身及子域名"""
+        if r_type in _DOMAIN_TYPES:
+            self._add_domain(_DOMAIN_TYPES[r_type], value, policy, provider, rule)
+        elif r_type == 'DOMAIN-KEYWORD':
+            self.keywords.append((self._add_entry(policy, provider, rule), value.lower()))
+        elif r_type in _IP_TYPES:
+            parsed = parse_ip_range(value)
+            if parsed is None:
+                self.skipped['invalid'] += 1
+                return
+            version, start, end = parsed
+            self.ips.add(version, start, end, self._add_entry(policy, provider, rule))
+        else:
+            self.skipped[r_type] += 1
+
+    def add_provider_rules(self, provider, behavior, file_path, policy):
+        """展开规则集文件：domain / ipcidr 为纯值，classical 为 'TYPE,value[,...]'"""
+        for rule in read_rules(file_path):
+            if behavior == 'domain':
+                # domain 规则集的 payload 带 '+.' / '.' / '*.' 通配前缀
+                self._add_domain(*split_domain_rule(rule), policy, provider, rule)
+            elif behavior == 'ipcidr':
+                self._add_rule('IP-CIDR', rule, policy, provider, rule)
+            else:
+                parts = [p.strip() for p in rule.split(',')]
+                if len(parts) < 2:
+                    self.skipped['invalid'] += 1
+                    continue
+                self._add_rule(parts[0].upper(), parts[1], policy, provider, rule)
+
+    def build(self):
+        self.keywords.sort()
+        self.ips.build()
+        return self
+
+    def match(self, query):
+        """返回 Match；未命中任何规则且模板无 MATCH 时 policy 为 None"""
+        host = query.strip().lower().rstrip('.')
+        best = None
+        if host and (':' in host or host[-1].isdigit()):
+            parsed = parse_ip_range(host) if '/' not in host else None
+            if parsed is not None:
+                best = self.ips.lookup(parsed[0], parsed[1])
+        if best is None and host:
+            best = self.domains.lookup(host)
+            for entry_id, keyword in self.keywords:
+                if best is not None and entry_id > best:
+                    break
+                if keyword in host:
+                    best = entry_id
+                    break
+        if best is None:
+            best = self.final
+        if best is None:
+            return Match(query, None, None, None)
+        policy, provider, rule = self.entries[best]
+        return Match(query, policy, provider, rule)
+
+    def match_many(self, queries):
+        return [self.match(q) for q in queries]
+
+def load_matcher(template_path, project_root):
+    """
+    从模板构建匹配器：解析 rule-providers 与 rules，RULE-SET 对应的本地规则集按 URL 路径在项目内查找
+    （Generated_rulesets / Converted_rulesets），找不到的规则集跳过并提示。
+    """
+    with open(template_path, 'r', encoding='utf-8') as f:
+        data = fast_yaml.safe_load(f) or {}
+    providers = data.get('rule-providers') or {}
+    matcher = RuleMatcher()
+
+    for line in data.get('rules') or []:
+        parts = [p.strip() for p in str(line).split(',')]
+        r_type = parts[0].upper()
+        if r_type == 'MATCH':
+            if matcher.final is None and len(parts) >= 2:
+                matcher.final = matcher._add_entry(parts[1], None, str(line))
+            continue
+        if len(parts) < 3:
+            matcher.skipped['invalid'] += 1
+            continue
+        if r_type == 'RULE-SET':
+            provider = providers.get(parts[1])
+            file_path = resolve_provider_path(provider['url'], project_root) if isinstance(provider, dict) and provider.get('url') else None
+            if file_path is None:
+                print(f"  -> 跳过 RULE-SET {parts[1]}: 本地未找到对应规则集")
+                matcher.skipped['RULE-SET'] += 1
+                continue
+            matcher.add_provider_rules(parts[1], provider.get('behavior', 'classical'), file_path, parts[2])
+        else:
+            matcher._add_rule(r_type, parts[1], parts[2], None, str(line))
+    return matcher.build()
+
+def _iter_query_batches(lines, batch_size):
+    batch = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+if __name__ == "__main__":
+    project_root = project_paths.PROJECT_ROOT
+    default_template = os.path.join(project_root, 'Custom_templates', 'default_template.yaml')
+
+    parser = argparse.ArgumentParser(description="离线判定域名 / IP 在模板规则下命中的规则与策略")
+    parser.add_argument('queries', nargs='*', help="要查询的域名或 IP；与 --file 二选一")
+    parser.add_argument('--file', '-f', help="查询文件，每行一个域名或 IP（'-' 表示标准输入）")
+    parser.add_argument('--template', default=default_template, help="模板路径")
+    parser.add_argument('--output', '-o', help="将逐条结果写为 TSV（query, policy, provider, rule）")
+    parser.add_argument('--batch-size', type=int, default=100000, help="每批处理的查询数")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.template):
+        print(f"错误: 模板 {args.template} 不存在。")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    matcher = load_matcher(args.template, project_root)
+    load_seconds = time.perf_counter() - start
+    print(f">>> 已加载 {len(matcher.entries)} 条规则，耗时 {load_seconds:.2f}s")
+    if matcher.skipped:
+        print("  -> 无法离线判定而跳过: " + ", ".join(f"{k} x{v}" for k, v in matcher.skipped.most_common()))
+
+    if args.file:
+        source = sys.stdin if args.file == '-' else open(args.file, 'r', encoding='utf-8')
+    else:
+        source = args.queries
+    out = open(args.output, 'w', encoding='utf-8') if args.output else None
+
+    hits = collections.Counter()
+    total = 0
+    match_seconds = 0.0
+    try:
+        for batch in _iter_query_batches(source, max(1, args.batch_size)):
+            start = time.perf_counter()
+            results = matcher.match_many(batch)
+            match_seconds += time.perf_counter() - start
+            total += len(results)
+            for m in results:
+                hits[(m.provider or '-', m.policy)] += 1
+            if out:
+                out.writelines(f"{m.query}\t{m.policy}\t{m.provider or '-'}\t{m.rule}\n" for m in results)
+            elif not args.file:
+                for m in results:
+                    print(f"{m.query} -> {m.policy} ({m.provider or '-'}: {m.rule})")
+    finally:
+        if out:
+            out.close()
+        if args.file and args.file != '-':
+            source.close()
+
+    rate = total / match_seconds if match_seconds else 0
+    print(f"\n>>> 共 {total} 条查询，匹配耗时 {match_seconds:.2f}s ({rate:,.0f} 条/秒)")
+    for (provider, policy), count in hits.most_common():
+        print(f"  {provider:<16} {policy:<12} {count}")
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from .. import project_paths
+from .rulesets_merge_tools import BUILD_MANIFEST_NAME
+from .ruleset_reader import read_rules
+
+# 参与比较的目录（相对项目根目录）
+DIFF_DIRS = ('Generated_rulesets', os.path.join('SRC_rulesets', 'Forked_rulesets', 'Converted_rulesets'))
+
+def _git(project_root, *args):
+    return subprocess.run(['git', *args], cwd=project_root, capture_output=True, check=True).stdout
+
+def load_rulesets_from_dir(root, rel_dirs=DIFF_DIRS):
+    """读取工作目录中的规则集：{相对路径: 规则集合}，只比较 payload，忽略头部注释与生成时间"""
+    result = {}
+    for rel_dir in rel_dirs:
+        d = os.path.join(root, rel_dir)
+        if not os.path.isdir(d):
+            continue
+        for filename in sorted(os.listdir(d)):
+            if filename.endswith('.yaml'):
+                result[f"{rel_dir}/{filename}".replace(os.sep, '/')] = set(read_rules(os.path.join(d, filename)))
+    return result
+
+def load_rulesets_from_git(project_root, rev, rel_dirs=DIFF_DIRS):
+    """读取某个提交中的规则集，结构同 load_rulesets_from_dir"""
+    result = {}
+    for rel_dir in rel_dirs:
+        rel_dir = rel_dir.replace(os.sep, '/')
+        try:
+            names = _git(project_root, 'ls-tree', '--name-only', f"{rev}:{rel_dir}").decode('utf-8').splitlines()
+        except subprocess.CalledProcessError:
+            continue
+        for filename in names:
+            if filename.endswith('.yaml'):
+                path = f"{rel_dir}/{filename}"
+                # 与 load_rulesets_from_dir 使用同一解析器，避免解析差异被误报为规则变化
+                result[path] = set(read_rules(path, _git(project_root, 'show', f"{rev}:{path}")))
+    return result
+
+def diff_rulesets(old, new, sample_size=5):
+    """
+    逐个规则集比较（哈希集合差，线性时间）：
+    返回 [{name, old_count, new_count, added, removed, shrink_pct, added_samples, removed_samples}]，
+    新增或删除的整个规则集同样列出。
+    """
+    report = []
+    for name in sorted(old.keys() | new.keys()):
+        old_rules = old.get(name, set())
+        new_rules = new.get(name, set())
+        added = new_rules - old_rules
+        removed = old_rules - new_rules
+        shrink_pct = 0.0
+        if old_rules and len(new_rules) < len(old_rules):
+            shrink_pct = round((len(old_rules) - len(new_rules)) * 100 / len(old_rules), 2)
+        report.append({
+            'name': name,
+            'status': 'added' if name not in old else 'removed' if name not in new else 'changed' if added or removed else 'unchanged',
+            'old_count': len(old_rules),
+            'new_count': len(new_rules),
+            'added': len(added),
+            'removed': len(removed),
+            'shrink_pct': shrink_pct,
+            'added_samples': sorted(added)[:sample_size],
+            'removed_samples': sorted(removed)[:sample_size],
+        })
+    return report
+
+def output_groups(rulesets_jsons, manifests=()):
+    """
+    汇总输出所属的规则组 {输出名: 规则组名}，新旧两份均计入（已删除的旧输出同样需要归组）：
+    1. 构建清单（build_manifest.json）记录了每个规则组的确切输出，优先使用。
+    2. 清单中没有的输出按 rulesets.json 推断：分片取 shard_of，domain / ipcidr 输出再去掉拆分后缀 _dm / _ip。
+    """
+    groups = {}
+    for rulesets_json in rulesets_jsons:
+        for name, info in rulesets_json.items():
+            if not isinstance(info, dict):
+                continue
+            base = info.get('shard_of') or name
+            for suffix, r_type in (('_dm', 'domain'), ('_ip', 'ipcidr')):
+                if base.endswith(suffix) and info.get('group_type') == r_type:
+                    base = base[:-len(suffix)]
+            groups[name] = base
+    for manifest in manifests:
+        for group_name, entry in manifest.items():
+            if isinstance(entry, dict) and isinstance(entry.get('outputs'), dict):
+                for name in entry['outputs']:
+                    groups[name] = group_name
+    return groups
+
+def merge_groups(rulesets, groups, rel_dir='Generated_rulesets'):
+    """
+    把同一规则组的全部输出（classical、_dm / _ip 拆分及其分片）合并为 '<rel_dir>/<规则组名>.yaml' 一项（规则取并集），
+    其余规则集保持不变。分片数变化、classical 与拆分输出互相切换时，单个文件的缩减不代表规则组真正缩水。
+    """
+    merged = {}
+    for path, rules in rulesets.items():
+        directory, _, filename = path.rpartition('/')
+        stem = filename[:-len('.yaml')]
+        if directory == rel_dir and stem in groups:
+            path = f"{directory}/{groups[stem]}.yaml"
+        merged.setdefault(path, set()).update(rules)
+    return merged
+
+def compare_rulesets_json(old_json, new_json):
+    """对比 rulesets.json 中的计数，返回 [(规则集, 旧计数, 新计数)]，仅列出变化项"""
+    changes = []
+    for name in sorted(old_json.keys() | new_json.keys()):
+        old_count = old_json.get(name, {}).get('rule_count')
+        new_count = new_json.get(name, {}).get('rule_count')
+        if old_count != new_count:
+            changes.append((name, old_count, new_count))
+    return changes
+
+def _load_json_at(project_root, rev, rel_path):
+    try:
+        if rev is None:
+            with open(os.path.join(project_root, rel_path), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return json.loads(_git(project_root, 'show', f"{rev}:{rel_path}"))
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return {}
+
+def print_report(report, json_changes, show_unchanged=False):
+    for entry in report:
+        if entry['status'] == 'unchanged' and not show_unchanged:
+            continue
+        print(f"\n[{entry['status']}] {entry['name']}: {entry['old_count']} -> {entry['new_count']} "
+              f"(+{entry['added']} / -{entry['removed']}"
+              + (f", 缩减 {entry['shrink_pct']}%" if entry['shrink_pct'] else "") + ")")
+        for rule in entry['added_samples']:
+            print(f"    + {rule}")
+        for rule in entry['removed_samples']:
+            print(f"    - {rule}")
+    if json_changes:
+        print("\nrulesets.json 计数变化:")
+        for name, old_count, new_count in json_changes:
+            print(f"    {name}: {old_count} -> {new_count}")
+
+if __name__ == "__main__":
+    project_root = project_paths.PROJECT_ROOT
+
+    parser = argparse.ArgumentParser(description="按规则集合比较两次生成结果，忽略时间戳与排序变化")
+    parser.add_argument('--old', default='HEAD', help="旧版本：git 提交（默认 HEAD）或包含相同目录结构的目录")
+    parser.add_argument('--new', default=None, help="新版本：目录，默认为当前工作目录")
+    parser.add_argument('--samples', type=int, default=5, help="每个规则集展示的新增 / 删除样例数")
+    parser.add_argument('--max-shrink', type=float, default=None, metavar='N',
+                        help="任一规则组缩减超过 N%% 时以非零状态退出（同一规则组的拆分与分片输出合计判断，整个规则组消失视为缩减 100%%）")
+    parser.add_argument('--allow-shrink', action='append', metavar='NAME',
+                        default=[n for n in os.environ.get('RULESETS_ALLOW_SHRINK', '').split(',') if n.strip()],
+                        help="已知的有意缩减（如删除或重组规则组）：该规则组或规则集不受 --max-shrink 限制，可重复指定；"
+                             "默认取环境变量 RULESETS_ALLOW_SHRINK（逗号分隔）")
+    parser.add_argument('--json', metavar='PATH', help="将完整报告写为 JSON")
+    parser.add_argument('--all', action='store_true', help="同时列出未变化的规则集")
+    args = parser.parse_args()
+
+    new_root = os.path.abspath(args.new) if args.new else project_root
+    if os.path.isdir(args.old):
+        old_root = os.path.abspath(args.old)
+        old = load_rulesets_from_dir(old_root)
+        old_json = _load_json_at(old_root, None, 'Generated_rulesets/rulesets.json')
+        old_manifest = _load_json_at(old_root, None, f'Generated_rulesets/{BUILD_MANIFEST_NAME}')
+    else:
+        old = load_rulesets_from_git(project_root, args.old)
+        old_json = _load_json_at(project_root, args.old, 'Generated_rulesets/rulesets.json')
+        old_manifest = _load_json_at(project_root, args.old, f'Generated_rulesets/{BUILD_MANIFEST_NAME}')
+    new = load_rulesets_from_dir(new_root)
+    new_json = _load_json_at(new_root, None, 'Generated_rulesets/rulesets.json')
+    new_manifest = _load_json_at(new_root, None, f'Generated_rulesets/{BUILD_MANIFEST_NAME}')
+
+    report = diff_rulesets(old, new, args.samples)
+    json_changes = compare_rulesets_json(old_json, new_json)
+    print_report(report, json_changes, args.all)
+
+    changed = [e for e in report if e['status'] != 'unchanged']
+    print(f"\n共 {len(report)} 个规则集，{len(changed)} 个有变化："
+          f"+{sum(e['added'] for e in report)} / -{sum(e['removed'] for e in report)}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'rulesets': report, 'rulesets_json_changes': json_changes}, f, ensure_ascii=False, indent=2)
+
+    if args.max_shrink is not None:
+        # 按规则组合计后再判断，分片数变化或拆分方式变化引起的单个文件缩减不算异常
+        groups = output_groups((old_json, new_json), (old_manifest, new_manifest))
+        group_report = diff_rulesets(merge_groups(old, groups), merge_groups(new, groups), 0)
+        allowed = {n.strip() for n in args.allow_shrink}
+        violations = []
+        for e in group_report:
+            if e['shrink_pct'] <= args.max_shrink:
+                continue
+            if e['name'] in allowed or e['name'].rpartition('/')[2][:-len('.yaml')] in allowed:
+                print(f"\n提示: {e['name']} 缩减 {e['shrink_pct']}%，已通过 --allow-shrink 允许")
+                continue
+            violations.append(e)
+        if violations:
+            print(f"\n错误: 以下规则集缩减超过 {args.max_shrink}%:")
+            for e in violations:
+                print(f"    {e['name']}: {e['old_count']} -> {e['new_count']} (-{e['shrink_pct']}%)")
+            print("确认为有意调整时，以 --allow-shrink <规则组名> 或环境变量 RULESETS_ALLOW_SHRINK 放行。")
+            sys.exit(1)
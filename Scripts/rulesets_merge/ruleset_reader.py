@@ -0,0 +1,183 @@
+import os
+import mmap
+
+# 规则集输出格式（merge_and_save_rulesets 与 list2yaml.save_to_yaml 写出）：
+#   '# 键: 值' 注释头部 -> 'payload:' -> 每行 '  - 规则'（domain/ipcidr 规则带单引号）
+PAYLOAD_MARKER = b'payload:'
+ENTRY_PREFIX = b'  - '
+# 头部只在文件开头的这些字节内查找，不扫描正文
+HEADER_MAX_BYTES = 4096
+# 统计未声明条数的文件时，每次读取的块大小
+COUNT_BLOCK_BYTES = 1 << 22
+
+# 头部键 -> 属性名（两种输出的头部写法不同）
+_HEADER_KEYS = {
+    'Ruleset Type': 'rule_type',
+    'Type': 'rule_type',
+    'Generated time': 'generated_time',
+    'Generated': 'generated_time',
+    'Rule Count': 'declared_count',
+}
+
+class RulesetReader:
+    """
+    以只读 mmap 打开生成的规则集文件：
+    1. 构造时只解析 'payload:' 之前的头部（类型、生成时间、声明的条数），不读取正文。
+    2. iter_entries 逐条产出正文条目的 memoryview 切片（已去掉 '  - ' 前缀与单引号），不复制数据；
+       切片只在 close 之前有效，需要保留时用 bytes() 复制。
+    3. rules 整段解码正文后批量切分为 str 列表，适合需要全部规则的场景。
+    格式不符（找不到 payload 或条目前缀不对）时抛出 ValueError，由调用方决定是否回退到通用解析。
+    data（bytes）给出时直接解析内存中的内容（如 git show 的输出），不打开文件，path 仅用于错误信息。
+    """
+    def __init__(self, path, data=None):
+        self.path = path
+        self.rule_type = None
+        self.generated_time = None
+        self.declared_count = None
+        self._file = self._mm = None
+        try:
+            if data is not None:
+                self._buffer = data
+            else:
+                self._file = open(path, 'rb')
+                size = os.fstat(self._file.fileno()).st_size
+                # 空文件无法映射，按空内容处理（随后因缺少 payload 报错）
+                self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+                self._buffer = self._mm if self._mm is not None else b''
+            self._view = memoryview(self._buffer)
+            self.payload_offset = self._parse_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse_header(self):
+        view = self._view
+        head = bytes(view[:HEADER_MAX_BYTES])
+        pos = head.find(PAYLOAD_MARKER)
+        while pos > 0 and head[pos - 1:pos] != b'\n':
+            pos = head.find(PAYLOAD_MARKER, pos + 1)
+        if pos < 0:
+            raise ValueError(f"{self.path}: 头部 {HEADER_MAX_BYTES} 字节内未找到 'payload:'，不是规则集输出格式")
+        line_end = head.find(b'\n', pos)
+        if line_end < 0:
+            line_end = len(head)
+        if head[pos:line_end].rstrip(b'\r') != PAYLOAD_MARKER:
+            raise ValueError(f"{self.path}: 'payload:' 行格式不符")
+
+        for line in head[:pos].decode('utf-8', errors='replace').splitlines():
+            if not line.startswith('#'):
+                continue
+            key, sep, value = line[1:].partition(':')
+            attr = _HEADER_KEYS.get(key.strip())
+            if sep and attr:
+                value = value.strip()
+                if attr == 'declared_count':
+                    value = int(value) if value.isdigit() else None
+                setattr(self, attr, value)
+        return min(line_end + 1, len(view))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        view = getattr(self, '_view', None)
+        if view is not None:
+            view.release()
+        mm = getattr(self, '_mm', None)
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                # 调用方仍持有条目切片：映射在最后一个切片释放后由垃圾回收关闭
+                pass
+        self._view = self._mm = self._buffer = None
+        if self._file is not None:
+            self._file.close()
+
+    def payload(self):
+        """正文的 memoryview（不含头部），用于整体比较"""
+        return self._view[self.payload_offset:]
+
+    def payload_equals(self, data):
+        """正文是否与 data（bytes）完全一致：直接比较映射内存，不解码、不复制"""
+        return self.payload() == data
+
+    def count(self):
+        """规则条数：头部声明时直接返回，否则按块统计正文行数"""
+        if self.declared_count is not None:
+            return self.declared_count
+        view = self._view
+        end = len(view)
+        lines = 0
+        for start in range(self.payload_offset, end, COUNT_BLOCK_BYTES):
+            lines += bytes(view[start:min(start + COUNT_BLOCK_BYTES, end)]).count(b'\n')
+        # 最后一行可能没有换行符
+        if end > self.payload_offset and view[end - 1] != 0x0A:
+            lines += 1
+        return lines
+
+    def iter_entries(self):
+        """逐条产出正文条目的 memoryview 切片（去掉 '  - ' 前缀与单引号），跳过空行"""
+        view = self._view
+        pos, end = self.payload_offset, len(view)
+        prefix_len = len(ENTRY_PREFIX)
+        find = self._buffer.find
+        while pos < end:
+            line_end = find(b'\n', pos)
+            if line_end < 0:
+                line_end = end
+            stop = line_end
+            if stop > pos and view[stop - 1] == 0x0D:
+                stop -= 1
+            if stop > pos:
+                if view[pos:pos + prefix_len] != ENTRY_PREFIX:
+                    raise ValueError(f"{self.path}: 偏移 {pos} 处的条目缺少 '  - ' 前缀")
+                start = pos + prefix_len
+                if stop - start >= 2 and view[start] == 0x27 and view[stop - 1] == 0x27:
+                    start += 1
+                    stop -= 1
+                yield view[start:stop]
+            pos = line_end + 1
+
+    def rules(self):
+        """全部规则的 str 列表：整段解码后批量切分，比逐条解码 iter_entries 的切片更快"""
+        text = str(self.payload(), 'utf-8')
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        lines = text.split('\n')
+        if lines and not lines[-1]:
+            lines.pop()
+        n = len(lines)
+        # 快速路径：每行都以 "  - '" 开头、以 "'" 结尾（domain/ipcidr 输出），用整段计数代替逐行检查
+        if (text.count('\n  - ') + text.startswith('  - ') == n
+                and text.count("  - '") == n and text.count("'\n") + text.endswith("'") == n):
+            return [line[5:-1] for line in lines]
+        if not all(line.startswith('  - ') for line in lines if line):
+            raise ValueError(f"{self.path}: 存在缺少 '  - ' 前缀的条目")
+        return [line[5:-1] if len(line) > 5 and line[4] == "'" and line[-1] == "'" else line[4:]
+                for line in lines if line]
+
+def read_rules(path, data=None):
+    """
+    读取规则集文件的全部规则：生成的输出格式走 RulesetReader，
+    格式不符（如手工编辑的文件）时回退到 iter_clean_content 通用解析。
+    data（bytes）给出时解析该内容而不读取文件。
+    """
+    try:
+        with RulesetReader(path, data) as reader:
+            return reader.rules()
+    except ValueError:
+        # 延迟导入：rulesets_merge_tools 本身也使用本模块
+        from .rulesets_merge_tools import iter_clean_content
+        if data is not None:
+            return list(iter_clean_content(data.decode('utf-8', errors='replace')))
+        with open(path, 'r', encoding='utf-8') as f:
+            return list(iter_clean_content(f.read()))
+
+def read_header(path):
+    """只读取头部：返回 {'rule_type', 'generated_time', 'rule_count'}，条数未声明时按行统计"""
+    with RulesetReader(path) as reader:
+        return {'rule_type': reader.rule_type, 'generated_time': reader.generated_time, 'rule_count': reader.count()}
@@ -1,27 +1,63 @@
-import yaml
 import os
-import requests
+import io
+import re
+import zlib
 import json
 from datetime import datetime
 import time
+import random
+import hashlib
+import itertools
+import collections
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from . import fast_yaml
+from .http_cache import cached_get, load_stale, decode_body
+from .ip_ranges import optimize_ips
+from .domain_pool import DomainPool, optimize_domains
+from .mrs_format import MRS_BEHAVIORS, mrs_available, write_mrs
+from .ruleset_reader import RulesetReader
+from . import instrumentation
+
+# 并发下载参数：总线程数与单个主机的最大并发连接数
+FETCH_MAX_WORKERS = 8
+FETCH_PER_HOST_LIMIT = 4
+
+# 下载调度参数：单次请求默认超时（秒）、重试次数，以及指数退避的基数与上限（秒）
+FETCH_TIMEOUT = 5
+FETCH_RETRIES = 3
+FETCH_BACKOFF_BASE = 1.0
+FETCH_BACKOFF_MAX = 30.0
+# 上游源可在配置中单独指定的下载选项（不参与规则组输入哈希）
+FETCH_OPTION_KEYS = ('priority', 'timeout', 'critical')
+
+# 增量构建清单：记录每个规则组输入的哈希，输入未变化的组直接跳过
+# 处理逻辑变化导致输出不同的修改，需要同步提升 BUILD_MANIFEST_VERSION 以强制全量重建
+BUILD_MANIFEST_NAME = 'build_manifest.json'
+BUILD_MANIFEST_VERSION = 5
+
+# 分片输出：仅 domain/ipcidr 规则集可按稳定哈希拆分为多个文件
+SHARD_TYPES = ('domain', 'ipcidr')
 
 # ================= 工具函数区 =================
 
-def clean_content(content):
+def iter_clean_content(content):
     """
-    清洗规则内容：
+    清洗规则内容（生成器，逐行读取、逐条产出，不构造完整的行列表）：
     1. 移除注释、空行、空格行和 'payload:' 行。
     2. 移除引号并提取核心内容（去除 '- ' 前缀）。
     3. 永久移除 'PROCESS-', 'GEOSITE', 'GEOIP' 开头的规则。
     """
     if isinstance(content, str):
-        lines = content.splitlines()
+        lines = io.StringIO(content, newline=None)
     elif isinstance(content, list):
-        lines = [str(item) for item in content]
+        lines = (str(item) for item in content)
     else:
-        return []
+        return
 
-    cleaned = []
     banned_prefixes = ('PROCESS-', 'GEOSITE', 'GEOIP')
 
     for line in lines:
@@ -42,41 +78,179 @@ def clean_content(content):
             upper_core = core.upper()
             if upper_core.startswith(banned_prefixes):
                 continue
-            cleaned.append(core)
-            
-    return cleaned
+            yield core
 
-def optimize_domains(domain_list):
-    """域名去重核心逻辑：+.abc.com 覆盖 *.abc.com"""
-    temp_set = set(domain_list)
-    suffix_roots = set()
-    
-    for d in temp_set:
-        if d.startswith('+.'):
-            suffix_roots.add(d[2:].lower())
-    
-    final_domains = []
-    for d in sorted(list(temp_set)):
-        if d.startswith('+.'):
-            final_domains.append(d)
-            continue
-            
-        check_str = d.lower()
-        if check_str.startswith('*.'):
-            check_str = check_str[2:]
-            
-        parts = check_str.split('.')
-        is_covered = False
-        for i in range(len(parts)):
-            sub_domain = ".".join(parts[i:])
-            if sub_domain in suffix_roots:
-                is_covered = True
-                break
-        
-        if not is_covered:
-            final_domains.append(d)
-            
-    return final_domains
+def clean_content(content):
+    """清洗规则内容，返回列表（规则同 iter_clean_content）"""
+    return list(iter_clean_content(content))
+
+_IP_RULE_PREFIXES = ('IP-CIDR', 'IP-CIDR6', 'IP-SUFFIX')
+_BANNED_PREFIXES = ('PROCESS-', 'GEOSITE', 'GEOIP')
+
+# IP 语法字符集：仅由数字、'.'、'/' 组成（IPv4），或含 ':' 且仅由十六进制数字、':'、'.'、'/' 组成（IPv6）；
+# 数值范围（如 256.1.1.1、/33）由 optimize_ips 解析时校验并丢弃
+_IPV4_CHARS = '0123456789./'
+_IPV6_CHARS = '0123456789abcdefABCDEF:./'
+# 带类型规则的批量提取：在以 '\n' 连接的文本上匹配行首的类型前缀（字面量前缀由正则引擎快速定位），
+# 取第一个逗号后的值并去除两侧空白；大小写或格式不同的少数规则由 _TYPED_OTHER_RE 取出后逐条交给 classify_rule
+_TYPED_VALUE = r',[ \t]*([^,\n \t]*(?:[ \t]+[^,\n \t]+)*)'
+_DOMAIN_RULE_RE = re.compile(r'\nDOMAIN' + _TYPED_VALUE)
+_SUFFIX_RULE_RE = re.compile(r'\nDOMAIN-SUFFIX' + _TYPED_VALUE)
+_IP_RULE_RE = re.compile(r'\nIP-(?:CIDR6?|SUFFIX)' + _TYPED_VALUE)
+_TYPED_OTHER_RE = re.compile(r'\n(?!(?:DOMAIN|DOMAIN-SUFFIX|IP-CIDR|IP-CIDR6|IP-SUFFIX),)([^\n]+)')
+# 批量清洗时每块的字符数上限，块内一次性切分，避免整段内容同时展开为行列表
+CLASSIFY_BLOCK_CHARS = 1 << 22
+
+def is_ip_syntax(value):
+    """按字符集识别 IPv4 / IPv6 地址或 CIDR（替代 isdigit 启发式）"""
+    return not value.strip(_IPV4_CHARS) or (':' in value and not value.strip(_IPV6_CHARS))
+
+def classify_rule(rule):
+    """
+    分类 (Raw -> Standard)：
+    返回 ('domain', 值) / ('ip', 值)；DOMAIN-SUFFIX 转为 '+.' 形式，不支持的规则类型返回 None。
+    纯内容按 is_ip_syntax 识别 IP；含 ':' 或 '/' 却不是 IP 的内容返回 None。
+    """
+    parts = rule.split(',')
+    if len(parts) >= 2:
+        prefix, val = parts[0].strip().upper(), parts[1].strip()
+        if prefix == 'DOMAIN': return 'domain', val
+        elif prefix == 'DOMAIN-SUFFIX': return 'domain', f"+.{val}"
+        elif prefix in _IP_RULE_PREFIXES: return 'ip', val
+        return None
+    if is_ip_syntax(rule):
+        return 'ip', rule
+    if ':' in rule or '/' in rule:
+        return None
+    return 'domain', rule
+
+def _clean_block(text):
+    """
+    批量清洗一块文本（规则同 iter_clean_content），以列表推导逐步过滤，
+    返回清洗后的规则列表。
+    """
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [line.strip() for line in text.split('\n')]
+    lines = [line for line in lines if line and line[0] != '#' and (line[-1] != ':' or line.lower() != 'payload:')]
+    items = [line[2:].lstrip() if line[:2] == '- ' else line for line in lines]
+    cores = [item.strip("'").strip('"') for item in items if item and item[0] != '#']
+    return [core for core in cores
+            if core and (core[0] not in 'pPgG' or not core.upper().startswith(_BANNED_PREFIXES))]
+
+def classify_rules(rules):
+    """
+    批量分类已清洗的规则：带类型规则在整块文本上由预编译正则提取，纯内容以列表推导调用 C 实现的字符串方法，
+    直接得到域名与 IP 列表。
+    返回 (domains, ips, invalid)，分类结果与逐条调用 classify_rule 一致（不保持原顺序）。
+    """
+    domains, ips, invalid = [], [], []
+    if not rules:
+        return domains, ips, invalid
+    text = '\n'.join(rules)
+
+    if ',' in text:
+        typed = [r for r in rules if ',' in r]
+        rules = [r for r in rules if ',' not in r]
+        typed_text = '\n' + '\n'.join(typed)
+        domains.extend(_DOMAIN_RULE_RE.findall(typed_text))
+        domains.extend(['+.' + v for v in _SUFFIX_RULE_RE.findall(typed_text)])
+        ips.extend(_IP_RULE_RE.findall(typed_text))
+        for rule in _TYPED_OTHER_RE.findall(typed_text):
+            classified = classify_rule(rule)
+            if classified is not None:
+                (domains if classified[0] == 'domain' else ips).append(classified[1])
+        if not rules:
+            return domains, ips, invalid
+        text = '\n'.join(rules)
+
+    plain_ips = [r for r in rules if not r.strip(_IPV4_CHARS) or (':' in r and not r.strip(_IPV6_CHARS))]
+    if not plain_ips and ':' not in text and '/' not in text:
+        domains.extend(rules)
+        return domains, ips, invalid
+    ips.extend(plain_ips)
+    if len(plain_ips) < len(rules):
+        ip_set = set(plain_ips)
+        rest = [r for r in rules if r not in ip_set]
+        invalid = [r for r in rest if ':' in r or '/' in r]
+        if invalid:
+            rest = [r for r in rest if ':' not in r and '/' not in r]
+        domains.extend(rest)
+    return domains, ips, invalid
+
+def iter_classified_blocks(content, block_chars=CLASSIFY_BLOCK_CHARS):
+    """
+    逐块清洗并分类原始内容：产出 (domains, ips, invalid)。
+    字符串内容按约 block_chars 个字符在换行处切块，内存占用与块大小成正比；list 内容按 iter_clean_content 清洗后整体分类。
+    """
+    if isinstance(content, list):
+        yield classify_rules(list(iter_clean_content(content)))
+        return
+    if not isinstance(content, str):
+        return
+    start, length = 0, len(content)
+    while start < length:
+        end = content.find('\n', start + block_chars) if start + block_chars < length else -1
+        end = length if end < 0 else end
+        yield classify_rules(_clean_block(content[start:end]))
+        start = end + 1
+
+class ClassifiedSource:
+    """已清洗分类的上游源：保存 iter_classified_blocks 的全部分块结果，可被多个规则组重复消费（不修改其中的列表）"""
+    __slots__ = ('blocks', 'lines_in')
+
+    def __init__(self, content):
+        self.blocks = list(iter_classified_blocks(content))
+        self.lines_in = content.count('\n') + 1
+
+class SourceStore:
+    """
+    批量构建的内容寻址共享存储：
+    1. 以上游内容的 sha256 为键，被多个规则组（可跨配置）引用的内容只在首次取用时清洗分类一次，结果分发给全部引用方。
+    2. 每个引用取走（take）或因跳过而释放（release）后引用计数减一，归零即释放清洗结果。
+    只被引用一次的内容不进入存储，仍由 process_group 流式清洗。
+    """
+    def __init__(self, contents, urls):
+        keys = {}
+        refs = collections.Counter()
+        for url in urls:
+            content = contents.get(url)
+            if content is None:
+                continue
+            if url not in keys:
+                keys[url] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            refs[keys[url]] += 1
+        self._keys = {url: key for url, key in keys.items() if refs[key] > 1}
+        self._refs = refs
+        self._entries = {}
+        self.classified = 0
+        self.served = 0
+
+    def shared_count(self):
+        return len(set(self._keys.values()))
+
+    def take(self, url, content):
+        """返回共享的 ClassifiedSource；URL 未被共享（或内容缺失）时原样返回 content"""
+        key = self._keys.get(url)
+        if key is None or content is None:
+            return content
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = ClassifiedSource(content)
+            self.classified += 1
+        self.served += 1
+        self._release_key(key)
+        return entry
+
+    def release(self, url):
+        key = self._keys.get(url)
+        if key is not None:
+            self._release_key(key)
+
+    def _release_key(self, key):
+        self._refs[key] -= 1
+        if self._refs[key] <= 0:
+            self._entries.pop(key, None)
 
 def format_for_classical(rule, rule_type):
     """还原 Classical 格式"""
@@ -100,8 +274,8 @@ def parse_rulesets_yaml(file_path):
 
     with open(file_path, 'r', encoding='utf-8') as f:
         try:
-            data = yaml.safe_load(f)
-        except yaml.YAMLError as e:
+            data = fast_yaml.safe_load(f)
+        except fast_yaml.YAMLError as e:
             print(f"解析 YAML 文件时出错: {e}")
             return {}
 
@@ -122,55 +296,182 @@ def parse_rulesets_yaml(file_path):
             if not isinstance(rs, dict): continue
             if not rs.get('name') or not rs.get('url'): continue
             
-            valid_rulesets.append({
+            entry = {
                 'name': rs.get('name'),
                 'type': rs.get('type', 'classical'),
                 'url': rs.get('url')
-            })
+            }
+            # 可选下载选项：priority 越大越先下载，timeout 为单次请求超时（秒），
+            # critical 为 true 时该源失败则保留规则组上次的输出
+            if isinstance(rs.get('priority'), int):
+                entry['priority'] = rs['priority']
+            if isinstance(rs.get('timeout'), (int, float)) and rs['timeout'] > 0:
+                entry['timeout'] = rs['timeout']
+            if rs.get('critical') is True:
+                entry['critical'] = True
+            valid_rulesets.append(entry)
         
         if valid_rulesets:
             parsed_data[group_title] = {
                 'groupname': group_name,
                 'rulesets': valid_rulesets
             }
+            # 可选：domain/ipcidr 输出超过 shard_size 条时拆分为多个分片
+            shard_size = group_content.get('shard_size')
+            if isinstance(shard_size, int) and shard_size > 0:
+                parsed_data[group_title]['shard_size'] = shard_size
 
     print(f"已解析配置，共 {len(parsed_data)} 个规则组。")
     return parsed_data
 
-def fetch_ruleset_content(url, retries=3):
-    """下载规则内容"""
-    print(f"  -> 正在下载: {url} ...", end="", flush=True)
+_thread_local = threading.local()
+_print_lock = threading.Lock()
+
+def get_http_session():
+    """获取当前线程的 keep-alive 会话，同一线程内的请求复用连接池"""
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        # requests 导入开销较大，只在第一次需要下载时导入
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=FETCH_MAX_WORKERS,
+            pool_maxsize=FETCH_PER_HOST_LIMIT
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _thread_local.session = session
+    return session
+
+def _host_semaphores(urls, limit):
+    """为本次下载的每个主机名分配信号量，限制同一主机的并发请求数：返回 {url: 信号量}，同一主机的 URL 共用一个"""
+    by_host = {}
+    return {url: by_host.setdefault(urlparse(url).netloc.lower(), threading.BoundedSemaphore(limit)) for url in urls}
+
+def backoff_delay(attempt, base=FETCH_BACKOFF_BASE, cap=FETCH_BACKOFF_MAX):
+    """第 attempt 次（从 0 开始）失败后的等待时间：指数退避并加入全抖动，避免并发重试同时打到上游"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def fetch_ruleset_content(url, retries=FETCH_RETRIES, session=None, timeout=FETCH_TIMEOUT, deadline=None):
+    """
+    下载规则内容（日志整行输出，避免并发时交错）：
+    1. 通过条件请求访问上游，304 时直接复用本地缓存；响应体流式读取，连接中断时按 Range 续传。
+    2. 失败后按指数退避加抖动重试；deadline（time.monotonic() 时间点）给出时，
+       单次超时与等待时间均不超过剩余预算，预算耗尽后不再发起请求。
+    3. 重试耗尽或预算耗尽后回退到未过期的旧缓存。
+    启用埋点时记录一条 fetch 事件：字节数、耗时、重试次数与最终状态。
+    """
+    session = session or get_http_session()
+    status = []
+    start = time.perf_counter()
+
+    def report(result, body=None, attempts=retries):
+        with _print_lock:
+            print(f"  -> 下载: {url} {' '.join(status)}", flush=True)
+        instrumentation.emit(
+            'fetch', url=url, status=result, bytes=len(body) if body is not None else 0,
+            retries=max(0, attempts - 1), seconds=round(time.perf_counter() - start, 6)
+        )
+
+    attempts = 0
     for i in range(retries):
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            status.append("[超出预算]")
+            break
+        attempts = i + 1
         try:
-            response = requests.get(url, timeout=5)
-            if response.status_code == 200:
-                print(" [成功]")
-                return response.text
+            status_code, body, encoding = cached_get(session, url, timeout=timeout if remaining is None else min(timeout, remaining), deadline=deadline)
+            if body is not None:
+                status.append("[未变更]" if status_code == 304 else "[成功]")
+                report('not_modified' if status_code == 304 else 'ok', body, attempts)
+                return decode_body(body, encoding)
             else:
-                print(f" [{response.status_code}]", end="", flush=True)
+                status.append(f"[{status_code}]")
         except Exception as e:
             if i < retries - 1:
-                print(f" [R{i+1}]", end="", flush=True)
+                status.append(f"[R{i+1}]")
             else:
-                print(" [失败]")
-            time.sleep(1)
+                status.append("[失败]")
+        if i < retries - 1:
+            delay = backoff_delay(i)
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+    body, encoding = load_stale(url)
+    if body is not None:
+        status.append("[使用旧缓存]")
+        report('stale', body, attempts)
+        return decode_body(body, encoding)
+    report('failed', attempts=attempts)
     return None
 
+def collect_fetch_options(rulesets):
+    """
+    汇总各 URL 的下载选项：同一 URL 被多个规则组引用时取最高优先级、最长超时，任一处标记 critical 即为关键源。
+    返回 {url: {'priority', 'timeout', 'critical'}}，按首次出现顺序排列。
+    """
+    options = {}
+    for rs in rulesets:
+        opt = options.setdefault(rs['url'], {'priority': 0, 'timeout': FETCH_TIMEOUT, 'critical': False})
+        if 'priority' in rs:
+            opt['priority'] = max(opt['priority'], rs['priority'])
+        if 'timeout' in rs:
+            opt['timeout'] = max(opt['timeout'], rs['timeout'])
+        opt['critical'] = opt['critical'] or rs.get('critical', False)
+    return options
+
+def fetch_all_rulesets(urls, max_workers=FETCH_MAX_WORKERS, per_host_limit=FETCH_PER_HOST_LIMIT, options=None, budget=None):
+    """
+    并发下载阶段：
+    1. 对 URL 去重（保持原始顺序），按优先级从高到低提交（同优先级时关键源在前）。
+    2. 使用有界线程池并发下载，同一主机的并发数受 per_host_limit 限制。
+    3. budget（秒）给出时全部下载共享同一截止时间，超出后未完成的源回退到旧缓存。
+    4. 返回 {url: content}，下载失败的 URL 对应 None。
+    options 为 collect_fetch_options 的返回值，缺省时全部使用默认超时。
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return {}
+    options = options or {}
+    deadline = time.monotonic() + budget if budget else None
+    # 信号量按次创建，每次调用的 per_host_limit 均生效
+    host_semaphores = _host_semaphores(unique_urls, per_host_limit)
+
+    def task(url):
+        opt = options.get(url, {})
+        with host_semaphores[url]:
+            return fetch_ruleset_content(url, timeout=opt.get('timeout', FETCH_TIMEOUT), deadline=deadline)
+
+    ordered = sorted(unique_urls, key=lambda url: (
+        -options.get(url, {}).get('priority', 0), not options.get(url, {}).get('critical', False)))
+    workers = max(1, min(max_workers, len(unique_urls)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(ordered, executor.map(task, ordered)))
+    return {url: results[url] for url in unique_urls}
+
 def parse_supply_files(supply_dir):
     """
     解析补丁文件 (修正版)
     仅读取 payload 列表，避免读取到 header 元数据
+    supply_dir 可以是单个目录或目录列表，多个目录中同一规则组的补丁按目录顺序合并。
     """
     supply_data = {} 
-    if not os.path.exists(supply_dir):
+    if isinstance(supply_dir, (list, tuple)):
+        for single_dir in supply_dir:
+            for group_name, rulesets in parse_supply_files(single_dir).items():
+                supply_data.setdefault(group_name, []).extend(rulesets)
+        return supply_data
+    if not supply_dir or not os.path.exists(supply_dir):
         return supply_data
 
-    for filename in os.listdir(supply_dir):
+    for filename in sorted(os.listdir(supply_dir)):
         if filename.startswith('supply_') and filename.endswith('.yaml'):
             file_path = os.path.join(supply_dir, filename)
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
-                    raw = yaml.safe_load(f)
+                    raw = fast_yaml.safe_load(f)
                 
                 if not raw or not isinstance(raw, dict): continue
                 
@@ -198,112 +499,523 @@ def parse_supply_files(supply_dir):
                 continue
     return supply_data
 
+def compute_group_hash(group_info, contents, supply_rulesets):
+    """
+    计算规则组的输入哈希：
+    覆盖配置条目、各上游源的内容（按配置顺序）以及本地补丁内容。
+    """
+    h = hashlib.sha256()
+    h.update(f"v{BUILD_MANIFEST_VERSION}\n".encode('utf-8'))
+    hashed_info = dict(group_info, rulesets=[
+        {k: v for k, v in rs.items() if k not in FETCH_OPTION_KEYS} for rs in group_info['rulesets']])
+    h.update(json.dumps(hashed_info, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for rs in group_info['rulesets']:
+        content = contents.get(rs['url'])
+        h.update(f"\0src:{rs['url']}\0".encode('utf-8'))
+        h.update(b"\1" if content is None else content.encode('utf-8'))
+    for s_rs in supply_rulesets or []:
+        h.update(f"\0supply:{s_rs['name']}\0".encode('utf-8'))
+        h.update(s_rs['content'].encode('utf-8'))
+    return h.hexdigest()
+
+def load_build_manifest(target_output_dir):
+    """读取增量构建清单，不存在或损坏时返回空字典"""
+    manifest_path = os.path.join(target_output_dir, BUILD_MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def output_formats(r_type, mrs=False):
+    """输出格式列表：始终包含 yaml，开启 mrs 时 domain/ipcidr 额外输出 .mrs"""
+    if mrs and r_type in MRS_BEHAVIORS:
+        return ['yaml', 'mrs']
+    return ['yaml']
+
+def _manifest_entry_usable(entry, group_hash, target_output_dir, mrs=False):
+    """清单条目可复用：哈希一致、输出格式与本次要求一致，且记录的输出文件均存在"""
+    if not isinstance(entry, dict) or entry.get('hash') != group_hash:
+        return False
+    outputs = entry.get('outputs')
+    if not isinstance(outputs, dict) or not outputs:
+        return False
+    for name, info in outputs.items():
+        if not isinstance(info, dict):
+            return False
+        formats = info.get('format')
+        if formats != output_formats(info.get('group_type'), mrs):
+            return False
+        if not all(os.path.exists(os.path.join(target_output_dir, f"{name}.{fmt}")) for fmt in formats):
+            return False
+    return True
+
+def _previous_outputs_exist(entry, target_output_dir):
+    """清单条目记录的输出文件均存在（不比较哈希与输出格式），用于关键源失败时保留上次输出"""
+    if not isinstance(entry, dict) or not isinstance(entry.get('outputs'), dict) or not entry['outputs']:
+        return False
+    return all(
+        isinstance(info, dict) and all(
+            os.path.exists(os.path.join(target_output_dir, f"{name}.{fmt}")) for fmt in info.get('format') or ['yaml'])
+        for name, info in entry['outputs'].items()
+    )
+
+def _ruleset_header(r_type, rule_count, generated_time):
+    return f"# Ruleset Type:  {r_type}\n# Generated time: {generated_time}\n# Rule Count: {rule_count}\npayload:\n"
+
+def _payload_line_format(r_type):
+    """classical 不加引号，domain/ipcidr 使用单引号"""
+    return "  - {}".format if r_type == 'classical' else "  - '{}'".format
+
+def write_ruleset_file(file_path, r_type, rules, rule_count, generated_time):
+    """
+    流式写出规则文件：头部 + 逐条 payload（带缓冲，不拼接整段字符串）。
+    classical 不加引号，domain/ipcidr 使用单引号；文件末尾无换行，与既有输出保持一致。
+    """
+    header = _ruleset_header(r_type, rule_count, generated_time)
+    line_fmt = _payload_line_format(r_type)
+
+    with open(file_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write(header)
+        rules = iter(rules)
+        for first in rules:
+            f.write(line_fmt(first))
+            break
+        f.writelines("\n" + line_fmt(r) for r in rules)
+
+def write_rendered_ruleset_file(file_path, r_type, rules, rule_count, generated_time):
+    """按 write_ruleset_file 的格式整段生成并写出规则文件，返回写出的字节内容（供 rendered 收集）"""
+    body = (_ruleset_header(r_type, rule_count, generated_time)
+            + '\n'.join(map(_payload_line_format(r_type), rules))).encode('utf-8')
+    with open(file_path, 'wb') as f:
+        f.write(body)
+    return body
+
+def write_ruleset_file_if_changed(file_path, r_type, rules, generated_time, rendered=None):
+    """
+    payload 与现有文件完全一致时保留原文件（包括原生成时间），字节不变，CDN 可继续返回 304；
+    否则按 write_ruleset_file 的格式重写。rules 须为列表，返回是否写入。
+    rendered 给出时把文件的完整内容记入 rendered[文件名]（未变化时按原生成时间重建，与磁盘内容一致）。
+    """
+    payload = '\n'.join(map(_payload_line_format(r_type), rules))
+    # 现有文件经 mmap 直接与新 payload 比较，不解码整个文件
+    existing_time = None
+    try:
+        with RulesetReader(file_path) as reader:
+            if reader.rule_type == r_type and reader.payload_equals(payload.encode('utf-8')):
+                existing_time = reader.generated_time
+    except (OSError, ValueError):
+        pass
+    if existing_time is not None:
+        if rendered is not None:
+            rendered[os.path.basename(file_path)] = (_ruleset_header(r_type, len(rules), existing_time) + payload).encode('utf-8')
+        return False
+    body = (_ruleset_header(r_type, len(rules), generated_time) + payload).encode('utf-8')
+    with open(file_path, 'wb') as f:
+        f.write(body)
+    if rendered is not None:
+        rendered[os.path.basename(file_path)] = body
+    return True
+
+def shard_count_for(rule_count, shard_size):
+    """分片数取使平均分片不超过 shard_size 的最小 2 的幂：规则增长导致分片数翻倍时，每个分片恰好一分为二"""
+    shard_count = 1
+    while rule_count > shard_count * shard_size:
+        shard_count <<= 1
+    return shard_count
+
+def shard_index(rule, shard_count):
+    """稳定分片：按规则文本（小写）的 CRC32 取模，不受进程哈希种子影响，同一规则始终落入同一分片"""
+    return zlib.crc32(rule.lower().encode('utf-8')) & (shard_count - 1)
+
+def _remove_stale_outputs(group_name, group_outputs, target_output_dir):
+    """
+    删除规则组本次不再输出的旧文件：规则组可能的输出名（原名、_dm、_ip）及其分片 _s<i> 的 .yaml / .mrs 中，
+    不在 group_outputs（含各自的 format）内的全部删除。
+    覆盖分片数减少、分片与不分片互相切换、拆分与 classical 互相切换、不再输出 .mrs 等情况，
+    避免旧文件被提交，或被 overlap_index / ruleset_diff 当作有效规则集读取。
+    """
+    bases = '|'.join(re.escape(group_name + suffix) for suffix in ('', '_dm', '_ip'))
+    pattern = re.compile(rf'(?:{bases})(?:_s\d+)?\.(?:yaml|mrs)')
+    current = {f"{name}.{fmt}" for name, info in group_outputs.items() for fmt in info['format']}
+    for filename in sorted(os.listdir(target_output_dir)):
+        if pattern.fullmatch(filename) and filename not in current:
+            os.remove(os.path.join(target_output_dir, filename))
+            print(f"  -> 删除过期输出: {filename}")
+
+def save_sharded_output(group_name, out_name, r_type, rules, shard_size, target_output_dir, generated_time, formats, rendered=None):
+    """
+    将超过 shard_size 条的 domain/ipcidr 输出按稳定哈希拆分为 <out_name>_s<i> 分片写出：
+    1. 各分片内保持原有排序，内容未变化的分片不重写（.yaml 与 .mrs 均保留原字节）。
+    2. 返回写入 rulesets.json 的分片信息，shard_of 记录所属的原输出名，供模板组装展开。
+    rendered 给出时收集各分片的内容（未重写的 .mrs 除外）。
+    """
+    shard_count = shard_count_for(len(rules), shard_size)
+    buckets = [[] for _ in range(shard_count)]
+    for rule in rules:
+        buckets[shard_index(rule, shard_count)].append(rule)
+
+    outputs = {}
+    unchanged = 0
+    for index, bucket in enumerate(buckets):
+        shard_name = f"{out_name}_s{index}"
+        with instrumentation.stage('save', group=group_name, output=shard_name, rule_count=len(bucket), format=formats) as save_stage:
+            changed = write_ruleset_file_if_changed(os.path.join(target_output_dir, f"{shard_name}.yaml"), r_type, bucket, generated_time, rendered)
+            mrs_path = os.path.join(target_output_dir, f"{shard_name}.mrs")
+            if 'mrs' in formats and (changed or not os.path.exists(mrs_path)):
+                data = write_mrs(mrs_path, r_type, bucket)
+                if rendered is not None and data is not None:
+                    rendered[f"{shard_name}.mrs"] = data
+            save_stage['changed'] = changed
+        unchanged += not changed
+        outputs[shard_name] = {"group_type": r_type, "rule_count": len(bucket), "format": formats,
+                               "shard_of": out_name, "shard_index": index, "shard_count": shard_count}
+    print(f"  -> 分片输出: {out_name} -> {shard_count} 个分片 (每片平均不超过 {shard_size} 条，{unchanged} 个未变化)")
+    return outputs
+
 # ================= 核心逻辑区 =================
 
-def merge_and_save_rulesets(base_results, supply_folder_path, target_output_dir):
+def process_group(group_title, group_info, sources, supply_count, target_output_dir, generated_time, mrs=False, rendered=None):
+    """
+    处理单个规则组：清洗、分类、去重优化、输出决策与保存。
+    sources 为该组全部原始内容（上游源按配置顺序，之后是补丁），消费后会被清空以尽早释放内存。
+    mrs=True 时 domain/ipcidr 输出额外写出同名 .mrs 二进制文件。
+    rendered 给出时把写出的文件内容记入 rendered[文件名]，调用方无需再从磁盘读回。
+    不依赖任何全局状态，可在子进程中执行。返回 {out_name: info}，无有效规则时返回空字典。
+    """
+    group_name = group_info['groupname']
+    with instrumentation.stage('group', group=group_name) as group_stage:
+        group_outputs = _process_group(group_title, group_info, sources, supply_count, target_output_dir, generated_time, mrs, rendered)
+        group_stage['peak_rss_mb'] = instrumentation.peak_memory_mb()
+    return group_outputs
+
+def _process_group(group_title, group_info, sources, supply_count, target_output_dir, generated_time, mrs, rendered=None):
+    group_name = group_info['groupname']
+    print(f"\n[处理中] 规则组: {group_title} ({group_name})")
+    if supply_count:
+        print(f"  -> 合并本地补丁: {supply_count} 个文件")
+
+    # 1~3. 流式清洗与分类：上游内容与补丁逐条清洗后直接进入去重池（域名进入紧凑的 DomainPool）
+    dm_pool = DomainPool()
+    ip_pool = set()
+    count_before = 0
+    source_names = [rs['name'] for rs in group_info['rulesets']]
+    missing = [name for name, content in zip(source_names, sources) if content is None]
+    if missing:
+        print(f"  -> 警告: 上游源 {', '.join(missing)} 下载失败，本次输出缺少这些源")
+    for index, content in enumerate(sources):
+        if not content: continue
+        source_name = source_names[index] if index < len(source_names) else 'supply'
+        shared = isinstance(content, ClassifiedSource)
+        with instrumentation.stage('clean', group=group_name, source=source_name, shared=shared) as clean_stage:
+            if instrumentation.enabled():
+                clean_stage['lines_in'] = (content.lines_in if shared else
+                                           content.count('\n') + 1 if isinstance(content, str) else len(content))
+            count_source = 0
+            invalid_count, invalid_sample = 0, None
+            for domains, ips, invalid in (content.blocks if shared else iter_classified_blocks(content)):
+                count_source += len(domains) + len(ips)
+                dm_pool.update(domains)
+                ip_pool.update(ips)
+                if invalid:
+                    invalid_count += len(invalid)
+                    invalid_sample = invalid_sample or invalid[0]
+            if invalid_count:
+                print(f"  -> {source_name}: 丢弃无法识别的规则 {invalid_count} 条 (如: {invalid_sample})")
+            clean_stage['rules_out'] = count_source
+        count_before += count_source
+    sources.clear()
+
+    if not dm_pool and not ip_pool:
+        print("  -> 无有效规则，跳过。")
+        return {}
+
+    # 4. 去重与优化
+    with instrumentation.stage('optimize', group=group_name, step='optimize_ips', items_in=len(ip_pool)) as opt_stage:
+        ip_pool = optimize_ips(ip_pool)
+        opt_stage['items_out'] = len(ip_pool)
+    with instrumentation.stage('optimize', group=group_name, step='optimize_domains') as opt_stage:
+        domain_pool, dm_pool = dm_pool, dm_pool.optimize()
+        opt_stage['items_in'] = domain_pool.unique_count
+        opt_stage['items_out'] = len(dm_pool)
+    
+    count_after = len(dm_pool) + len(ip_pool)
+    print(f"  -> 规则优化: {count_before} -> {count_after} (去重: {count_before - count_after})")
+
+    # 5. 输出决策
+    valid_outputs = [] 
+    total_count = len(dm_pool) + len(ip_pool)
+    
+    if dm_pool and not ip_pool:
+        valid_outputs.append({'type': 'domain', 'rules': dm_pool})
+    elif ip_pool and not dm_pool:
+        valid_outputs.append({'type': 'ipcidr', 'rules': ip_pool})
+    elif dm_pool and ip_pool and total_count > 1200:
+        valid_outputs.append({'type': 'domain', 'rules': dm_pool})
+        valid_outputs.append({'type': 'ipcidr', 'rules': ip_pool})
+    else: # 混合且少量 -> Classical
+        combined_rules = itertools.chain(
+            (format_for_classical(d, 'domain') for d in dm_pool),
+            (format_for_classical(i, 'ip') for i in ip_pool)
+        )
+        valid_outputs.append({'type': 'classical', 'rules': combined_rules, 'count': total_count})
+
+    # 6. 保存
+    group_outputs = {}
+    type_suffixes = {'classical': '', 'domain': '_dm', 'ipcidr': '_ip'}
+    for out in valid_outputs:
+        r_type = out['type']
+        rules = out['rules']
+        rule_count = out['count'] if 'count' in out else len(rules)
+        
+        if len(valid_outputs) == 1:
+            out_name = group_name
+        else:
+            suffix = type_suffixes.get(r_type, f"_{r_type}")
+            out_name = f"{group_name}{suffix}"
+
+        shard_size = group_info.get('shard_size')
+        if shard_size and r_type in SHARD_TYPES and rule_count > shard_size:
+            group_outputs.update(save_sharded_output(group_name, out_name, r_type, rules, shard_size,
+                                                     target_output_dir, generated_time, output_formats(r_type, mrs), rendered))
+            continue
+        
+        file_path = os.path.join(target_output_dir, f"{out_name}.yaml")
+        formats = output_formats(r_type, mrs)
+        with instrumentation.stage('save', group=group_name, output=out_name, rule_count=rule_count, format=formats):
+            if rendered is None:
+                write_ruleset_file(file_path, r_type, rules, rule_count, generated_time)
+            else:
+                rendered[f"{out_name}.yaml"] = write_rendered_ruleset_file(file_path, r_type, rules, rule_count, generated_time)
+            if 'mrs' in formats:
+                data = write_mrs(os.path.join(target_output_dir, f"{out_name}.mrs"), r_type, rules)
+                if rendered is not None and data is not None:
+                    rendered[f"{out_name}.mrs"] = data
+                print(f"  -> 输出 MRS: {out_name}.mrs")
+        
+        group_outputs[out_name] = {"group_type": r_type, "rule_count": rule_count, "format": formats}
+
+    _remove_stale_outputs(group_name, group_outputs, target_output_dir)
+    return group_outputs
+
+def _process_group_task(args, metrics=False, render=False):
+    """
+    子进程入口：执行 process_group 并捕获其日志与埋点事件，由主进程按规则组顺序统一输出；
+    render=True 时一并回传写出的文件内容。
+    """
+    if metrics:
+        # fork 启动的子进程会继承主进程已记录的事件，先清空，只回传本组事件
+        instrumentation.enable()
+        instrumentation.drain()
+    rendered = {} if render else None
+    log_buffer = io.StringIO()
+    with contextlib.redirect_stdout(log_buffer):
+        group_outputs = process_group(*args, rendered=rendered)
+    return group_outputs, log_buffer.getvalue(), instrumentation.drain(), rendered
+
+def merge_and_save_rulesets(base_results, supply_folder_path, target_output_dir, max_workers=FETCH_MAX_WORKERS, force=False, jobs=1, mrs=False, shard_size=0, fetch_budget=None,
+                            fetched_contents=None, source_store=None, rendered=None):
+    """
+    合并并保存全部规则组：
+    1. 并发下载全部上游源。
+    2. 依据增量构建清单跳过输入未变化的规则组。
+    3. 其余规则组串行处理，或在 jobs > 1 时交给进程池并行处理。
+    rulesets.json 始终按配置顺序写出，与串行运行结果一致。
+    mrs=True 时额外输出 .mrs 二进制规则集（需要 zstandard，未安装时仅输出 YAML）。
+    shard_size > 0 时作为未单独配置 shard_size 的规则组的默认分片大小。
+    fetch_budget（秒）给出时作为全部下载的总时间预算。
+    关键源（critical: true）下载失败且无可用旧缓存时，该规则组保留上次的输出，不写出缺少该源的结果。
+    supply_folder_path 可以是单个补丁目录或目录列表。
+    fetched_contents / source_store 由 merge_and_save_batch 传入：给出时不再下载，直接使用已下载内容与共享清洗结果。
+    rendered 给出时（字典）收集本次写出的文件内容 {文件名: bytes}，包括 rulesets.json；
+    输入未变化而跳过的规则组、关键源失败保留的输出与未重写的分片 .mrs 不在其中。
+    """
     if not os.path.exists(target_output_dir):
         os.makedirs(target_output_dir)
 
+    if mrs and not mrs_available():
+        print("警告: 未安装 zstandard，跳过 .mrs 输出 (pip install zstandard)。")
+        mrs = False
+
     supply_dict = parse_supply_files(supply_folder_path)
+
+    # 0. 并发下载全部上游源（同一 URL 只下载一次）
+    all_rulesets = [rs for group_info in base_results.values() for rs in group_info['rulesets']]
+    all_urls = [rs['url'] for rs in all_rulesets]
+    if fetched_contents is None:
+        budget_note = f", 时间预算: {fetch_budget}s" if fetch_budget else ""
+        print(f"\n[下载中] 共 {len(set(all_urls))} 个上游源 (并发: {max_workers}{budget_note})")
+        fetched_contents = fetch_all_rulesets(all_urls, max_workers=max_workers,
+                                              options=collect_fetch_options(all_rulesets), budget=fetch_budget)
+    else:
+        # 批量构建共享同一份下载结果，复制字典后再按引用释放
+        fetched_contents = {url: fetched_contents.get(url) for url in all_urls}
+
+    # 每个 URL 在最后一个引用它的规则组取走后即从字典释放，避免全部原始内容同时驻留内存
+    url_refs = collections.Counter(all_urls)
+
+    def take_contents(rulesets):
+        taken = [fetched_contents.get(rs['url']) for rs in rulesets]
+        for rs in rulesets:
+            url_refs[rs['url']] -= 1
+            if url_refs[rs['url']] <= 0:
+                fetched_contents.pop(rs['url'], None)
+        return taken
+
+    def share_contents(rulesets, sources, processed):
+        """批量构建时把被共享的源替换为共享存储中的清洗结果；不处理的规则组只释放其引用"""
+        if source_store is None:
+            return sources
+        if not processed:
+            for rs in rulesets:
+                source_store.release(rs['url'])
+            return sources
+        return [source_store.take(rs['url'], content) for rs, content in zip(rulesets, sources)]
+
     final_output_info = {}
+    # force 时不跳过任何规则组，但仍读取清单，以便关键源失败时保留上次输出
+    old_manifest = load_build_manifest(target_output_dir)
+    new_manifest = {}
+    skipped_groups = 0
+    kept_groups = 0
     generated_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    for group_title, group_info in base_results.items():
+    executor = None
+    if jobs > 1:
+        # 进程池模块（含 multiprocessing）只在并行处理时导入
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+    if executor:
+        print(f"\n[并行处理] 进程数: {jobs}")
+
+    def finish_group(group_title, group_info, group_hash, result):
+        """
+        按配置顺序汇总单个规则组的结果，result 为以下之一：
+        - 清单条目：输入未变化，复用现有输出；
+        - ('kept', 失败的关键源, 清单条目或 None)：关键源下载失败，保留上次输出或不输出；
+        - (输出信息, 日志, 埋点事件, 写出的文件内容)：本次处理的结果。
+        """
+        nonlocal skipped_groups, kept_groups
         group_name = group_info['groupname']
-        rulesets = group_info['rulesets']
-        
-        print(f"\n[处理中] 规则组: {group_title} ({group_name})")
-        
-        all_raw_rules = [] 
-        
-        # 1. 下载
-        for rs in rulesets:
-            content = fetch_ruleset_content(rs['url'])
-            if content:
-                all_raw_rules.extend(clean_content(content))
-        
-        # 2. 合并补丁
-        if group_name in supply_dict:
-            print(f"  -> 合并本地补丁: {len(supply_dict[group_name])} 个文件")
-            for s_rs in supply_dict[group_name]:
-                all_raw_rules.extend(clean_content(s_rs['content']))
-
-        if not all_raw_rules:
-            print("  -> 无有效规则，跳过。")
-            continue
+        if group_hash is None:
+            print(f"\n[处理中] 规则组: {group_title} ({group_name})")
+            print("  -> 输入未变化，保留现有输出。")
+            final_output_info.update(result['outputs'])
+            new_manifest[group_name] = result
+            skipped_groups += 1
+            return
+        if result[0] == 'kept':
+            _, failed_sources, old_entry = result
+            print(f"\n[处理中] 规则组: {group_title} ({group_name})")
+            if old_entry is None:
+                print(f"  -> 警告: 关键源 {', '.join(failed_sources)} 下载失败且没有上次的输出，本次不生成该规则组。")
+                return
+            print(f"  -> 警告: 关键源 {', '.join(failed_sources)} 下载失败，保留上次的输出。")
+            final_output_info.update(old_entry['outputs'])
+            # 保留旧哈希，关键源恢复后下次运行会重新生成
+            new_manifest[group_name] = old_entry
+            kept_groups += 1
+            return
+        group_outputs, log_text, events, group_rendered = result
+        instrumentation.extend(events)
+        if group_rendered:
+            rendered.update(group_rendered)
+        if log_text:
+            print(log_text, end="")
+        if group_outputs:
+            final_output_info.update(group_outputs)
+            new_manifest[group_name] = {"hash": group_hash, "outputs": group_outputs}
 
-        # 3. 分类 (Raw -> Standard)
-        dm_pool = []
-        ip_pool = []
-        
-        for r in all_raw_rules:
-            parts = r.split(',')
-            if len(parts) >= 2:
-                prefix, val = parts[0].strip().upper(), parts[1].strip()
-                if prefix == 'DOMAIN': dm_pool.append(val)
-                elif prefix == 'DOMAIN-SUFFIX': dm_pool.append(f"+.{val}")
-                elif prefix in ['IP-CIDR', 'IP-CIDR6', 'IP-SUFFIX']: ip_pool.append(val)
-            else:
-                # 纯内容判断修正：排除带空格的行（避免 key: value 被误判为 IPv6）
-                if ('/' in r) or (r.replace('.','').isdigit()) or (':' in r and ' ' not in r):
-                    ip_pool.append(r)
+    # 串行模式下逐组即时处理；并行模式下提交进程池，之后按配置顺序收集结果与日志
+    pending = []
+    try:
+        for group_title, group_info in base_results.items():
+            group_name = group_info['groupname']
+            group_supply = supply_dict.get(group_name, [])
+            if shard_size > 0 and 'shard_size' not in group_info:
+                # 写入 group_info 使分片设置参与输入哈希，设置变化时重新生成
+                group_info = dict(group_info, shard_size=shard_size)
+
+            group_hash = compute_group_hash(group_info, fetched_contents, group_supply)
+            sources = take_contents(group_info['rulesets'])
+            old_entry = old_manifest.get(group_name)
+            if not force and _manifest_entry_usable(old_entry, group_hash, target_output_dir, mrs):
+                share_contents(group_info['rulesets'], sources, False)
+                if executor:
+                    pending.append((group_title, group_info, None, old_entry))
                 else:
-                    dm_pool.append(r)
+                    finish_group(group_title, group_info, None, old_entry)
+                continue
 
-        # 4. 去重与优化
-        count_before = len(dm_pool) + len(ip_pool)
-        ip_pool = sorted(list(set(ip_pool)))
-        dm_pool = optimize_domains(dm_pool)
-        
-        count_after = len(dm_pool) + len(ip_pool)
-        print(f"  -> 规则优化: {count_before} -> {count_after} (去重: {count_before - count_after})")
+            failed_critical = [rs['name'] for rs, content in zip(group_info['rulesets'], sources)
+                               if content is None and rs.get('critical')]
+            if failed_critical:
+                share_contents(group_info['rulesets'], sources, False)
+                kept = ('kept', failed_critical, old_entry if _previous_outputs_exist(old_entry, target_output_dir) else None)
+                if executor:
+                    pending.append((group_title, group_info, group_hash, kept))
+                else:
+                    finish_group(group_title, group_info, group_hash, kept)
+                continue
 
-        # 5. 输出决策
-        valid_outputs = [] 
-        total_count = len(dm_pool) + len(ip_pool)
-        
-        if dm_pool and not ip_pool:
-            valid_outputs.append({'type': 'domain', 'rules': dm_pool})
-        elif ip_pool and not dm_pool:
-            valid_outputs.append({'type': 'ipcidr', 'rules': ip_pool})
-        elif dm_pool and ip_pool and total_count > 1200:
-            valid_outputs.append({'type': 'domain', 'rules': dm_pool})
-            valid_outputs.append({'type': 'ipcidr', 'rules': ip_pool})
-        else: # 混合且少量 -> Classical
-            combined_rules = []
-            for d in dm_pool: combined_rules.append(format_for_classical(d, 'domain'))
-            for i in ip_pool: combined_rules.append(format_for_classical(i, 'ip'))
-            valid_outputs.append({'type': 'classical', 'rules': combined_rules})
-
-        # 6. 保存
-        type_suffixes = {'classical': '', 'domain': '_dm', 'ipcidr': '_ip'}
-        for out in valid_outputs:
-            r_type = out['type']
-            rules = out['rules']
-            
-            if len(valid_outputs) == 1:
-                out_name = group_name
+            sources = share_contents(group_info['rulesets'], sources, True)
+            sources.extend(s_rs['content'] for s_rs in group_supply)
+            task_args = (group_title, group_info, sources, len(group_supply), target_output_dir, generated_time, mrs)
+            if executor:
+                pending.append((group_title, group_info, group_hash, executor.submit(
+                    _process_group_task, task_args, instrumentation.enabled(), rendered is not None)))
             else:
-                suffix = type_suffixes.get(r_type, f"_{r_type}")
-                out_name = f"{group_name}{suffix}"
-            
-            file_path = os.path.join(target_output_dir, f"{out_name}.yaml")
-            
-            def finalize_fmt(rule, rt):
-                if rt == 'classical': return f"  - {rule}"
-                else: return f"  - '{rule}'"
+                finish_group(group_title, group_info, group_hash, (process_group(*task_args, rendered=rendered), None, None, None))
+            sources = task_args = None
 
-            header = f"# Ruleset Type:  {r_type}\n# Generated time: {generated_time}\n# Rule Count: {len(rules)}\npayload:\n"
-            content_payload = "\n".join([finalize_fmt(r, r_type) for r in rules])
-            
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(header + content_payload)
-            
-            final_output_info[out_name] = {"group_type": r_type, "rule_count": len(rules)}
+        for group_title, group_info, group_hash, result in pending:
+            if group_hash is not None and not isinstance(result, tuple):
+                result = result.result()
+            finish_group(group_title, group_info, group_hash, result)
+    finally:
+        if executor:
+            executor.shutdown()
 
     json_path = os.path.join(target_output_dir, 'rulesets.json')
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(final_output_info, f, ensure_ascii=False, indent=2)
+    rulesets_json = json.dumps(final_output_info, ensure_ascii=False, indent=2).encode('utf-8')
+    with open(json_path, 'wb') as f:
+        f.write(rulesets_json)
+    if rendered is not None:
+        rendered['rulesets.json'] = rulesets_json
+
+    manifest_path = os.path.join(target_output_dir, BUILD_MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(new_manifest, f, ensure_ascii=False, indent=2)
+
+    kept_note = f"，{kept_groups} 个规则组因关键源失败保留上次输出" if kept_groups else ""
+    print(f"\n全部完成！共生成 {len(final_output_info)} 个文件（{skipped_groups} 个规则组输入未变化，已跳过{kept_note}）。")
+    return final_output_info
+
+def merge_and_save_batch(builds, max_workers=FETCH_MAX_WORKERS, force=False, jobs=1, mrs=False, shard_size=0, fetch_budget=None):
+    """
+    批量构建多份配置（各自的补丁目录与输出目录）：
+    1. 汇总全部配置的上游源，每个 URL 只下载一次（下载选项按 collect_fetch_options 合并）。
+    2. 被多个规则组引用的内容通过 SourceStore 只清洗分类一次，再分发给各配置中引用它的规则组。
+    3. 依次对每份配置调用 merge_and_save_rulesets，写出各自的规则集、rulesets.json 与增量构建清单。
+    builds 为 [{'name', 'base_results', 'supply', 'output_dir'}]，返回 {name: rulesets.json 内容}。
+    """
+    all_rulesets = [rs for build in builds for group_info in build['base_results'].values() for rs in group_info['rulesets']]
+    all_urls = [rs['url'] for rs in all_rulesets]
+    budget_note = f", 时间预算: {fetch_budget}s" if fetch_budget else ""
+    print(f"\n[批量下载] {len(builds)} 份配置共引用 {len(all_urls)} 次上游源，去重后 {len(set(all_urls))} 个 (并发: {max_workers}{budget_note})")
+    fetched_contents = fetch_all_rulesets(all_urls, max_workers=max_workers,
+                                          options=collect_fetch_options(all_rulesets), budget=fetch_budget)
+    source_store = SourceStore(fetched_contents, all_urls)
+    print(f"[共享存储] {source_store.shared_count()} 份内容被多个规则组引用，只清洗一次")
 
-    print(f"\n全部完成！共生成 {len(final_output_info)} 个文件。")
-    return final_output_info
\ No newline at end of file
+    results = {}
+    for build in builds:
+        print(f"\n========== 配置: {build['name']} -> {build['output_dir']} ==========")
+        results[build['name']] = merge_and_save_rulesets(
+            build['base_results'], build.get('supply'), build['output_dir'], max_workers=max_workers,
+            force=force, jobs=jobs, mrs=mrs, shard_size=shard_size,
+            fetched_contents=fetched_contents, source_store=source_store
+        )
+    print(f"\n[共享存储] 清洗 {source_store.classified} 份共享内容，分发 {source_store.served} 次")
+    return results
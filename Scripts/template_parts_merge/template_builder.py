@@ -0,0 +1,372 @@
+import os
+import json
+from urllib.parse import urlparse
+
+from .. import project_paths
+from ..rulesets_merge import fast_yaml
+
+# 片段顺序：head -> dns -> sniffer -> strategy -> rules
+PART_PREFIXES = (
+    ('head', 'headpart_'),
+    ('dns', 'dnspart_'),
+    ('sniffer', 'snifferpart_'),
+    ('strategy', 'strategypart_'),
+    ('rules', 'rulespart_'),
+)
+# strategy 与 rules 为必填片段
+REQUIRED_PARTS = ('strategy', 'rules')
+
+GENERATED_DIR = 'Generated_rulesets'
+# list2yaml 的输出目录，其中的 .yaml 规则集存在同名 .mrs 时 provider 改用 mrs 格式
+CONVERTED_DIR = 'Converted_rulesets'
+GENERATED_URL_BASE = "https://cdn.jsdelivr.net/gh/JesterW365/Clash_Rulesets_Template@master/Generated_rulesets/"
+DEFAULT_INTERVAL = 86400
+# rule-providers 条目的输出键顺序，其余键按片段中的顺序排在其后
+PROVIDER_KEYS = ('type', 'behavior', 'format', 'url', 'path', 'interval')
+# 规则组按类型拆分后的输出后缀，与 rulesets_merge_tools.process_group 一致
+SPLIT_SUFFIXES = ('_dm', '_ip')
+# 无需在 proxy-groups 中定义的内置策略
+BUILTIN_POLICIES = {'DIRECT', 'REJECT', 'REJECT-DROP', 'PASS', 'COMPATIBLE'}
+# 逻辑规则的策略位置无法按逗号切分，不参与策略校验
+_LOGIC_RULES = {'AND', 'OR', 'NOT', 'SUB-RULE'}
+
+class PartCache:
+    """
+    片段缓存：按 (mtime, size) 判断文件是否变化，
+    一次运行构建多个模板时，共用的片段只读取、解析一次。
+    """
+    def __init__(self):
+        self._entries = {}
+
+    def _load(self, path):
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self._entries.get(path)
+        if entry is None or entry['stamp'] != stamp:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            entry = self._entries[path] = {'stamp': stamp, 'text': text, 'lines': None, 'data': None}
+        return entry
+
+    def lines(self, path):
+        """去除空行与注释行后的文本行（保留缩进，去除行尾空白）"""
+        entry = self._load(path)
+        if entry['lines'] is None:
+            entry['lines'] = [line.rstrip() for line in entry['text'].splitlines()
+                              if line.strip() and not line.strip().startswith('#')]
+        return entry['lines']
+
+    def data(self, path):
+        """解析后的 YAML 内容（只读，调用方不得修改）"""
+        entry = self._load(path)
+        if entry['data'] is None:
+            entry['data'] = fast_yaml.safe_load(entry['text']) or {}
+        return entry['data']
+
+PART_CACHE = PartCache()
+
+def load_rulesets_info(json_path):
+    """读取 Generated_rulesets/rulesets.json，文件不存在时返回 None"""
+    if not json_path or not os.path.isfile(json_path):
+        return None
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def resolve_part_files(parts_dir, parts):
+    """
+    按片段名称查找文件：返回 [(片段键, 文件路径或 None)]，顺序同 PART_PREFIXES。
+    名称为空或 none 表示不使用该片段；strategy / rules 必填，且有效片段至少 2 个。
+    """
+    if not os.path.exists(parts_dir):
+        raise FileNotFoundError(f"文件夹路径 '{parts_dir}' 不存在。")
+    found = []
+    for key, prefix in PART_PREFIXES:
+        name = (parts.get(key) or '').strip()
+        if not name or name.lower() == 'none':
+            if key in REQUIRED_PARTS:
+                raise ValueError(f"{key}_name 必须填写且不能为空或 none。")
+            found.append((key, None))
+            continue
+        filename = f"{prefix}{name}.yaml"
+        filepath = os.path.join(parts_dir, filename)
+        if not os.path.isfile(filepath):
+            raise FileNotFoundError(f"未找到片段文件 '{filename}'。")
+        found.append((key, filepath))
+
+    valid_parts_count = len([f for _, f in found if f is not None])
+    if valid_parts_count < 2:
+        raise ValueError(f"找到的有效片段数量为 {valid_parts_count}，合并至少需要 2 个片段。")
+    return found
+
+def _ruleset_name(url, dirname):
+    """URL 指向 dirname 目录下的 .yaml / .mrs 时返回规则集名，否则返回 None"""
+    head, _, filename = urlparse(url).path.rpartition('/')
+    stem, ext = os.path.splitext(filename)
+    if head.endswith('/' + dirname) and ext in ('.yaml', '.mrs'):
+        return stem
+    return None
+
+def _generated_name(url):
+    """URL 指向 Generated_rulesets 下的 .yaml / .mrs 时返回规则集名，否则返回 None"""
+    return _ruleset_name(url, GENERATED_DIR)
+
+def _converted_mrs(spec, converted_dir):
+    """
+    指向 Converted_rulesets 下 .yaml 的 domain / ipcidr provider，本地存在同名 .mrs 时
+    返回改用 mrs 格式的 provider（url / path 同步改为 .mrs），否则返回 None。
+    片段中已显式给出 format 的 provider 保持原样。
+    """
+    url = spec['url']
+    name = _ruleset_name(url, CONVERTED_DIR)
+    if (name is None or not url.endswith('.yaml') or 'format' in spec
+            or spec.get('behavior') not in ('domain', 'ipcidr')
+            or not os.path.isfile(os.path.join(converted_dir, f"{name}.mrs"))):
+        return None
+    spec = dict(spec)
+    spec['format'] = 'mrs'
+    spec['url'] = _replace_filename(url, f"{name}.mrs")
+    if spec.get('path'):
+        spec['path'] = os.path.splitext(spec['path'])[0] + '.mrs'
+    return spec
+
+def _replace_filename(value, filename):
+    head, sep, _ = value.rpartition('/')
+    return f"{head}{sep}{filename}"
+
+def _format_from_url(url):
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    return {'.mrs': 'mrs', '.txt': 'text', '.list': 'text'}.get(ext, 'yaml')
+
+def expand_output(out_name, rulesets_info, split=True):
+    """
+    规则集名 -> rulesets.json 中实际存在的输出名列表：存在时为其自身；
+    否则依次查找其分片（shard_of 为该名称，按 shard_index 排序）与 _dm / _ip 拆分（拆分后的输出可能再分片，但不会再次拆分）。
+    """
+    if out_name in rulesets_info:
+        return [out_name]
+    shards = [n for n, info in rulesets_info.items() if info.get('shard_of') == out_name]
+    if shards:
+        return sorted(shards, key=lambda n: rulesets_info[n].get('shard_index', 0))
+    targets = []
+    if split:
+        for suffix in SPLIT_SUFFIXES:
+            targets.extend(expand_output(out_name + suffix, rulesets_info, split=False))
+    return targets
+
+def _ordered_provider(entry):
+    ordered = {k: entry[k] for k in PROVIDER_KEYS if k in entry}
+    ordered.update((k, v) for k, v in entry.items() if k not in ordered)
+    return ordered
+
+def resolve_rule_providers(data, rulesets_info, prefer_mrs=True, converted_dir=project_paths.CONVERTED_DIR):
+    """
+    校验并补全 rulespart 的 rule-providers 与 rules：
+    1. 指向 Generated_rulesets 的 provider，其 behavior / format / url / path / interval 按 rulesets.json 生成；
+       片段中可只写 'name:' 或省略 url，此时按 provider 名在 rulesets.json 中查找。
+       规则集已分片或拆分为 _dm / _ip 时，provider 与引用它的 RULE-SET 规则同步展开（后者给出警告）。
+    2. 其余 provider 保留原样，仅补全 format（按 URL 扩展名）与 interval；
+       指向 Converted_rulesets 的 domain / ipcidr provider，在 converted_dir 中存在同名 .mrs 时改用 mrs 格式。
+    3. 每条 RULE-SET 必须引用已定义的 provider；mrs 格式不支持 classical。
+    返回 (providers, rules, warnings, errors)。
+    """
+    warnings, errors = [], []
+    providers = {}
+    expanded = {}       # 原 provider 名 -> 展开后的 provider 名列表
+    invalid = set()     # 已报告错误的 provider，引用处不再重复报告
+    referenced = set()  # 被 provider 引用的 rulesets.json 规则集
+
+    for name, spec in (data.get('rule-providers') or {}).items():
+        spec = dict(spec or {})
+        url = spec.get('url')
+        out_name = _generated_name(url) if url else name
+        if out_name is None or rulesets_info is None:
+            if not url:
+                errors.append(f"rule-providers.{name}: 缺少 url，且 rulesets.json 不可用，无法自动生成")
+                invalid.add(name)
+                continue
+            if prefer_mrs and url and converted_dir:
+                spec = _converted_mrs(spec, converted_dir) or spec
+                url = spec['url']
+            spec.setdefault('type', 'http')
+            spec.setdefault('format', _format_from_url(url))
+            spec.setdefault('interval', DEFAULT_INTERVAL)
+            if spec['format'] == 'mrs' and spec.get('behavior', 'classical') == 'classical':
+                errors.append(f"rule-providers.{name}: mrs 格式不支持 classical 规则集")
+            providers[name] = _ordered_provider(spec)
+            continue
+
+        outputs = expand_output(out_name, rulesets_info)
+        if not outputs:
+            errors.append(f"rule-providers.{name}: rulesets.json 中不存在规则集 '{out_name}'，模板已过期")
+            invalid.add(name)
+            continue
+        targets = [(name + target[len(out_name):], target) for target in outputs]
+        if outputs != [out_name]:
+            expanded[name] = [t for t, _ in targets]
+            if all(rulesets_info[t].get('shard_of') == out_name for t in outputs):
+                print(f"  -> rule-providers.{name}: 展开为 {len(outputs)} 个分片")
+            else:
+                warnings.append(f"rule-providers.{name}: 规则集 '{out_name}' 已拆分为 {', '.join(outputs)}，"
+                                f"已展开为 {', '.join(expanded[name])}")
+
+        for provider_name, target in targets:
+            referenced.add(target)
+            info = rulesets_info[target]
+            behavior = info.get('group_type')
+            if len(targets) == 1 and spec.get('behavior') and spec['behavior'] != behavior:
+                warnings.append(f"rule-providers.{provider_name}: behavior '{spec['behavior']}' 与 rulesets.json 中 "
+                                f"{target} 的 group_type '{behavior}' 不一致，已按 rulesets.json 修正")
+            fmt = 'mrs' if prefer_mrs and behavior != 'classical' and 'mrs' in (info.get('format') or ()) else 'yaml'
+            filename = f"{target}.{fmt}"
+            entry = dict(spec)
+            entry.setdefault('type', 'http')
+            entry['behavior'] = behavior
+            entry['format'] = fmt
+            entry['url'] = _replace_filename(url, filename) if url else GENERATED_URL_BASE + filename
+            if spec.get('path') and len(targets) == 1:
+                entry['path'] = os.path.splitext(spec['path'])[0] + f".{fmt}"
+            else:
+                entry['path'] = _replace_filename(spec.get('path') or './ruleset/', filename)
+            entry.setdefault('interval', DEFAULT_INTERVAL)
+            providers[provider_name] = _ordered_provider(entry)
+
+    rules = []
+    used = set()
+    for rule in data.get('rules') or []:
+        rule = str(rule)
+        parts = rule.split(',')
+        if len(parts) >= 3 and parts[0].strip().upper() == 'RULE-SET':
+            ref = parts[1].strip()
+            if ref in expanded:
+                for new_ref in expanded[ref]:
+                    rules.append(','.join([parts[0], new_ref] + parts[2:]))
+                    used.add(new_ref)
+                continue
+            if ref not in providers and ref not in invalid:
+                errors.append(f"rules: '{rule}' 引用了未定义的 rule-provider '{ref}'")
+            used.add(ref)
+        rules.append(rule)
+
+    for name in providers:
+        if name not in used:
+            warnings.append(f"rule-providers.{name}: 未被任何 RULE-SET 引用")
+    if rulesets_info is not None:
+        for name in rulesets_info:
+            if name not in referenced:
+                warnings.append(f"rulesets.json: 规则集 '{name}' 未被模板引用")
+    return providers, rules, warnings, errors
+
+def check_policies(rules, proxy_groups):
+    """规则的目标策略须为内置策略或 proxy-groups 中定义的策略组，返回警告列表"""
+    known = BUILTIN_POLICIES | {g.get('name') for g in proxy_groups or [] if isinstance(g, dict)}
+    warnings = []
+    for rule in rules:
+        parts = [p.strip() for p in rule.split(',')]
+        r_type = parts[0].upper()
+        if r_type in _LOGIC_RULES:
+            continue
+        policy = parts[1] if r_type == 'MATCH' and len(parts) >= 2 else parts[2] if len(parts) >= 3 else None
+        if policy is not None and policy not in known:
+            warnings.append(f"rules: '{rule}' 的策略 '{policy}' 未在 proxy-groups 中定义")
+    return warnings
+
+def _scalar(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str):
+        if value and value.strip() == value and not any(c in value for c in ':#{}[],&*!|>\'"%@`'):
+            return value
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+def _dump_block(value, indent):
+    dumped = fast_yaml.safe_dump(value, allow_unicode=True, sort_keys=False, default_flow_style=False)
+    return [' ' * indent + line for line in dumped.splitlines()]
+
+def render_rules_part(data, providers, rules):
+    """按片段的顶层键顺序输出 rules 片段：rule-providers 与 rules 使用补全后的内容，其余键原样序列化"""
+    lines = []
+    for key, value in data.items():
+        if key == 'rule-providers':
+            lines.append('rule-providers:')
+            for name, entry in providers.items():
+                lines.append(f"  {name}:")
+                for k, v in entry.items():
+                    if isinstance(v, (dict, list)):
+                        lines.append(f"    {k}:")
+                        lines.extend(_dump_block(v, 6))
+                    else:
+                        lines.append(f"    {k}: {_scalar(v)}")
+        elif key == 'rules':
+            lines.append('rules:')
+            lines.extend(f"  - {rule}" for rule in rules)
+        else:
+            lines.extend(_dump_block({key: value}, 0))
+    return lines
+
+def build_template(template_name, parts_dir, parts, rulesets_info=None, output_dir=None,
+                   prefer_mrs=True, strict=False, cache=PART_CACHE):
+    """
+    组装单个模板：
+    1. head / dns / sniffer / strategy 片段去除空行与注释后原样拼接；
+    2. rules 片段经 resolve_rule_providers 校验补全后重新输出，并校验规则策略是否已在 proxy-groups 中定义；
+    3. 存在错误（strict 时含警告）则抛出 ValueError，不写出模板。
+    输出到 output_dir（默认 parts_dir 的上级目录）下的 <template_name>.yaml，返回输出路径。
+    """
+    template_name = template_name.strip()
+    if not template_name:
+        raise ValueError("template_name 不能为空。")
+    found = resolve_part_files(parts_dir, parts)
+
+    lines, warnings, errors = [], [], []
+    strategy_path = dict(found).get('strategy')
+    for key, filepath in found:
+        if filepath is None:
+            continue
+        if key != 'rules':
+            lines.extend(cache.lines(filepath))
+            continue
+        data = cache.data(filepath)
+        providers, rules, part_warnings, part_errors = resolve_rule_providers(data, rulesets_info, prefer_mrs)
+        warnings.extend(part_warnings)
+        errors.extend(part_errors)
+        warnings.extend(check_policies(rules, cache.data(strategy_path).get('proxy-groups')))
+        lines.extend(render_rules_part(data, providers, rules))
+
+    for message in warnings:
+        print(f"  -> 警告: {message}")
+    if strict:
+        errors.extend(warnings)
+    if errors:
+        raise ValueError(f"模板 '{template_name}' 校验失败:\n" + '\n'.join(f"  - {e}" for e in errors))
+
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(parts_dir))
+    output_path = os.path.join(output_dir, f"{template_name}.yaml")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return output_path
+
+def build_variants(variants, parts_dir, rulesets_json=None, output_dir=None, prefer_mrs=True, strict=False, rulesets_info=None):
+    """
+    一次构建多个模板变体：variants 为 {模板名: {片段键: 片段名}}，
+    rulesets.json 只读取一次（rulesets_info 已给出时直接使用，不再读取文件），共用片段经 PART_CACHE 只解析一次。
+    单个模板失败不影响其余模板，返回 (成功的输出路径列表, {模板名: 错误信息})。
+    """
+    if rulesets_info is None:
+        rulesets_info = load_rulesets_info(rulesets_json)
+    if rulesets_info is None:
+        print(f"警告: 未找到 {rulesets_json}，跳过 rule-providers 与生成规则集的一致性校验")
+    built, failed = [], {}
+    for template_name, parts in variants.items():
+        print(f">>> 构建模板: {template_name}")
+        try:
+            output_path = build_template(template_name, parts_dir, parts or {}, rulesets_info,
+                                         output_dir, prefer_mrs, strict)
+        except (ValueError, FileNotFoundError) as e:
+            print(f"错误: {e}")
+            failed[template_name] = str(e)
+            continue
+        print(f"成功: 模板已生成并保存至 '{output_path}'")
+        built.append(output_path)
+    return built, failed
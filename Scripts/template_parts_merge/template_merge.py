@@ -1,99 +1,70 @@
 import os
 import sys
 
+if not __package__:
+    # 兼容直接以文件路径运行（python Scripts/template_parts_merge/template_merge.py，以及 spawn 方式启动的子进程重新导入主模块）：
+    # 登记项目根目录并按 PEP 366 指定所属包，使包内相对导入可用
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    __package__ = 'Scripts.template_parts_merge'
+
+from .. import project_paths
+from ..rulesets_merge import fast_yaml
+from .template_builder import GENERATED_DIR, build_template, build_variants, load_rulesets_info
+
 def merge_template(template_name, parts_dir, head_name, dns_name, sniffer_name=None, strategy_name='default', rules_name='default'):
     """
-    根据传入的 7 个参数合并模板片段。
+    根据传入的 7 个参数合并模板片段（单模板入口，实际组装与校验由 template_builder.build_template 完成）。
+    rulesets.json 取 parts_dir 所在项目的 Generated_rulesets/rulesets.json，不存在时跳过一致性校验。
     """
-    
-    # 1. 校验参数
-    template_name = template_name.strip()
-    parts_dir = parts_dir.strip()
-    head_name = head_name.strip() if head_name else None
-    dns_name = dns_name.strip() if dns_name else None
-    sniffer_name = sniffer_name.strip() if sniffer_name else None
-    strategy_name = strategy_name.strip()
-    rules_name = rules_name.strip()
-
-    # 必填项校验
-    if not template_name:
-        raise ValueError("template_name 不能为空。")
-    
-    if not strategy_name or strategy_name.lower() == 'none':
-        raise ValueError("strategy_name 必须填写且不能为空或 none。")
-        
-    if not rules_name or rules_name.lower() == 'none':
-        raise ValueError("rules_name 必须填写且不能为空或 none。")
+    parts = {
+        'head': head_name,
+        'dns': dns_name,
+        'sniffer': sniffer_name,
+        'strategy': strategy_name,
+        'rules': rules_name,
+    }
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(parts_dir.strip())))
+    rulesets_info = load_rulesets_info(os.path.join(project_root, GENERATED_DIR, 'rulesets.json'))
+    output_path = build_template(template_name, parts_dir.strip(), parts, rulesets_info)
+    print(f"成功: 模板已生成并保存至 '{output_path}'")
+    return output_path
 
-    if not os.path.exists(parts_dir):
-        raise FileNotFoundError(f"文件夹路径 '{parts_dir}' 不存在。")
+def load_variants(config_path):
+    """读取模板变体配置：{模板名: {head, dns, sniffer, strategy, rules}}"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        variants = fast_yaml.safe_load(f) or {}
+    if not isinstance(variants, dict):
+        raise ValueError(f"模板变体配置 '{config_path}' 格式错误，应为 模板名 -> 片段名称 的映射。")
+    return variants
 
-    # 2. 定义片段及其前缀
-    # 按照顺序排列：head -> dns -> sniffer -> strategy -> rules
-    parts_config = [
-        ('headpart_', head_name),
-        ('dnspart_', dns_name),
-        ('snifferpart_', sniffer_name),
-        ('strategypart_', strategy_name),
-        ('rulespart_', rules_name)
-    ]
+def main(argv=None, rulesets_info=None):
+    """
+    命令行入口（也供 Scripts/cli.py 的 template / all 子命令调用）。
+    rulesets_info 给出时直接使用（all 子命令传入本次合并的结果），不再读取 rulesets.json。
+    返回失败的模板数。
+    """
+    import argparse
 
-    found_files = []
-    
-    # 3. 检索文件并校验
-    for prefix, name in parts_config:
-        if not name or name.lower() == 'none':
-            found_files.append(None)
-            continue
-            
-        filename = f"{prefix}{name}.yaml"
-        filepath = os.path.join(parts_dir, filename)
-        
-        if os.path.isfile(filepath):
-            found_files.append(filepath)
-        else:
-            raise FileNotFoundError(f"未找到片段文件 '{filename}'。")
+    parser = argparse.ArgumentParser(description="按模板变体配置组装模板，并校验 rule-providers 与生成规则集的一致性")
+    parser.add_argument('--config', default=project_paths.TEMPLATES_CONFIG, help="模板变体配置路径")
+    parser.add_argument('--only', action='append', metavar='NAME', help="只构建指定模板（可重复）")
+    parser.add_argument('--no-mrs', action='store_true', help="生成规则集的 provider 始终使用 yaml 格式")
+    parser.add_argument('--strict', action='store_true', help="将警告视为错误")
+    args = parser.parse_args(argv)
 
-    # 统计有效片段数量
-    valid_parts_count = len([f for f in found_files if f is not None])
-    if valid_parts_count < 2:
-        raise ValueError(f"找到的有效片段数量为 {valid_parts_count}，合并至少需要 2 个片段。")
+    variants = load_variants(args.config)
+    if args.only:
+        missing = [name for name in args.only if name not in variants]
+        if missing:
+            print(f"错误: 配置中不存在模板 {', '.join(missing)}")
+            return len(missing)
+        variants = {name: variants[name] for name in args.only}
 
-    # 4. 执行拼接
-    parent_dir = os.path.dirname(os.path.abspath(parts_dir))
-    output_path = os.path.join(parent_dir, f"{template_name}.yaml")
-    
-    with open(output_path, 'w', encoding='utf-8') as outfile:
-        for i, filepath in enumerate(found_files):
-            if filepath is None:
-                continue
-            
-            prefix = parts_config[i][0]
-            
-            # 在 strategypart 之前插入注释
-            # if prefix == 'strategypart_':
-            #     outfile.write('# 这里插入节点信息\n')
-            
-            with open(filepath, 'r', encoding='utf-8') as infile:
-                for line in infile:
-                    stripped = line.strip()
-                    # 去除空行和注释行
-                    if not stripped or stripped.startswith('#'):
-                        continue
-                    outfile.write(line.rstrip() + '\n')
-        
-    print(f"成功: 模板已生成并保存至 '{output_path}'")
-    return output_path
+    rulesets_json = os.path.join(project_paths.GENERATED_DIR, 'rulesets.json')
+    built, failed = build_variants(variants, project_paths.PARTS_DIR, rulesets_json,
+                                   prefer_mrs=not args.no_mrs, strict=args.strict, rulesets_info=rulesets_info)
+    print(f"\n>>> 共 {len(variants)} 个模板，成功 {len(built)} 个，失败 {len(failed)} 个")
+    return len(failed)
 
 if __name__ == "__main__":
-    current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    project_root = os.path.dirname(current_dir)
-
-    name = "default_template"
-    parts_dir = os.path.join(project_root, 'Custom_templates', 'Parts')
-    head_name = "default"
-    dns_name = "default"
-    sniffer_name = "default"
-    strategy_name = "default"
-    rules_name = "default"
-    merge_template(name, parts_dir, head_name, dns_name, sniffer_name, strategy_name, rules_name)
+    sys.exit(1 if main() else 0)
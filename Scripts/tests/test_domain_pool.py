@@ -0,0 +1,63 @@
+import random
+
+from Scripts.rulesets_merge.domain_pool import DomainPool, optimize_domains
+
+_KINDS = (('+.', '+'), ('*.', '*'), ('.', '.'))
+
+def _split(rule):
+    d = rule.lower()
+    for prefix, kind in _KINDS:
+        if d.startswith(prefix):
+            return kind, d[len(prefix):]
+    return '', d
+
+def _covers(cover, target):
+    """逐条判断的覆盖语义：'+.x' 覆盖 x 与全部子域名，'.x' 覆盖全部子域名与同级 '*.x'，'*.x' 覆盖一级子域名"""
+    (c_kind, c_domain), (kind, domain) = cover, target
+    if cover == target:
+        return False
+    is_sub = domain.endswith('.' + c_domain)
+    if c_kind == '+':
+        return domain == c_domain or is_sub
+    if c_kind == '.':
+        return is_sub or (domain == c_domain and kind == '*')
+    if c_kind == '*':
+        return kind == '' and domain.partition('.')[2] == c_domain
+    return False
+
+def naive_optimize(rules):
+    chosen = {}
+    for rule in rules:
+        key = _split(rule)
+        if key not in chosen or rule < chosen[key]:
+            chosen[key] = rule
+    return sorted(rule for key, rule in chosen.items() if not any(_covers(other, key) for other in chosen))
+
+def _random_rules(rng, count):
+    labels = ['a', 'b', 'cd', 'Cd', 'x-y']
+    rules = []
+    for _ in range(count):
+        name = '.'.join(rng.choice(labels) for _ in range(rng.randint(1, 3))) + rng.choice(['.com', '.org'])
+        rules.append(rng.choice(['', '', '+.', '.', '*.']) + name)
+    return rules
+
+def test_matches_naive_reference():
+    rng = random.Random(20260101)
+    for _ in range(200):
+        rules = _random_rules(rng, rng.randint(0, 40))
+        assert optimize_domains(rules) == naive_optimize(rules), rules
+
+def test_chunked_pool_matches_single_chunk():
+    rng = random.Random(7)
+    rules = _random_rules(rng, 500)
+    pool = DomainPool(chunk_size=16)
+    for rule in rules:
+        pool.add(rule)
+    assert pool.optimize() == naive_optimize(rules)
+    assert pool.unique_count == len(set(rules))
+
+def test_examples():
+    assert optimize_domains(['+.example.com', 'www.example.com', 'example.com', '.a.example.com']) == ['+.example.com']
+    assert optimize_domains(['.example.com', '*.example.com', 'example.com', 'a.example.com']) == ['.example.com', 'example.com']
+    assert optimize_domains(['*.example.com', 'a.example.com', 'a.b.example.com']) == ['*.example.com', 'a.b.example.com']
+    assert optimize_domains(['Example.com', 'example.com', 'EXAMPLE.com']) == ['EXAMPLE.com']
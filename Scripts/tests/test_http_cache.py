@@ -0,0 +1,76 @@
+import pytest
+
+from Scripts.rulesets_merge import http_cache
+
+BODY = bytes(range(256)) * 1024
+STREAM_ERROR = http_cache._stream_errors()[0]
+RESUMABLE = {'ETag': '"v1"', 'Accept-Ranges': 'bytes'}
+
+class FakeResponse:
+    """按块产出内容，cut_at 给出时读到该字节数后模拟连接中断"""
+    def __init__(self, status_code, body, headers=None, cut_at=None):
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+        self.encoding = None
+        self._body = body
+        self._cut_at = cut_at
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        end = len(self._body) if self._cut_at is None else self._cut_at
+        for start in range(0, end, chunk_size):
+            yield self._body[start:min(start + chunk_size, end)]
+        if self._cut_at is not None:
+            raise STREAM_ERROR("connection reset")
+
+    def close(self):
+        self.closed = True
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None, stream=False):
+        self.requests.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+def test_truncated_stream_resumes_with_206():
+    cut = 100000
+    first = FakeResponse(200, BODY, RESUMABLE, cut_at=cut)
+    session = FakeSession([FakeResponse(206, BODY[cut:])])
+    body, full = http_cache._read_stream(session, 'https://example.com/a', first, timeout=5)
+    assert body == BODY
+    assert full is first
+    assert first.closed
+    assert session.requests == [{'Range': f"bytes={cut}-", 'If-Range': '"v1"', 'Accept-Encoding': 'identity'}]
+
+def test_resume_restarts_on_200():
+    first = FakeResponse(200, b'old' * 1000, RESUMABLE, cut_at=1000)
+    fresh = FakeResponse(200, BODY, {'ETag': '"v2"'})
+    body, full = http_cache._read_stream(FakeSession([fresh]), 'https://example.com/a', first, timeout=5)
+    assert body == BODY
+    assert full is fresh
+
+def test_not_resumable_without_accept_ranges():
+    first = FakeResponse(200, BODY, {'ETag': '"v1"'}, cut_at=1000)
+    session = FakeSession([])
+    with pytest.raises(STREAM_ERROR):
+        http_cache._read_stream(session, 'https://example.com/a', first, timeout=5)
+    assert session.requests == []
+
+def test_resume_attempts_limited():
+    cut = 1000
+    first = FakeResponse(200, BODY, RESUMABLE, cut_at=cut)
+    session = FakeSession([FakeResponse(206, BODY[cut:], cut_at=10)])
+    with pytest.raises(STREAM_ERROR):
+        http_cache._read_stream(session, 'https://example.com/a', first, timeout=5, resume_attempts=1)
+
+def test_cached_get_stores_resumed_body(tmp_path):
+    cut = 70000
+    session = FakeSession([FakeResponse(200, BODY, RESUMABLE, cut_at=cut), FakeResponse(206, BODY[cut:])])
+    status, body, _ = http_cache.cached_get(session, 'https://example.com/a', timeout=5, cache_dir=str(tmp_path))
+    assert (status, body) == (200, BODY)
+    meta, cached = http_cache.load_cache_entry('https://example.com/a', str(tmp_path))
+    assert cached == BODY
+    assert meta['etag'] == '"v1"'
@@ -0,0 +1,44 @@
+import ipaddress
+import random
+
+from Scripts.rulesets_merge.ip_ranges import optimize_ips, parse_ip_range
+
+def reference_optimize(rules):
+    """标准库参考实现：ip_network(strict=False) 归一化后按地址族 collapse_addresses"""
+    networks = {4: [], 6: []}
+    for rule in rules:
+        try:
+            network = ipaddress.ip_network(rule.strip(), strict=False)
+        except ValueError:
+            continue
+        networks[network.version].append(network)
+    return [str(n) for version in (4, 6) for n in ipaddress.collapse_addresses(networks[version])]
+
+def _random_v4(rng):
+    # 限定在少数 /16 内，使区间频繁重叠与相邻
+    base = rng.choice([0x0A000000, 0xC0A80000, 0x01020000])
+    prefix = rng.randint(16, 32)
+    address = ipaddress.IPv4Address(base | rng.getrandbits(16))
+    return f"{address}/{prefix}" if rng.random() < 0.8 else str(address)
+
+def _random_v6(rng):
+    base = rng.choice([0x20010db8 << 96, 0xfe80 << 112])
+    prefix = rng.randint(32, 128)
+    address = ipaddress.IPv6Address(base | (rng.getrandbits(16) << 80) | rng.getrandbits(8))
+    return f"{address}/{prefix}" if rng.random() < 0.8 else str(address)
+
+def test_matches_collapse_addresses():
+    rng = random.Random(20260101)
+    for _ in range(300):
+        rules = [(_random_v4 if rng.random() < 0.6 else _random_v6)(rng) for _ in range(rng.randint(0, 30))]
+        assert optimize_ips(rules) == reference_optimize(rules), rules
+
+def test_invalid_rules_dropped():
+    rules = ['10.0.0.0/25', '10.0.0.128/25', 'not-an-ip', '1.2.3.4/33', '::1/129', ' 2001:db8::1/64 ']
+    assert optimize_ips(rules) == ['10.0.0.0/24', '2001:db8::/64']
+    assert optimize_ips(rules) == reference_optimize(rules)
+
+def test_parse_ip_range_normalises_host_bits():
+    assert parse_ip_range('10.1.2.3/8') == (4, 0x0A000000, 0x0AFFFFFF)
+    assert parse_ip_range('::/0') == (6, 0, (1 << 128) - 1)
+    assert parse_ip_range('1.2.3') is None
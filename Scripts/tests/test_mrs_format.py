@@ -0,0 +1,41 @@
+import pytest
+
+from Scripts.rulesets_merge import mrs_format
+
+def test_domain_round_trip():
+    rules = ['+.example.com', '.sub.example.org', '*.wild.net', 'exact.io', '*.example.org', 'a.b.c.d']
+    behavior, count, decoded = mrs_format.decode_mrs(mrs_format.encode_mrs('domain', rules))
+    assert behavior == 'domain'
+    assert count == len(rules)
+    assert decoded == sorted(rules)
+
+def test_domain_plain_and_dot_merge_to_plus():
+    # 'x' 与 '.x' 在字典树中的键与 '+.x' 相同，解码后合并为 '+.x'
+    _, _, decoded = mrs_format.decode_mrs(mrs_format.encode_mrs('domain', ['example.com', '.example.com']))
+    assert decoded == ['+.example.com']
+
+def test_domain_empty():
+    assert mrs_format.decode_mrs(mrs_format.encode_mrs('domain', [])) == ('domain', 0, [])
+
+def test_ipcidr_round_trip():
+    rules = ['1.2.3.0/24', '10.0.0.0/8', '192.168.1.1/32', '2001:db8::/32', '::1/128']
+    behavior, count, decoded = mrs_format.decode_mrs(mrs_format.encode_mrs('ipcidr', rules))
+    assert behavior == 'ipcidr'
+    assert count == len(rules)
+    assert sorted(decoded) == sorted(rules)
+
+def test_ipcidr_adjacent_ranges_merge():
+    # 相邻网段在 MRS 中按区间存储，解码后还原为最少的 CIDR
+    _, _, decoded = mrs_format.decode_mrs(mrs_format.encode_mrs('ipcidr', ['10.0.0.0/25', '10.0.0.128/25']))
+    assert decoded == ['10.0.0.0/24']
+
+def test_invalid_magic():
+    with pytest.raises(ValueError):
+        mrs_format.decode_mrs(b'XXXX')
+
+@pytest.mark.skipif(not mrs_format.mrs_available(), reason="zstandard 未安装")
+def test_write_read_file(tmp_path):
+    path = tmp_path / 'set.mrs'
+    rules = ['+.example.com', '*.example.net']
+    assert mrs_format.write_mrs(str(path), 'domain', rules) == path.read_bytes()
+    assert mrs_format.read_mrs(str(path)) == ('domain', 2, sorted(rules))
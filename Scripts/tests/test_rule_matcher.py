@@ -0,0 +1,31 @@
+from Scripts.rulesets_merge.rule_matcher import RuleMatcher
+
+def _matcher(tmp_path, behavior, payload, inline=()):
+    path = tmp_path / 'set.yaml'
+    path.write_text('payload:\n' + ''.join(f"  - '{p}'\n" for p in payload), encoding='utf-8')
+    matcher = RuleMatcher()
+    for r_type, value, policy in inline:
+        matcher._add_rule(r_type, value, policy, None, f"{r_type},{value},{policy}")
+    matcher.add_provider_rules('set', behavior, str(path), 'PROXY')
+    return matcher.build()
+
+def test_classical_domain_is_literal(tmp_path):
+    matcher = _matcher(tmp_path, 'classical', ['DOMAIN,*.example.com', 'DOMAIN,.example.org', 'DOMAIN,Exact.io'])
+    assert matcher.match('a.example.com').policy is None
+    assert matcher.match('a.example.org').policy is None
+    assert matcher.match('exact.io').policy == 'PROXY'
+    assert matcher.match('a.exact.io').policy is None
+
+def test_domain_behavior_wildcards(tmp_path):
+    matcher = _matcher(tmp_path, 'domain', ['*.example.com', '.example.org', '+.example.net', 'exact.io'])
+    assert matcher.match('a.example.com').policy == 'PROXY'
+    assert matcher.match('a.b.example.com').policy is None
+    assert matcher.match('a.b.example.org').policy == 'PROXY'
+    assert matcher.match('example.org').policy is None
+    assert matcher.match('example.net').policy == 'PROXY'
+    assert matcher.match('a.exact.io').policy is None
+
+def test_inline_rules_take_priority(tmp_path):
+    matcher = _matcher(tmp_path, 'domain', ['+.example.com'], inline=[('DOMAIN-SUFFIX', 'a.example.com', 'DIRECT')])
+    assert matcher.match('x.a.example.com').policy == 'DIRECT'
+    assert matcher.match('b.example.com').policy == 'PROXY'
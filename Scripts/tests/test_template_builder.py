@@ -0,0 +1,29 @@
+from Scripts.template_parts_merge import template_builder
+
+CONVERTED_URL = "https://cdn.jsdelivr.net/gh/o/r@master/SRC_rulesets/Forked_rulesets/Converted_rulesets/"
+
+def _resolve(providers, converted_dir, prefer_mrs=True):
+    data = {'rule-providers': providers, 'rules': [f"RULE-SET,{name},DIRECT" for name in providers]}
+    resolved, _, _, errors = template_builder.resolve_rule_providers(data, None, prefer_mrs, str(converted_dir))
+    assert errors == []
+    return resolved
+
+def test_converted_provider_uses_mrs_when_present(tmp_path):
+    (tmp_path / 'cn.mrs').write_bytes(b'')
+    resolved = _resolve({
+        'cn': {'behavior': 'domain', 'url': CONVERTED_URL + 'cn.yaml', 'path': './ruleset/cndm.yaml'},
+        'private': {'behavior': 'domain', 'url': CONVERTED_URL + 'private.yaml', 'path': './ruleset/private.yaml'},
+    }, tmp_path)
+    assert resolved['cn']['format'] == 'mrs'
+    assert resolved['cn']['url'] == CONVERTED_URL + 'cn.mrs'
+    assert resolved['cn']['path'] == './ruleset/cndm.mrs'
+    # 没有同名 .mrs 时保持 yaml
+    assert resolved['private']['format'] == 'yaml'
+    assert resolved['private']['url'] == CONVERTED_URL + 'private.yaml'
+
+def test_converted_provider_keeps_yaml(tmp_path):
+    (tmp_path / 'cn.mrs').write_bytes(b'')
+    spec = {'behavior': 'domain', 'url': CONVERTED_URL + 'cn.yaml'}
+    assert _resolve({'cn': spec}, tmp_path, prefer_mrs=False)['cn']['format'] == 'yaml'
+    assert _resolve({'cn': dict(spec, format='yaml')}, tmp_path)['cn']['format'] == 'yaml'
+    assert _resolve({'cn': dict(spec, behavior='classical')}, tmp_path)['cn']['format'] == 'yaml'